@@ -0,0 +1,218 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Lossless archive of every track, encoded while the CD burns
+
+Each track is read straight from its (memory-mapped) capture file
+using the track intervals from the session, and encoded on its own
+by a pool of worker processes, so archiving runs alongside cdrecord
+instead of after it.  A manifest.json next to the encoded tracks
+records each track's number, side, offsets, segmentation confidence,
+gain, and a SHA-1 of its PCM data (so the archive can be checked
+later).
+
+Encoders (both work offline):
+'flac' -- the flac command-line encoder, fed raw PCM on stdin
+'zlib' -- built-in fallback: per-chunk first differences (16-bit,
+wrapping), deflated with zlib, in a small .trz container (see
+decodeZlib)
+"""
+import distutils.spawn
+import hashlib
+import json
+import multiprocessing
+import os, os.path
+import struct
+import subprocess
+import time
+import zlib
+
+import numpy as NP
+
+import WavFile
+
+# File extension of each encoder's output
+extensions = {'flac' : '.flac', 'zlib' : '.trz'}
+# .trz header: magic, channels, rate, nframes
+trzmagic = b'TRZ1'
+trzheader = '<4sHIQ'
+
+def defaultEncoder():
+    """ flac if it is installed, otherwise the built-in encoder """
+    if(distutils.spawn.find_executable('flac') != None):
+        return 'flac'
+    return 'zlib'
+
+def pcmChunks(frames, chunkframes=262144):
+    """ Contiguous 16-bit chunks of frames (e.g. a memmap slice) """
+    for i in range(0,len(frames),chunkframes):
+        yield NP.ascontiguousarray(frames[i:i+chunkframes],'<i2')
+
+def encodeFlac(frames, fn, rate, tags):
+    """ Encode frames with flac (raw PCM piped to stdin) """
+    cmd = ['flac','--silent','--force-raw-format','--endian=little',
+           '--sign=signed','--channels=%d' % frames.shape[1],'--bps=16',
+           '--sample-rate=%d' % rate]
+    for (name,value) in sorted(tags.items()):
+        cmd += ['-T','%s=%s' % (name.upper(),value)]
+    cmd += ['-o',fn,'-']
+    proc = subprocess.Popen(cmd,stdin=subprocess.PIPE)
+    h = hashlib.sha1()
+    for chunk in pcmChunks(frames):
+        data = chunk.tostring()
+        h.update(data)
+        proc.stdin.write(data)
+    proc.stdin.close()
+    if(proc.wait() != 0):
+        raise IOError('flac failed on %s (%d)' % (fn,proc.returncode))
+    return h.hexdigest()
+
+def encodeZlib(frames, fn, rate, tags):
+    """ Encode frames in the built-in .trz format """
+    h = hashlib.sha1()
+    f = open(fn,'wb')
+    f.write(struct.pack(trzheader,trzmagic,frames.shape[1],rate,len(frames)))
+    for chunk in pcmChunks(frames):
+        h.update(chunk.tostring())
+        # (differences wrap around in 16 bits, which cumsum undoes)
+        diff = chunk.copy()
+        diff[1:] -= chunk[:-1]
+        data = zlib.compress(diff.T.tostring(),6)
+        f.write(struct.pack('<II',len(chunk),len(data)))
+        f.write(data)
+    f.close()
+    return h.hexdigest()
+
+def decodeZlib(fn):
+    """ Return (rate, frames) of a .trz file """
+    f = open(fn,'rb')
+    (magic,channels,rate,nframes) = struct.unpack(
+        trzheader,f.read(struct.calcsize(trzheader)))
+    if(magic != trzmagic):
+        raise ValueError('%s is not a .trz file' % fn)
+    chunks = []
+    while(True):
+        head = f.read(8)
+        if(len(head) < 8):
+            break
+        (n,size) = struct.unpack('<II',head)
+        diff = NP.frombuffer(zlib.decompress(f.read(size)),'<i2')
+        chunks.append(NP.cumsum(diff.reshape((channels,n)).T,axis=0,
+                                dtype='<i2'))
+    f.close()
+    if(len(chunks) == 0):
+        return (rate,NP.zeros((0,channels),'<i2'))
+    return (rate,NP.concatenate(chunks))
+
+encoders = {'flac' : encodeFlac, 'zlib' : encodeZlib}
+
+def encodeTrack(job):
+    """
+    Encode one track (worker process side)
+
+    job -- dict of capture, start, end, fn, encoder, tags
+
+    Return dict of file, bytes, sha1 (of the PCM data), seconds
+    """
+    start = time.time()
+    (rate,frames) = WavFile.mapWav(job['capture'])
+    (s,e) = (job['start'],min(job['end'],len(frames)))
+    sha1 = encoders[job['encoder']](frames[s:e],job['fn'],rate,job['tags'])
+    return {'file' : os.path.basename(job['fn']),
+            'bytes' : os.path.getsize(job['fn']),
+            'sha1' : sha1,
+            'seconds' : time.time() - start}
+
+class TapeArchive:
+    """
+    Encode all tracks of a session's sides into outdir, on a pool
+    of worker processes (start() returns right away)
+    """
+
+    def __init__(self, sides, outdir, encoder=None, processes=None):
+        # (sides as in Session.TapeSession)
+        self.sides = sides
+        self.outdir = outdir
+        self.encoder = encoder or defaultEncoder()
+        self.processes = processes
+        self.pool = None
+        self.pending = None
+        self.tracks = None
+        self.manifestfn = None
+
+    def start(self):
+        if(not os.path.isdir(self.outdir)):
+            os.makedirs(self.outdir)
+        self.tracks = self.trackList()
+        jobs = [track.pop('job') for track in self.tracks]
+        self.pool = multiprocessing.Pool(self.processes)
+        self.pending = self.pool.map_async(encodeTrack,jobs,chunksize=1)
+        self.pool.close()
+
+    def trackList(self):
+        """ Manifest entry (and encoding job) for every track """
+        tracks = []
+        for (sidenum,side) in enumerate(self.sides):
+            rate = WavFile.readWavHeader(side['capture'])[1]
+            confidence = side.get('confidence',
+                                  [None] * len(side['intervals']))
+            gains = side.get('gains',[1.0] * len(side['intervals']))
+            for (i,(start,end)) in enumerate(side['intervals']):
+                tracknum = len(tracks) + 1
+                fn = os.path.join(self.outdir,'track%02d%s' %
+                                  (tracknum,extensions[self.encoder]))
+                tags = {'tracknumber' : tracknum,
+                        'side' : sidenum + 1}
+                tracks.append({'track' : tracknum,
+                               'side' : sidenum + 1,
+                               'capture' : os.path.basename(side['capture']),
+                               'mode' : side['mode'],
+                               'start' : start,
+                               'end' : end,
+                               'startsec' : start / float(rate),
+                               'endsec' : end / float(rate),
+                               'confidence' : confidence[i],
+                               'gain' : gains[i],
+                               'job' : {'capture' : side['capture'],
+                                        'start' : start, 'end' : end,
+                                        'fn' : fn,
+                                        'encoder' : self.encoder,
+                                        'tags' : tags}})
+        return tracks
+
+    def finished(self):
+        return self.pending != None and self.pending.ready()
+
+    def wait(self):
+        """
+        Block until every track is encoded, write the manifest,
+        return its filename (raises if any track failed)
+        """
+        if(self.manifestfn != None):
+            return self.manifestfn
+        try:
+            encoded = self.pending.get()
+        finally:
+            self.pool.join()
+        for (track,result) in zip(self.tracks,encoded):
+            track.update(result)
+        manifestfn = os.path.join(self.outdir,'manifest.json')
+        tmpfn = manifestfn + '.tmp'
+        f = open(tmpfn,'w')
+        json.dump({'created' : time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'encoder' : self.encoder,
+                   'tracks' : self.tracks},f,indent=2)
+        f.close()
+        os.rename(tmpfn,manifestfn)
+        self.manifestfn = manifestfn
+        return manifestfn
+
+    def stop(self):
+        """ Give up on any tracks not encoded yet """
+        if(self.pool != None):
+            self.pool.terminate()
+            self.pool.join()
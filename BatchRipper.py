@@ -0,0 +1,246 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Headless batch mode: segment and export a set of already-digitized
+tape captures (16-bit PCM WAV files), spread over a pool of worker
+processes.  Nothing here imports Tkinter or tkSnack.
+
+USAGE
+
+python BatchRipper.py [options] capture1.wav capture2.wav ...
+
+For each capture, the tracks found are written to
+<outdir>/<capture name>/trackNN.wav (or, with --cue, described by
+<outdir>/<capture name>.cue pointing at a CD image
+<outdir>/<capture name>.wav: the capture up to the end of its last
+track, normalized too with --normalize), and
+a JSON summary of all track boundaries and per-stage timings is
+written to <outdir>/summary.json
+"""
+import json
+import multiprocessing
+import optparse
+import os, os.path
+import sys
+import time
+
+import numpy as NP
+
+import CDImage
+import Features
+import Instrument
+import Normalize
+import SegmentCache
+import Segmentor
+import WavFile
+
+def ripFile(fn, outdir, mode='music', subrate=20000, cue=False,
+            refine=True, cachedir=None, normalize=False, features=False,
+            mintrack=None, mingap=None):
+    """
+    Segment a single capture and export its tracks
+
+    cachedir -- if given, reuse envelopes / decoded tracks from
+    earlier runs on the same capture (see SegmentCache)
+    normalize -- even out track levels and fade track ends while
+    exporting (see Normalize)
+    features -- find music tracks from spectral features rather
+    than the amplitude envelope alone (see Features)
+    mintrack, mingap -- if given, shortest track / gap (in seconds)
+    when splitting music tracks (see Segmentor.durationTracks)
+
+    Return summary dict for this file (never raises, errors are
+    reported in the 'error' entry so one bad file doesn't stop
+    the batch)
+    """
+    summary = {'file' : fn, 'mode' : mode, 'subrate' : subrate}
+    timings = {}
+    try:
+        # Envelope
+        start = time.time()
+        (rate,frames) = WavFile.mapWav(fn)
+        if(cachedir != None):
+            cache = SegmentCache.SegmentCache(cachedir)
+            samps = cache.envelope(fn,subrate)
+        else:
+            samps = Segmentor.getMonoAmpSamples(fn,subrate)
+        timings['envelope'] = time.time() - start
+        # Segmentation
+        start = time.time()
+        if(mode == 'voice' and cachedir != None):
+            intervals = cache.voiceIntervals(samps) * subrate
+        elif(mode == 'voice'):
+            intervals = Segmentor.voiceIntervals(samps) * subrate
+        else:
+            if(features):
+                assign = Features.decodeFeatureTracks(
+                    Features.getFeatures(fn,subrate))
+            elif(mintrack != None or mingap != None):
+                blocks = [1 if sec == None else
+                          max(1,int(NP.ceil(sec * rate / subrate)))
+                          for sec in [mintrack,mingap]]
+                assign = Segmentor.durationTracks(samps,*blocks)
+            elif(cachedir != None):
+                assign = cache.decoded(samps)
+            else:
+                assign = Segmentor.decodeTracks(samps)
+            intervals = Segmentor.splitTrackIntervals(assign) * subrate
+        timings['segment'] = time.time() - start
+        # Sample-accurate cut points
+        start = time.time()
+        if(refine and mode != 'voice'):
+            intervals = Segmentor.refineTracks(frames,assign,subrate)
+        timings['refine'] = time.time() - start
+        # Export
+        start = time.time()
+        name = os.path.splitext(os.path.basename(fn))[0]
+        tracks = []
+        if(normalize):
+            gains = Normalize.trackGains(samps,intervals,subrate)
+            fadeframes = Normalize.fadeFrames(rate)
+        else:
+            gains = NP.ones((len(intervals),))
+        if(cue):
+            # (cdrecord burns the whole file, so the cue sheet points
+            # at a copy ending with the last track)
+            starts = CDImage.trackStarts(intervals)
+            end = CDImage.trackEnd(intervals)
+            ends = starts[1:] + [end]
+            if(normalize):
+                chunks = Normalize.captureChunks(frames[:end],intervals,
+                                                 gains,fadeframes)
+            else:
+                chunks = CDImage.frameChunks(frames[:end])
+            imagefn = os.path.join(outdir,name + '.wav')
+            CDImage.writeImage(imagefn,[(chunks,starts,end)],
+                               frames.shape[1],rate)
+            CDImage.writeCueSheet(os.path.join(outdir,name + '.cue'),
+                                  imagefn,starts)
+            tracks = [{'start' : s, 'end' : e} for (s,e) in zip(starts,ends)]
+        else:
+            trackdir = os.path.join(outdir,name)
+            if(not os.path.isdir(trackdir)):
+                os.makedirs(trackdir)
+            for (tracknum,(tstart,tend)) in enumerate(intervals):
+                (tstart,tend) = (int(tstart),int(min(tend,len(frames))))
+                trackfn = os.path.join(trackdir,'track%02d.wav' % tracknum)
+                if(normalize):
+                    Normalize.writeTrack(frames[tstart:tend],trackfn,rate,
+                                         gains[tracknum],fadeframes)
+                else:
+                    WavFile.copyFrames(frames[tstart:tend],trackfn,rate)
+                tracks.append({'start' : tstart,
+                               'end' : tend,
+                               'file' : trackfn})
+        timings['export'] = time.time() - start
+        for (track,gain) in zip(tracks,gains):
+            track['startsec'] = track['start'] / float(rate)
+            track['endsec'] = track['end'] / float(rate)
+            track['gain'] = float(gain)
+        summary['rate'] = rate
+        summary['frames'] = len(frames)
+        summary['tracks'] = tracks
+    except Exception, e:
+        summary['error'] = '%s: %s' % (e.__class__.__name__,e)
+    summary['timings'] = timings
+    return summary
+
+def ripFileArgs(args):
+    """ (Pool.map only passes a single argument) """
+    return ripFile(*args)
+
+def ripBatch(fns, outdir, mode='music', subrate=20000, cue=False,
+             refine=True, processes=None, logfn=None, cachedir=None,
+             normalize=False, features=False, mintrack=None, mingap=None):
+    """
+    Rip a List of capture files across a pool of worker processes
+    (processes=None means one per CPU, 1 means no pool at all)
+
+    logfn -- if given, every process appends per-stage Instrument
+    records to this JSON-lines file
+    cachedir -- shared SegmentCache directory (or None)
+    normalize -- even out track levels (see ripFile)
+    features -- segment music using spectral features (see ripFile)
+    mintrack, mingap -- shortest track / gap in seconds (see ripFile)
+
+    Return summary dict, also written to <outdir>/summary.json
+    """
+    if(not os.path.isdir(outdir)):
+        os.makedirs(outdir)
+    start = time.time()
+    jobs = [(fn,outdir,mode,subrate,cue,refine,cachedir,normalize,features,
+             mintrack,mingap) for fn in fns]
+    if(processes == 1):
+        if(logfn != None):
+            Instrument.enable(logfn)
+        try:
+            files = [ripFileArgs(job) for job in jobs]
+        finally:
+            Instrument.disable()
+    else:
+        if(logfn != None):
+            pool = multiprocessing.Pool(processes,Instrument.enable,(logfn,))
+        else:
+            pool = multiprocessing.Pool(processes)
+        try:
+            files = pool.map(ripFileArgs,jobs,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    summary = {'files' : files, 'elapsed' : time.time() - start}
+    f = open(os.path.join(outdir,'summary.json'),'w')
+    json.dump(summary,f,indent=2)
+    f.close()
+    return summary
+
+def main(argv):
+    parser = optparse.OptionParser(
+        usage='%prog [options] capture1.wav capture2.wav ...')
+    parser.add_option('-o','--outdir',default='ripped',
+                      help='output directory [%default]')
+    parser.add_option('-m','--mode',choices=['music','voice'],
+                      default='music',
+                      help='music (split tracks) or voice (single '
+                      'track) [%default]')
+    parser.add_option('-s','--subrate',type='int',default=20000,
+                      help='samples per envelope block [%default]')
+    parser.add_option('-j','--processes',type='int',default=None,
+                      help='worker processes [one per CPU]')
+    parser.add_option('--cue',action='store_true',default=False,
+                      help='write cue sheets instead of track WAVs')
+    parser.add_option('--no-refine',action='store_false',dest='refine',
+                      default=True,
+                      help='keep coarse (subrate) track boundaries')
+    parser.add_option('--log',default=None,metavar='FILE',
+                      help='append per-stage timings to FILE (JSON lines)')
+    parser.add_option('--cache',default=None,metavar='DIR',
+                      help='reuse envelopes / decoded tracks cached in DIR')
+    parser.add_option('--normalize',action='store_true',default=False,
+                      help='even out track levels and fade track ends')
+    parser.add_option('--features',action='store_true',default=False,
+                      help='find music tracks from spectral features '
+                      '(hiss / hum / quiet intros)')
+    parser.add_option('--min-track',type='float',default=None,
+                      dest='mintrack',metavar='SEC',
+                      help='never split off music tracks shorter than SEC')
+    parser.add_option('--min-gap',type='float',default=None,
+                      dest='mingap',metavar='SEC',
+                      help='ignore gaps between tracks shorter than SEC')
+    (options,fns) = parser.parse_args(argv)
+    if(len(fns) == 0):
+        parser.error('no capture files given')
+    summary = ripBatch(fns,options.outdir,options.mode,options.subrate,
+                       options.cue,options.refine,options.processes,
+                       options.log,options.cache,options.normalize,
+                       options.features,options.mintrack,options.mingap)
+    failed = [f for f in summary['files'] if 'error' in f]
+    for f in failed:
+        sys.stderr.write('%s: %s\n' % (f['file'],f['error']))
+    return 1 if len(failed) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
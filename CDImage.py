@@ -0,0 +1,473 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Burn a CD from the capture file(s) using a cue sheet
+
+Instead of copying every track out to its own WAV file, describe the
+track boundaries (from Segmentor.refineTracks etc.) in a CDRWIN-style
+cue sheet pointing at one WAV, and let 'cdrecord -dao' read it
+directly.  Each track boundary then costs one line of text.
+
+cdrecord only takes one FILE statement per cue sheet, and burns that
+file to its very end.  So the cue sheet points at a CD image WAV
+(see writeImage): each capture up to the end of its last track,
+sides one after the other, with any track gains applied on the way
+(see Normalize).  That is one sequential copy of the audio, and as
+much free disk space as the CD holds, but the captures themselves
+are never changed -- the tracks can still be re-segmented after a
+failed burn.  (trimCapture instead cuts a capture after its last
+track in place, for captures that are not needed any more.)
+
+Audio CD addresses are in frames of 1/75 s (588 stereo samples), so
+all track boundaries are snapped to multiples of 588 samples.  Any
+audio before a side's first track becomes that track's (hidden)
+pregap.
+
+Several copies can be burned at once from the same cue sheet, one
+per CD burner found on the bus (see BurnQueue).
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+
+import numpy as NP
+
+import WavFile
+
+# Samples per CD frame, and CD frames per second
+framesamples = 588
+framespersec = 75
+
+def snapToFrame(sample):
+    """ Nearest CD frame boundary (in samples) """
+    return int(round(float(sample) / framesamples)) * framesamples
+
+def trackStarts(intervals):
+    """
+    Track start sample offsets, snapped to CD frames
+
+    intervals -- [start,end) sample offsets of each track (see
+    Segmentor.splitTrackIntervals / refineTracks)
+
+    Each track then runs until the next one starts (the last one
+    until trackEnd(...))
+    """
+    return [snapToFrame(start) for (start,end) in intervals]
+
+def trackEnd(intervals):
+    """ End (exclusive) sample offset of the last track """
+    return snapToFrame(intervals[-1][1])
+
+def msf(sample):
+    """ Sample offset -> cue sheet 'mm:ss:ff' time """
+    frames = sample // framesamples
+    return '%02d:%02d:%02d' % (frames // (60*framespersec),
+                               (frames // framespersec) % 60,
+                               frames % framespersec)
+
+def trimCapture(fn, end):
+    """
+    Drop everything after sample <end> from a capture WAV,
+    so it is not burned on the end of the last track
+    """
+    (channels,rate,bits,dataoffset,nframes) = WavFile.readWavHeader(fn)
+    if(end < nframes):
+        WavFile.truncateWav(fn,end)
+
+def writeCueSheet(cuefn, audiofn, starts, sidestarts=[0]):
+    """
+    Write a cue sheet for one WAV file (a CD image, see writeImage,
+    or a trimmed capture)
+
+    starts -- List of track start sample offsets
+    sidestarts -- sample offsets where each side starts in the file,
+    audio before a side's first track becomes that track's pregap
+    """
+    lines = ['FILE "%s" WAVE' % os.path.abspath(audiofn)]
+    # First track of each side
+    firsts = dict([(NP.searchsorted(starts,sidestart),sidestart)
+                   for sidestart in sidestarts])
+    for (i,start) in enumerate(starts):
+        lines.append('  TRACK %02d AUDIO' % (i + 1))
+        if(i in firsts and start > firsts[i]):
+            # Leading silence as a pregap
+            lines.append('    INDEX 00 %s' % msf(firsts[i]))
+        lines.append('    INDEX 01 %s' % msf(start))
+    f = open(cuefn,'w')
+    f.write('\n'.join(lines) + '\n')
+    f.close()
+
+def frameChunks(frames, chunkframes=262144):
+    """ frames (e.g. a memmap slice) chunkframes at a time """
+    for i in range(0,len(frames),chunkframes):
+        yield frames[i:i+chunkframes]
+
+def writeImage(imagefn, sides, channels=2, rate=44100):
+    """
+    Write one or more sides' audio into one CD image WAV
+
+    sides -- List of (chunks of the side's audio, e.g. frameChunks
+    of a capture up to the end of its last track, List of track
+    start sample offsets, end sample offset), each side is padded
+    with silence up to its end if shorter (so every side starts on
+    a CD frame boundary) and cut there if longer
+
+    Return (track starts, side starts) in the image, for
+    writeCueSheet
+    """
+    writer = WavFile.WavWriter(imagefn,channels,rate)
+    (starts,sidestarts) = ([],[])
+    pos = 0
+    for (chunks,sidetracks,end) in sides:
+        sidestarts.append(pos)
+        starts += [pos + start for start in sidetracks]
+        written = 0
+        for chunk in chunks:
+            chunk = chunk[:end - written]
+            writer.write(chunk)
+            written += len(chunk)
+        if(written < end):
+            writer.write(NP.zeros((end - written,channels),'<i2'))
+        pos += end
+    writer.close()
+    return (starts,sidestarts)
+
+def burnCommand(dev, cuefn):
+    """ cdrecord command line for burning a cue sheet """
+    cmd = 'cdrecord fs=4096k -v -useinfo speed=1 '
+    cmd += '-dao -eject -pad '
+    cmd += '-dev=%s ' % (dev)
+    cmd += '-cuefile=\"%s\"' % (cuefn)
+    return cmd
+
+# cdrecord -v progress line
+progressline = re.compile(r'Track\s+(\d+):\s*(\d+)\s+of\s+(\d+)\s+MB written')
+
+def burnProgress(line):
+    """
+    Status text for a line of cdrecord output, or None if the line
+    isn't worth showing
+
+    cdrecord -v rewrites its progress line in place with '\\r', e.g.
+    'Track 01:   12 of  300 MB written (fifo 100%) [buf  99%]   1.0x.'
+    """
+    match = progressline.search(line)
+    if(match != None):
+        (track,done,total) = [int(g) for g in match.groups()]
+        return 'Burning track %d: %d of %d MB' % (track,done,total)
+    for status in ['Fixating','Starting to write','Writing pregap',
+                   'Last chance to quit']:
+        if(line.strip().startswith(status)):
+            return line.strip()
+    return None
+
+def burnCueSheet(dev, cuefn, report=None):
+    """
+    Burn the cue sheet (blocks until cdrecord exits), return
+    cdrecord exit status
+
+    report -- if given, called with status text (see burnProgress)
+    as cdrecord's output comes in, so this can be run on a
+    Pipeline worker thread
+    """
+    proc = subprocess.Popen(burnCommand(dev,cuefn),shell=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    partial = ''
+    while(True):
+        chunk = os.read(proc.stdout.fileno(),4096)
+        if(len(chunk) == 0):
+            break
+        lines = re.split('[\r\n]',partial + chunk)
+        partial = lines.pop()
+        for line in lines:
+            status = burnProgress(line)
+            if(report != None and status != None):
+                report(status)
+    status = burnProgress(partial)
+    if(report != None and status != None):
+        report(status)
+    proc.stdout.close()
+    return proc.wait()
+
+def scanBurners():
+    """
+    Device IDs ('x,y,z') of all CD burners on the bus, in
+    'cdrecord -scanbus' order (any device described as 'RW' is
+    assumed to be able to burn CDs)
+    """
+    proc = subprocess.Popen('cdrecord -scanbus',shell=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    devs = []
+    for line in proc.communicate()[0].splitlines():
+        if('RW' in line):
+            m = re.search('(\d+,\d+,\d+)',line)
+            if(m != None):
+                devs.append(m.group(1))
+    return devs
+
+def checkBurner(dev):
+    """ Is device dev (still) there? (a quick inquiry, no bus scan) """
+    proc = subprocess.Popen('cdrecord -inq dev=%s' % dev,shell=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    proc.communicate()
+    return proc.returncode == 0
+
+class BurnerProbe:
+    """
+    Find the CD burners in the background
+
+    Bus scans can take many seconds, so the devices found are
+    remembered in cachefn; on the next run they are just re-checked
+    with a quick inquiry, and the bus only scanned if none answer
+    (delete cachefn to look for newly added burners).  device() /
+    devices() wait for the probe only if it hasn't finished yet.
+    """
+
+    def __init__(self, cachefn=None):
+        self.cachefn = cachefn
+        self.devs = []
+        self.done = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """ Start probing (returns immediately) """
+        self.thread = threading.Thread(target=self.probe)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def probe(self):
+        """ Find the burners in the current thread """
+        try:
+            devs = [dev for dev in self.cachedDevices() if checkBurner(dev)]
+            if(len(devs) == 0):
+                devs = scanBurners()
+                if(len(devs) > 0):
+                    self.saveDevices(devs)
+            self.devs = devs
+        finally:
+            self.done.set()
+
+    def finished(self):
+        return self.done.isSet()
+
+    def device(self, timeout=None):
+        """ First burner's device ID (None if none found / still probing) """
+        devs = self.devices(timeout)
+        return devs[0] if len(devs) > 0 else None
+
+    def devices(self, timeout=None):
+        """ Device IDs of all burners found (so far) """
+        self.done.wait(timeout)
+        return list(self.devs)
+
+    def cachedDevices(self):
+        """ Last known-good devices (possibly none) """
+        if(self.cachefn == None or not os.path.exists(self.cachefn)):
+            return []
+        return [dev for dev in open(self.cachefn).read().split()
+                if re.match('^\d+,\d+,\d+$',dev)]
+
+    def saveDevices(self, devs):
+        if(self.cachefn != None):
+            f = open(self.cachefn,'w')
+            f.write(''.join([dev + '\n' for dev in devs]))
+            f.close()
+
+def mediaStatus(dev):
+    """
+    'blank', 'written' or 'none' (no disc, or unreadable) for the
+    disc in a burner, from 'cdrecord -minfo'
+    """
+    proc = subprocess.Popen('cdrecord -minfo dev=%s' % dev,shell=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    out = proc.communicate()[0]
+    m = re.search('disk status:\s*(\w+)',out,re.I)
+    if(proc.returncode != 0 or m == None):
+        return 'none'
+    if(m.group(1).lower() == 'empty'):
+        return 'blank'
+    return 'written'
+
+class BurnQueue:
+    """
+    Burn several copies of one cue sheet, on all burners at once
+
+    Each burner takes the next copy from a shared queue as soon as
+    it is free, so faster drives burn more copies.  A failed copy
+    goes back on the queue (for any drive) up to <retries> times,
+    and a drive that fails <drivefailures> times in a row is given
+    up on.  All copies read the same captures / cue sheet on disk.
+
+    Every burn ejects its disc, so before each copy a drive asks for
+    a blank CD (in its status text) and checks every <mediapoll>
+    seconds until one is in.  A drive that gets none for
+    <mediatimeout> seconds stops, and its copy goes back on the
+    queue.  A burn that fails with no disc in the drive is not held
+    against the copy or the drive.
+
+    report -- if given, called as report(dev,text) with each drive's
+    progress (from the drive's own thread, see statusText)
+    """
+
+    def __init__(self, cuefn, devs, copies=1, retries=2,
+                 drivefailures=2, report=None, mediatimeout=600,
+                 mediapoll=2.0):
+        self.cuefn = cuefn
+        self.devs = devs
+        self.copies = copies
+        self.retries = retries
+        self.drivefailures = drivefailures
+        self.report = report
+        self.mediatimeout = mediatimeout
+        self.mediapoll = mediapoll
+        # Copy numbers waiting, burned, given up on; burns under way
+        self.pending = range(copies)
+        self.burned = []
+        self.failed = []
+        self.attempts = dict([(copy,0) for copy in range(copies)])
+        self.inflight = 0
+        self.active = len(devs)
+        self.lock = threading.Condition()
+        # Latest status text of each drive
+        self.progress = dict([(dev,'Waiting') for dev in devs])
+        self.threads = []
+
+    def start(self):
+        """ Start a thread per drive (returns immediately) """
+        if(len(self.devs) == 0):
+            self.failed = self.pending
+            self.pending = []
+        for dev in self.devs:
+            thread = threading.Thread(target=self.burnDrive,args=(dev,))
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def wait(self):
+        """ Block until every copy is burned or given up on """
+        for thread in self.threads:
+            thread.join()
+        return len(self.burned)
+
+    def run(self):
+        """ Burn all copies, return how many were burned """
+        self.start()
+        return self.wait()
+
+    def nextCopy(self):
+        """ Next copy to burn, or None when there is nothing left """
+        self.lock.acquire()
+        try:
+            # (a burn under way may still fail and come back)
+            while(len(self.pending) == 0 and self.inflight > 0):
+                self.lock.wait()
+            if(len(self.pending) == 0):
+                return None
+            self.inflight += 1
+            return self.pending.pop(0)
+        finally:
+            self.lock.release()
+
+    def copyDone(self, copy, status):
+        """
+        Record how a burn went, requeue it if it may be retried
+        (status None: not really tried, just requeue it)
+        """
+        self.lock.acquire()
+        try:
+            self.inflight -= 1
+            if(status == None):
+                self.pending.append(copy)
+            elif(status == 0):
+                self.burned.append(copy)
+            else:
+                self.attempts[copy] += 1
+                if(self.attempts[copy] <= self.retries):
+                    self.pending.append(copy)
+                else:
+                    self.failed.append(copy)
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+
+    def driveDone(self):
+        """ A drive stopped; if it was the last one, nothing else will burn """
+        self.lock.acquire()
+        try:
+            self.active -= 1
+            if(self.active == 0):
+                self.failed += self.pending
+                self.pending = []
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+
+    def burnDrive(self, dev):
+        """ Burn copies on one drive until the queue runs dry """
+        failures = 0
+        try:
+            while(failures < self.drivefailures):
+                copy = self.nextCopy()
+                if(copy == None):
+                    break
+                if(not self.waitForMedia(dev,copy)):
+                    self.copyDone(copy,None)
+                    self.setStatus(dev,'No blank CD, stopped')
+                    break
+                self.setStatus(dev,'Copy %d: starting' % (copy + 1))
+                report = lambda text: self.setStatus(dev,'Copy %d: %s' %
+                                                     (copy + 1,text))
+                try:
+                    status = burnCueSheet(dev,self.cuefn,report)
+                except (IOError,OSError):
+                    status = -1
+                if(status != 0 and mediaStatus(dev) == 'none'):
+                    # (disc taken out, not the drive's fault)
+                    self.copyDone(copy,None)
+                    self.setStatus(dev,'Copy %d: no disc' % (copy + 1))
+                    continue
+                self.copyDone(copy,status)
+                if(status == 0):
+                    failures = 0
+                    self.setStatus(dev,'Copy %d: done' % (copy + 1))
+                else:
+                    failures += 1
+                    self.setStatus(dev,'Copy %d: failed (%d)' %
+                                   (copy + 1,status))
+            if(failures >= self.drivefailures):
+                self.setStatus(dev,'Gave up on this drive')
+        finally:
+            self.driveDone()
+
+    def waitForMedia(self, dev, copy):
+        """
+        Wait for a blank CD in dev (asking for one in the status
+        text), return False if none came within mediatimeout
+        """
+        start = time.time()
+        while(mediaStatus(dev) != 'blank'):
+            if(time.time() - start >= self.mediatimeout):
+                return False
+            self.setStatus(dev,'Copy %d: insert a blank CD' % (copy + 1))
+            time.sleep(self.mediapoll)
+        return True
+
+    def setStatus(self, dev, text):
+        self.progress[dev] = text
+        if(self.report != None):
+            self.report(dev,text)
+
+    def statusText(self):
+        """ One line per drive """
+        return '\n'.join(['%s: %s' % (dev,self.progress[dev])
+                          for dev in self.devs])
@@ -0,0 +1,175 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Spectral features of each envelope block, for telling tape hiss,
+hum and quiet intros apart from real silence and real music
+
+The max-amplitude envelope (Segmentor.getMonoAmpSamples) can't tell
+a gap full of hiss from a quiet passage at the same level.  Their
+spectra differ a lot though: hiss is flat and crosses zero all the
+time, hum sits in the lowest band, music is lumpy.  For each block
+of subrate frames we compute
+
+  log10 mean power in each frequency band (see bandedges)
+  spectral flatness (geometric / arithmetic mean of the power
+  spectrum, 1 = white noise, near 0 = tonal)
+  zero-crossing rate (crossings per frame)
+
+from the average power spectrum of the block's fftsize-frame
+windows.  The windows of chunkblocks blocks at a time are a strided
+view of the memory-mapped capture, and go through one batched real
+FFT -- there is no per-block Python code.
+
+decodeFeatureTracks then finds tracks with the same 2-state HMM as
+the envelope (Segmentor.viterbiDecoding), under a diagonal Gaussian
+emission model per state fitted to the features.
+"""
+import numpy as NP
+from numpy.lib.stride_tricks import as_strided
+
+import Instrument
+import Segmentor
+import WavFile
+
+# Lower edge of each frequency band (Hz), the last band runs up to
+# the Nyquist frequency
+bandedges = [0,150,400,1000,2500,6000,12000]
+# Frames per FFT window
+fftsize = 1024
+
+def featureNames(edges=bandedges):
+    """ Name of each feature column """
+    return (['band%d' % edge for edge in edges] +
+            ['flatness','zerocrossings'])
+
+def bandBins(rate, size=fftsize, edges=bandedges):
+    """ First real FFT bin of each band """
+    freqs = NP.arange(size // 2 + 1) * float(rate) / size
+    return NP.searchsorted(freqs,edges)
+
+def getFeatures(fn, subrate, start=0, end=None, size=fftsize,
+                edges=bandedges):
+    """
+    blockFeatures of (samples [start,end) of) a 16-bit PCM WAV
+    file, block for block aligned with getMonoAmpSamples
+    """
+    (rate,frames) = WavFile.mapWav(fn)
+    frames = frames[start:end]
+    with Instrument.stage('features',len(frames)):
+        return blockFeatures(frames,subrate,rate,size,edges)
+
+def blockFeatures(frames, subrate, rate, size=fftsize, edges=bandedges,
+                  chunkblocks=64):
+    """
+    Spectral features of each block of subrate frames (any trailing
+    partial block is dropped)
+
+    frames -- PCM frames (dim nframes x channels), e.g. from
+    WavFile.mapWav -- processed chunkblocks blocks at a time so
+    memory use does not grow with the length of the recording
+
+    Return NP array (dim nblocks x (nbands + 2)), see featureNames
+    """
+    (nframes,channels) = frames.shape
+    nblocks = nframes // subrate
+    nwindows = subrate // size
+    if(nwindows == 0):
+        raise ValueError('subrate %d is shorter than an FFT window (%d)' %
+                         (subrate,size))
+    starts = bandBins(rate,size,edges)
+    nbands = len(starts)
+    binsperband = NP.diff(NP.append(starts,size // 2 + 1))
+    window = NP.hanning(size).astype(NP.float32)
+    features = NP.zeros((nblocks,nbands + 2))
+    for b in range(0,nblocks,chunkblocks):
+        e = min(b + chunkblocks, nblocks)
+        # Mono, one row per block
+        mono = frames[b*subrate:e*subrate].astype(NP.float32)
+        mono = mono.sum(axis=1).reshape((e-b,subrate)) / channels
+        # View each block as (windows x size), no copying
+        step = mono.strides[1]
+        windows = as_strided(mono,shape=(e-b,nwindows,size),
+                             strides=(mono.strides[0],size*step,step))
+        spectra = NP.fft.rfft(windows * window,axis=2)
+        power = (spectra.real**2 + spectra.imag**2).mean(axis=1)
+        # Mean power per band
+        bands = NP.add.reduceat(power,starts,axis=1) / binsperband
+        features[b:e,:nbands] = NP.log10(bands + 1.0)
+        # Flatness (leaving out DC)
+        ac = power[:,1:] + 1e-10
+        features[b:e,nbands] = (NP.exp(NP.log(ac).mean(axis=1)) /
+                                ac.mean(axis=1))
+        # Zero crossings
+        signs = NP.signbit(mono)
+        features[b:e,nbands+1] = (signs[:,1:] != signs[:,:-1]).mean(axis=1)
+    return features
+
+def fitEmissions(features, assign, floor):
+    """
+    Diagonal Gaussian (mu,sigma) of the features assigned to each
+    of the 2 states (sigma at least floor)
+    """
+    stateparam = []
+    for state in [0,1]:
+        x = features[assign == state]
+        stateparam.append((x.mean(axis=0),NP.maximum(x.std(axis=0),floor)))
+    return stateparam
+
+def initialTracks(features, iterations=20):
+    """
+    Starting track/gap split of the blocks: 2-means clustering of
+    the standardized features, where the gap cluster is the one
+    whose loudest band is quieter on average (hiss spreads its
+    energy over all bands, music piles it up in a few)
+    """
+    z = ((features - features.mean(axis=0)) /
+         (features.std(axis=0) + 1e-9))
+    # Start from the blocks with the quietest / loudest loudest band
+    loudest = features[:,:-2].max(axis=1)
+    centers = z[[loudest.argmin(),loudest.argmax()]]
+    assign = NP.zeros((len(z),),NP.int)
+    for i in range(iterations):
+        dist = ((z[:,NP.newaxis,:] - centers[NP.newaxis,:,:])**2).sum(axis=2)
+        newassign = dist.argmin(axis=1)
+        if(newassign.min() == newassign.max() or
+           NP.all(newassign == assign)):
+            break
+        assign = newassign
+        centers = NP.array([z[assign == k].mean(axis=0) for k in [0,1]])
+    assign = newassign
+    if(assign.min() < assign.max() and
+       loudest[assign == 0].mean() > loudest[assign == 1].mean()):
+        assign = 1 - assign
+    return assign
+
+def decodeFeatureTracks(features, assign=None, iterations=10):
+    """
+    Track/gap state (1/0) of each block from its spectral features
+    (feed the result to Segmentor.splitTracks / refineTracks)
+
+    The emission model of each state is a diagonal Gaussian over
+    the features, fitted by Viterbi training: fit to the current
+    path, decode, and repeat until the path stops changing.
+
+    assign -- path to start from (default initialTracks)
+    """
+    features = NP.asarray(features,NP.float64)
+    floor = 0.05 * features.std(axis=0) + 1e-6
+    if(assign is None):
+        assign = initialTracks(features)
+    (initprob,transition,stateparam) = Segmentor.trackHMM(0.0,1.0)
+    for i in range(iterations):
+        # (nothing to fit a 2-state model to)
+        if(assign.min() == assign.max()):
+            break
+        stateparam = fitEmissions(features,assign,floor)
+        newassign = Segmentor.viterbiDecoding(features,initprob,
+                                              transition,stateparam)
+        if(NP.all(newassign == assign)):
+            break
+        assign = newassign
+    return assign
@@ -0,0 +1,197 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Per-stage timing / memory instrumentation
+
+Processing stages mark themselves with
+
+    with Instrument.stage('decode',items=len(data)):
+        ...
+
+or the @Instrument.timed('decode') decorator (items = len of the
+first argument).  Nothing is measured until enable() is called, and
+while disabled a stage costs one function call and an attribute
+lookup.
+
+When enabled, each finished stage records its duration, input size
+(items, e.g. audio frames or envelope subsamples), throughput
+(items/s) and peak growth in resident memory, into an in-memory
+list (see report()) and optionally as one JSON object per line in
+a log file.  count(name,n) keeps simple running counters.
+"""
+import json
+import os
+import threading
+import time
+
+# Is instrumentation on?
+enabled = False
+# Record peak memory of each stage (costs a sampling thread per stage)
+memory = True
+# Finished stage records / named counters / JSON-lines log
+records = []
+counters = {}
+log = None
+session = None
+
+def enable(logfn=None, trackmemory=True):
+    """ Start recording stages (appending JSON lines to logfn, if given) """
+    global enabled, memory, log, session
+    enabled = True
+    memory = trackmemory
+    session = '%d-%d' % (os.getpid(),int(time.time()))
+    if(logfn != None):
+        log = open(logfn,'a')
+
+def disable():
+    """ Stop recording (records so far are kept) """
+    global enabled, log
+    enabled = False
+    if(log != None):
+        log.close()
+        log = None
+
+def reset():
+    """ Forget all records and counters """
+    del records[:]
+    counters.clear()
+
+def stage(name, items=None):
+    """ Context manager measuring one run of a stage """
+    if(not enabled):
+        return nostage
+    return Stage(name,items)
+
+def timed(name, size=len):
+    """ Decorator: measure every call as a stage (items = size(arg 0)) """
+    def decorate(f):
+        def wrapper(*args, **kwargs):
+            if(not enabled):
+                return f(*args,**kwargs)
+            with Stage(name,size(args[0]) if len(args) > 0 else None):
+                return f(*args,**kwargs)
+        wrapper.__name__ = f.__name__
+        wrapper.__doc__ = f.__doc__
+        return wrapper
+    return decorate
+
+def count(name, n=1):
+    """ Add n to a named counter """
+    if(enabled):
+        counters[name] = counters.get(name,0) + n
+
+def report():
+    """
+    Totals per stage name: {name : {'calls', 'seconds', 'items',
+    'persec', 'peakmb'}} plus the counters under 'counters'
+    """
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['stage'],
+                                  {'calls' : 0, 'seconds' : 0.0,
+                                   'items' : 0, 'peakmb' : None})
+        total['calls'] += 1
+        total['seconds'] += record['seconds']
+        if(record['items'] != None):
+            total['items'] += record['items']
+        if(record['peakmb'] != None):
+            total['peakmb'] = max(total['peakmb'],record['peakmb'])
+    for total in totals.values():
+        total['persec'] = total['items'] / max(total['seconds'],1e-9)
+    return {'stages' : totals, 'counters' : dict(counters)}
+
+class NoStage:
+    """ (what stage() hands out while disabled) """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+nostage = NoStage()
+
+class Stage:
+    """ One measured run of a stage (items can be set inside the block) """
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+        self.sampler = None
+
+    def __enter__(self):
+        if(memory):
+            self.sampler = MemorySampler()
+            self.sampler.start()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.time() - self.start
+        record = {'session' : session,
+                  'stage' : self.name,
+                  'start' : self.start,
+                  'seconds' : seconds,
+                  'items' : self.items,
+                  'persec' : (None if self.items == None else
+                              self.items / max(seconds,1e-9)),
+                  'peakmb' : (None if self.sampler == None else
+                              self.sampler.stop()),
+                  'failed' : exc[0] != None}
+        records.append(record)
+        if(self.items != None):
+            count(self.name + '.items',self.items)
+        if(log != None):
+            log.write(json.dumps(record) + '\n')
+            log.flush()
+        return False
+
+class MemorySampler(threading.Thread):
+    """
+    Track peak resident (anonymous, i.e. not file-backed memmap)
+    memory of this process while a stage runs, by polling
+    /proc/self/status (Linux only, otherwise peak stays None)
+    """
+
+    def __init__(self, interval=0.01):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.interval = interval
+        self.base = residentBytes()
+        self.peak = self.base
+        self.finished = threading.Event()
+
+    def run(self):
+        while(not self.finished.isSet()):
+            self.sample()
+            self.finished.wait(self.interval)
+
+    def sample(self):
+        current = residentBytes()
+        if(current != None):
+            self.peak = max(self.peak,current)
+
+    def stop(self):
+        """ Return peak growth over the starting size (MB) """
+        self.finished.set()
+        self.join()
+        self.sample()
+        if(self.base == None):
+            return None
+        return (self.peak - self.base) / 2.0**20
+
+def residentBytes():
+    """ Anonymous resident memory (falls back to total RSS), or None """
+    try:
+        fields = dict([line.split(':',1)
+                       for line in open('/proc/self/status')])
+    except IOError:
+        return None
+    for key in ['RssAnon','VmRSS']:
+        if(key in fields):
+            return int(fields[key].split()[0]) * 1024
+    return None
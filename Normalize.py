@@ -0,0 +1,135 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Per-track level normalization and fades, applied while exporting
+
+Each track gets a single gain, chosen from the segmentation envelope
+(Segmentor.getMonoAmpSamples) that is already in memory, so finding
+the levels costs no extra pass over the audio: the track's loudness
+is a high percentile of its block peaks (so one click or pop does
+not set the level), and the gain is capped so its loudest block
+peak stays under the ceiling.
+
+Applying the gain (plus a short linear fade in/out at the track
+boundaries, so cut points never click) is then one streaming pass,
+chunkframes frames at a time over the memory-mapped capture --
+into new track WAVs, a normalized copy of the capture, or the CD
+image the cue sheet points at (see captureChunks).  The capture
+itself is never changed, so the gains can be changed (or dropped)
+again until the CD is burned.
+"""
+import numpy as NP
+
+import CDImage
+import WavFile
+
+# Loudness (block peak percentile) to aim for, and the limit on
+# the loudest block peak after gain (16-bit full scale = 32767)
+level = 16384
+ceiling = 32000
+loudpercentile = 95
+# Never boost by more than this (quiet tracks are mostly hiss)
+maxgain = 8.0
+# Fade in / out length (seconds)
+fadesec = 0.05
+
+def trackGains(samps, intervals, subrate):
+    """
+    Gain for each track
+
+    samps -- segmentation envelope (peak per block of subrate frames)
+    intervals -- [start,end) sample offsets of each track
+
+    Return NP array of gains (1.0 for tracks too short or too quiet
+    to measure)
+    """
+    samps = NP.asarray(samps,NP.float64)
+    gains = NP.ones((len(intervals),))
+    for (i,(start,end)) in enumerate(intervals):
+        # Blocks overlapping the track
+        b = int(start) // subrate
+        e = min(max(b + 1,-(-int(end) // subrate)),len(samps))
+        peaks = samps[b:e]
+        if(len(peaks) == 0 or peaks.max() <= 0):
+            continue
+        loud = NP.percentile(peaks,loudpercentile)
+        gain = min(level / max(loud,1.0),ceiling / peaks.max(),maxgain)
+        gains[i] = gain
+    return gains
+
+def fadeFrames(rate):
+    """ Fade length in frames """
+    return int(round(fadesec * rate))
+
+def scaleChunks(frames, gain, fadeframes, chunkframes=262144):
+    """
+    Apply gain and fade in / out to one track's frames (dim nframes
+    x channels, e.g. a slice of a memmap), chunkframes at a time
+
+    Yields 16-bit chunks (clipped at full scale), in order
+    """
+    nframes = len(frames)
+    for i in range(0,nframes,chunkframes):
+        j = min(i + chunkframes,nframes)
+        chunk = frames[i:j].astype(NP.float32)
+        if(fadeframes > 0 and (i < fadeframes or j > nframes - fadeframes)):
+            # Distance from the nearest track end, as a ramp
+            pos = NP.arange(i,j)
+            ramp = NP.minimum(pos,nframes - 1 - pos) / float(fadeframes)
+            ramp = NP.minimum(ramp,1.0).astype(NP.float32) * gain
+            chunk *= ramp[:,NP.newaxis]
+        else:
+            chunk *= gain
+        NP.rint(chunk,out=chunk)
+        NP.clip(chunk,-32768,32767,out=chunk)
+        yield chunk.astype('<i2')
+
+def writeTrack(frames, fn, rate, gain, fadeframes, chunkframes=262144):
+    """ Write one track to a new WAV, with gain and fades """
+    writer = WavFile.WavWriter(fn,frames.shape[1],rate)
+    for chunk in scaleChunks(frames,gain,fadeframes,chunkframes):
+        writer.write(chunk)
+    writer.close()
+
+def trackSegments(intervals, nframes):
+    """
+    Disjoint [start,end) frames to apply each track's gain to
+
+    On the CD each track runs from its start (CDImage.trackStarts)
+    until the next one starts, gap included, so that is where its
+    gain (and fade out) goes too -- the last track runs to the end
+    of the audio (nframes)
+    """
+    starts = [min(start,nframes) for start in CDImage.trackStarts(intervals)]
+    return zip(starts,starts[1:] + [nframes])
+
+def captureChunks(frames, intervals, gains, fadeframes, chunkframes=262144):
+    """
+    Chunks of a whole capture (frames, e.g. a memmap up to the end
+    of its last track) with gain and fades applied to each track
+    (see trackSegments, audio before the first track is copied as
+    is), in order
+    """
+    pos = 0
+    for ((start,end),gain) in zip(trackSegments(intervals,len(frames)),gains):
+        for i in range(pos,start,chunkframes):
+            yield frames[i:min(i + chunkframes,start)]
+        for chunk in scaleChunks(frames[start:end],gain,fadeframes,
+                                 chunkframes):
+            yield chunk
+        pos = end
+    for i in range(pos,len(frames),chunkframes):
+        yield frames[i:i+chunkframes]
+
+def writeCapture(frames, fn, rate, intervals, gains, fadeframes,
+                 chunkframes=262144):
+    """ Write captureChunks(...) to a new WAV """
+    writer = WavFile.WavWriter(fn,frames.shape[1],rate)
+    for chunk in captureChunks(frames,intervals,gains,fadeframes,
+                               chunkframes):
+        writer.write(chunk)
+    writer.close()
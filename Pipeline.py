@@ -0,0 +1,73 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Run the slow post-recording work (envelope, segmentation, export,
+burning) off the Tk event thread
+
+A Pipeline runs its stages one after another on a worker thread.
+Each stage is a function stage(data, report) which takes the previous
+stage's result and returns its own; report(text) posts a progress
+message (and each stage is measured as an Instrument stage).
+Messages go through a thread-safe queue which the GUI drains with
+poll() from an after() callback, so Tk is only ever touched from the
+main thread (and nothing here needs a display).
+
+Messages are (kind, stage name, value) Tuples where kind is
+'stage' (stage started), 'progress' (value = text),
+'error' (value = error text, pipeline stops) or
+'done' (value = result of the last stage)
+"""
+import Queue
+import threading
+import traceback
+
+import Instrument
+
+class Pipeline:
+    """ Stages run in sequence on a worker thread """
+
+    def __init__(self, stages):
+        # List of (name, stage function) Tuples
+        self.stages = stages
+        self.messages = Queue.Queue()
+        self.thread = None
+
+    def start(self, data=None):
+        """ Start running the stages on data (returns immediately) """
+        self.thread = threading.Thread(target=self.run, args=(data,))
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def run(self, data=None):
+        """ Run all stages in the current thread """
+        for (name,stage) in self.stages:
+            self.messages.put(('stage',name,None))
+            def report(text, name=name):
+                self.messages.put(('progress',name,text))
+            try:
+                with Instrument.stage(name):
+                    data = stage(data,report)
+            except Exception, e:
+                traceback.print_exc()
+                self.messages.put(('error',name,'%s: %s' %
+                                   (e.__class__.__name__,e)))
+                return
+        self.messages.put(('done',None,data))
+
+    def poll(self):
+        """ All messages posted since the last poll (never blocks) """
+        messages = []
+        while(True):
+            try:
+                messages.append(self.messages.get_nowait())
+            except Queue.Empty:
+                return messages
+
+    def wait(self, timeout=None):
+        """ Block until the worker thread is finished """
+        if(self.thread != None):
+            self.thread.join(timeout)
@@ -0,0 +1,231 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Disk-streamed recording
+
+Holding a whole tape side in a tkSnack.Sound eventually makes Tcl/Tk
+fail with 'unable to alloc'.  Instead, the recorder repeatedly drains
+whatever the audio source has captured so far and appends it to a WAV
+file on disk in fixed-size chunks, so memory use stays flat no matter
+how long the tape is.  Everything downstream (envelope, segmentation,
+export, playback) then works from that file.
+
+An audio source is anything with attributes rate / channels and
+methods start(), stop() and read(nframes), where read returns up to
+nframes captured frames (NP array of dim n x channels, int16), or
+no frames if nothing new has been captured yet.
+
+A LevelMeter can watch the frames on their way to disk: it keeps
+the last fraction of a second in a fixed ring buffer for a live
+peak / RMS / clipping display, and works out the segmentation
+envelope block by block as it goes, so the envelope of a finished
+recording doesn't have to be read back from disk.
+"""
+import os
+import tempfile
+
+import numpy as NP
+
+import Instrument
+import Segmentor
+import WavFile
+
+class DiskRecorder:
+    """ Stream frames from an audio source to a WAV file on disk """
+
+    def __init__(self, source, fn, chunkframes=65536, meter=None):
+        self.source = source
+        self.fn = fn
+        self.chunkframes = chunkframes
+        self.writer = WavFile.WavWriter(fn,source.channels,source.rate)
+        # (LevelMeter, or None)
+        self.meter = meter
+
+    def start(self):
+        """ Start capturing """
+        self.source.start()
+
+    def poll(self):
+        """
+        Move everything captured so far to disk
+
+        Return number of frames written
+        """
+        written = 0
+        while(True):
+            frames = self.source.read(self.chunkframes)
+            if(len(frames) == 0):
+                break
+            self.writer.write(frames)
+            if(self.meter != None):
+                self.meter.push(frames)
+            written += len(frames)
+        # Keep the header current so the file can be read mid-capture
+        self.writer.flush()
+        Instrument.count('record.frames',written)
+        return written
+
+    def stop(self):
+        """ Stop capturing, write out the rest and close the file """
+        self.source.stop()
+        self.poll()
+        self.writer.close()
+        return self.fn
+
+    def length(self):
+        """ Number of frames on disk so far """
+        return self.writer.nframes
+
+class LevelMeter:
+    """
+    Live input levels of the most recent <window> seconds of audio,
+    and the envelope (Segmentor.getMonoAmpSamples) of everything
+    pushed so far
+
+    Frames are copied into a preallocated ring buffer, so memory
+    stays flat however long the recording and however often the
+    levels are looked at.
+    """
+
+    def __init__(self, channels=2, rate=44100, window=0.25, subrate=20000):
+        self.channels = channels
+        self.rate = rate
+        self.subrate = subrate
+        self.ring = NP.zeros((int(window * rate),channels),'<i2')
+        # Next ring position to write, frames pushed in total
+        self.pos = 0
+        self.nframes = 0
+        # Clipped samples (at full scale) per channel, and the frame
+        # count when the last one was seen
+        self.clips = NP.zeros((channels,),NP.int64)
+        self.lastclip = None
+        # Envelope: whole blocks not taken yet, and the peak / size
+        # of the block being filled
+        self.blocks = []
+        self.blockpeak = 0
+        self.blockfill = 0
+
+    def push(self, frames):
+        """ Account for newly recorded frames (dim n x channels) """
+        frames = NP.asarray(frames,'<i2')
+        n = len(frames)
+        if(n == 0):
+            return
+        # Ring buffer (only the last len(ring) frames can matter)
+        size = len(self.ring)
+        recent = frames[-size:]
+        first = min(len(recent),size - self.pos)
+        self.ring[self.pos:self.pos+first] = recent[:first]
+        self.ring[:len(recent)-first] = recent[first:]
+        self.pos = (self.pos + len(recent)) % size
+        # Clipping
+        clipped = (frames == 32767) | (frames == -32768)
+        if(clipped.any()):
+            self.clips += clipped.sum(axis=0)
+            last = NP.flatnonzero(clipped.any(axis=1))[-1]
+            self.lastclip = self.nframes + last
+        self.nframes += n
+        self.pushBlocks(frames)
+
+    def pushBlocks(self, frames):
+        """ Extend the envelope by whole blocks of subrate frames """
+        # Finish the partial block first
+        if(self.blockfill > 0):
+            fill = min(self.subrate - self.blockfill,len(frames))
+            self.blockpeak = max(self.blockpeak,peakLevel(frames[:fill]))
+            self.blockfill += fill
+            frames = frames[fill:]
+            if(self.blockfill == self.subrate):
+                self.blocks.append(NP.array([self.blockpeak],NP.float64))
+                (self.blockpeak,self.blockfill) = (0,0)
+        nblocks = len(frames) // self.subrate
+        if(nblocks > 0):
+            whole = frames[:nblocks*self.subrate]
+            peak = Segmentor.blockLevels(whole,self.subrate)[0].max(axis=1)
+            self.blocks.append(peak)
+        rest = frames[nblocks*self.subrate:]
+        if(len(rest) > 0):
+            self.blockpeak = peakLevel(rest)
+            self.blockfill = len(rest)
+
+    def takeBlocks(self):
+        """
+        Envelope of the whole blocks finished since the last call
+        (so far the same as getMonoAmpSamples of the capture)
+        """
+        if(len(self.blocks) == 0):
+            return NP.zeros((0,))
+        blocks = NP.concatenate(self.blocks)
+        self.blocks = []
+        return blocks
+
+    def levels(self):
+        """ (peak,rms) of each channel over the ring buffer window """
+        recent = self.ring[:min(self.nframes,len(self.ring))]
+        if(len(recent) == 0):
+            return (NP.zeros((self.channels,)),NP.zeros((self.channels,)))
+        peak = NP.maximum(recent.max(axis=0).astype(NP.int32),
+                          -recent.min(axis=0).astype(NP.int32))
+        wide = recent.astype(NP.int64)
+        rms = NP.sqrt(NP.einsum('ij,ij->j',wide,wide) / float(len(recent)))
+        return (peak.astype(NP.float64),rms)
+
+    def clipping(self, within=1.0):
+        """ Any clipping in the last <within> seconds? """
+        return (self.lastclip != None and
+                self.nframes - self.lastclip <= within * self.rate)
+
+def peakLevel(frames):
+    """ Peak absolute amplitude over all frames / channels """
+    if(len(frames) == 0):
+        return 0
+    # (abs() of -32768 overflows int16)
+    return max(int(frames.max()),-int(frames.min()))
+
+def dbfs(level):
+    """ Amplitude -> dB relative to 16-bit full scale """
+    return 20 * NP.log10(NP.maximum(level,1.0) / 32768.0)
+
+class SnackSource:
+    """
+    Mic input via tkSnack
+
+    Snack records into an in-memory Sound, so each read() copies
+    the oldest captured frames out (through a small temp WAV) and
+    then cuts them from the Sound, keeping it at most a few
+    seconds long
+    """
+
+    def __init__(self, rate=44100, channels=2):
+        # (import here so the rest of this module works without Tk)
+        import tkSnack
+        self.rate = rate
+        self.channels = channels
+        self.sound = tkSnack.Sound()
+        self.sound.configure(channels={1:"Mono",2:"Stereo"}[channels])
+        self.sound.configure(frequency=rate)
+
+    def start(self):
+        self.sound.record()
+
+    def stop(self):
+        self.sound.stop()
+
+    def read(self, nframes):
+        n = min(self.sound.length(), nframes)
+        if(n == 0):
+            return NP.zeros((0,self.channels),'<i2')
+        (fd,fn) = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            self.sound.write(fn,start=0,end=n-1)
+            frames = NP.array(WavFile.mapWav(fn)[1][:n])
+        finally:
+            os.remove(fn)
+        # Drop the copied frames from memory
+        self.sound.cut(0,n-1)
+        return frames
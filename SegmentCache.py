@@ -0,0 +1,165 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+On-disk cache of segmentation artifacts, so re-running with the
+other mode (voice/music) or different parameters only recomputes
+what actually changed
+
+Each artifact (envelope, smoothed envelope, decoded track/gap path)
+is keyed by a hash of its inputs: the envelope by the capture's
+content hash plus subrate, and everything downstream by a hash of
+the envelope values plus its own parameters.  Artifacts are stored
+as .npy files, and the least recently used ones are deleted when
+the cache grows past maxbytes.
+
+The content hash of a capture is itself remembered by (path, size,
+mtime), as one more artifact, so an unchanged capture is only read
+through once.
+Several processes can share a cache directory (at worst an artifact
+is computed twice).
+"""
+import hashlib
+import os, os.path
+import tempfile
+
+import numpy as NP
+
+import Instrument
+import Segmentor
+
+class SegmentCache:
+    """ Segmentation artifacts cached in cachedir """
+
+    def __init__(self, cachedir, maxbytes=256*2**20):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+        if(not os.path.isdir(cachedir)):
+            os.makedirs(cachedir)
+
+    def envelope(self, fn, subrate):
+        """ Segmentor.getMonoAmpSamples(fn,subrate) """
+        key = digest('envelope',self.fileDigest(fn),subrate)
+        return self.cached(key,Segmentor.getMonoAmpSamples,fn,subrate)
+
+    def smoothed(self, samps, W=7):
+        """ Segmentor.smoothEnvelope(samps,W) """
+        key = digest('smoothed',arrayDigest(samps),W)
+        return self.cached(key,Segmentor.smoothEnvelope,samps,W)
+
+    def decoded(self, samps, hmm=None):
+        """
+        Track/gap Viterbi path for an envelope (Segmentor.decodeTracks),
+        or under other HMM parameters (initprob,transition,stateparam)
+        """
+        if(hmm == None):
+            hmm = Segmentor.trackHMM(samps.mean(),samps.std())
+        (initprob,transition,stateparam) = hmm
+        key = digest('decoded',arrayDigest(samps),
+                     arrayDigest(initprob),arrayDigest(transition),
+                     arrayDigest(stateparam))
+        return self.cached(key,Segmentor.viterbiDecoding,
+                           samps,initprob,transition,stateparam)
+
+    def voiceIntervals(self, samps):
+        """ Segmentor.voiceIntervals, from the cached smoothed envelope """
+        return Segmentor.voiceIntervals(samps,self.smoothed(samps))
+
+    def trackIntervals(self, samps, padding=6):
+        """ Segmentor.splitTrackIntervals of the cached Viterbi path """
+        return Segmentor.splitTrackIntervals(self.decoded(samps),padding)
+
+    def cached(self, key, compute, *args):
+        """ Stored artifact for key, or compute(*args) (then stored) """
+        result = self.load(key)
+        if(result is None):
+            Instrument.count('cache.miss')
+            result = compute(*args)
+            self.store(key,result)
+        else:
+            Instrument.count('cache.hit')
+        return result
+
+    def path(self, key):
+        return os.path.join(self.cachedir,key + '.npy')
+
+    def load(self, key):
+        """ Stored artifact (marked as just used), or None """
+        fn = self.path(key)
+        try:
+            result = NP.load(fn)
+            os.utime(fn,None)
+        except (IOError,OSError,ValueError):
+            return None
+        return result
+
+    def store(self, key, array):
+        """ Store an artifact, then evict down to maxbytes """
+        # (write to a temp file first so readers never see half a file)
+        (fd,tmpfn) = tempfile.mkstemp(suffix='.tmp',dir=self.cachedir)
+        f = os.fdopen(fd,'wb')
+        NP.save(f,NP.asarray(array))
+        f.close()
+        os.rename(tmpfn,self.path(key))
+        self.evict(key)
+
+    def evict(self, keep=None):
+        """
+        Delete least recently used artifacts (other than key <keep>)
+        until under maxbytes
+        """
+        entries = []
+        for name in os.listdir(self.cachedir):
+            if(name.endswith('.npy')):
+                try:
+                    st = os.stat(os.path.join(self.cachedir,name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime,st.st_size,name))
+        entries.sort()
+        total = sum([size for (used,size,name) in entries])
+        for (used,size,name) in entries:
+            if(total <= self.maxbytes):
+                break
+            if(name == '%s.npy' % keep):
+                continue
+            try:
+                os.remove(os.path.join(self.cachedir,name))
+            except OSError:
+                pass
+            total -= size
+
+    def fileDigest(self, fn, chunkbytes=2**20):
+        """
+        Content hash of a file (remembered by path, size and mtime,
+        as a small artifact evicted like the others)
+        """
+        st = os.stat(fn)
+        key = digest('file',os.path.abspath(fn),st.st_size,st.st_mtime)
+        memo = self.load(key)
+        if(memo is not None):
+            return str(memo)
+        h = hashlib.sha1()
+        f = open(fn,'rb')
+        while(True):
+            chunk = f.read(chunkbytes)
+            if(len(chunk) == 0):
+                break
+            h.update(chunk)
+        f.close()
+        self.store(key,NP.array(h.hexdigest()))
+        return h.hexdigest()
+
+def digest(*parts):
+    """ Cache key for a sequence of (string-able) parts """
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+def arrayDigest(a):
+    """ Hash of the values (and shape/type) of an array """
+    a = NP.ascontiguousarray(a)
+    h = hashlib.sha1(repr((a.shape,a.dtype.str)))
+    h.update(a.data)
+    return h.hexdigest()
@@ -17,8 +17,22 @@ For single-track recordings (spoken word, or multiple songs for which
 multi-track mode fails to find the correct segmentation), just 
 trim the intro / outro silence.
 """
+import os
+import tempfile
+
 import numpy as NP
 
+import Instrument
+import WavFile
+
+# Closed-form 2-state decoding scans this many timesteps at a time
+# (bounds scan temporaries, and fixes the order of floating point
+# operations so block-wise and whole-sequence decodes agree exactly)
+scanblock = 65536
+
+# viterbiBatch decodes smaller batches one row at a time
+minbatch = 8
+
 def segmentVoice(data):
     """
     Given sample amplitudes, simply define a single track with
@@ -26,24 +40,34 @@ def segmentVoice(data):
     
     Return one-element List containing subsample indices for this track    
     """
+    return intervalIndices(voiceIntervals(data))
+
+def voiceIntervals(data,cdata=None):
+    """
+    Given sample amplitudes, simply define a single track with
+    beginning / ending silence clipped off
+
+    cdata -- smoothEnvelope(data), if already known
+
+    Return NP array (dim 1 x 2) of [start,end) subsample indices
+    """
     D = len(data)
 
     # Apply Gaussian smoothing kernel    
-    W = 7
-    kernel = NP.array([NP.exp(-(i-(W-1)/2)**2 / (W/2)) for i in range(W)])
-    kernel = kernel / kernel.sum()
-    cdata = NP.convolve(data,kernel,'same')
+    if(cdata is None):
+        cdata = smoothEnvelope(data)
 
     # Find FIRST subsample w/ amplitude > max / 2, then take <padding> 
     # subsamples before that (or first subsample)
     pad = 6
-    start = max(0,NP.where(cdata > 0.5 * cdata.max())[0].min() - pad)
+    loud = NP.flatnonzero(cdata > 0.5 * cdata.max())
+    start = max(0,loud.min() - pad)
 
     # Find LAST subsample w/ amplitude > max / 2, then take <padding> 
     # subsamples after that (or last subsample)
-    finish = min(D-1,NP.where(cdata > 0.5 * cdata.max())[0].max() + pad)
+    finish = min(D-1,loud.max() + pad)
 
-    return [range(start,finish+1)]
+    return NP.array([[start,finish+1]], NP.int64)
 
 def segmentTracks(data):
     """ 
@@ -55,14 +79,49 @@ def segmentTracks(data):
 
     Return List containing subsample indices for each track
     """
-    D = len(data)
+    # Get state sequence of Viterbi decoding
+    # (state assignments for each subsample)
+    assign = decodeTracks(data)
+
+    # Split each pair of tracks in the middle of the separating gap
+    # (List of subsample indices for each track)
+    return splitTracks(assign)
+
+def decodeTracks(data):
+    """
+    Track/gap state (1/0) of each subsample under the hand-coded 
+    2-state HMM (the Viterbi path behind segmentTracks)
+    """
+    # Hand-coded 2-state track/gap HMM
+    (initprob,transition,stateparam) = trackHMM(data.mean(),data.std())
+
+    return viterbiDecoding(data,initprob,transition,stateparam)
 
-    # Pre-process data with Gaussian smoothing kernel
-    W = 7
-    kernel = NP.array([NP.exp(-(i-(W-1)/2)**2 / (W/2)) for i in range(W)])
-    kernel = kernel / kernel.sum()
-    cdata = NP.convolve(data,kernel,'same')
+@Instrument.timed('smooth')
+def smoothEnvelope(data,W=7):
+    """ Convolve subsample amplitudes with a width-W Gaussian kernel """
+    return NP.convolve(data,gaussKernel(W),'same')
 
+def gaussKernel(W):
+    """ Normalized width-W Gaussian kernel (built once per width) """
+    if(W not in kernels):
+        i = NP.arange(W)
+        kernel = NP.exp(-(i-(W-1)//2)**2 // (W//2))
+        kernels[W] = kernel / kernel.sum()
+        # (shared, so keep it from being modified)
+        kernels[W].setflags(write=False)
+    return kernels[W]
+
+# Kernels built so far, by width
+kernels = {}
+
+def trackHMM(mean,std):
+    """
+    Hand-coded parameters of the 2-state track/gap HMM, given 
+    the mean and std dev of the sample amplitudes
+
+    Return (initprob,transition,stateparam)
+    """
     # Initial distribution over states
     # (start recording before music begins)
     initprob = NP.array([0.999,0.001])
@@ -74,16 +133,9 @@ def segmentTracks(data):
     # Mean and std dev for each state's Gaussian emission model
     # state 0 = gap (near silence)
     # state 1 = track (use dataset mean)
-    stateparam = [(0,data.std()), 
-                  (data.mean(),data.std())]
-
-    # Get state sequence of Viterbi decoding
-    # (state assignments for each subsample)
-    assign = viterbiDecoding(data,initprob,transition,stateparam)
-
-    # Split each pair of tracks in the middle of the separating gap
-    # (List of subsample indices for each track)
-    return splitTracks(assign)
+    stateparam = [(0,std), 
+                  (mean,std)]
+    return (initprob,transition,stateparam)
 
 def splitTracks(assign,padding=6):
     """
@@ -92,142 +144,1099 @@ def splitTracks(assign,padding=6):
 
     Return List of track subsample index Lists where each track
     List contains subsample indices assigned to that track
+
+    (List-of-indices form of splitTrackIntervals)
+    """
+    return intervalIndices(splitTrackIntervals(assign,padding))
+
+def splitTrackIntervals(assign,padding=6):
+    """
+    Partition all samples among tracks, padding each
+    track with <padding> gap-assigned sample(s)
+
+    Return NP array (dim ntracks x 2) of [start,end) subsample
+    indices of each track
     """
-    tracks = []    
     # Detect contiguous same-label runs 
     # (run starts and lengths)
     (runStarts,runLengths) = detectRuns(assign)
+    nruns = len(runStarts)
     endIndex = runStarts[-1] + runLengths[-1] - 1
-    # If we only have a single run, 
-    # assume it is a single track
-    if(len(runStarts) == 0):
-        return [range(runStarts[0],
-                      runStarts[0] + runLengths[0])]
-    # Otherwise, is the 1st run track or gap?
+    runEnds = runStarts + runLengths
+    # Is the 1st run track or gap?
     if(assign[runStarts[0]] == 1):
         # Track
-        curTrack = range(runStarts[0],
-                         min(runStarts[0] + runLengths[0] + padding, endIndex))
+        first = (runStarts[0],
+                 min(runEnds[0] + padding, endIndex))
         curRun = 2
-    else:
+    elif(nruns > 1):
         # Gap
-        curTrack = range(max(runStarts[0] + runLengths[0] - padding, 0),
-                         min(runStarts[1] + runLengths[1] + padding, endIndex))
+        first = (max(runEnds[0] - padding, 0),
+                 min(runEnds[1] + padding, endIndex))
         curRun = 3
-    tracks.append(curTrack)
-    # Find rest of tracks
-    while(curRun < len(runStarts)):
-        # Take half the previous gap, the track,
-        # then half the next gap (if it exists)
-        curTrack = range(
-            max(runStarts[curRun-1] + runLengths[curRun-1] - padding, 0),
-            runStarts[curRun] + runLengths[curRun])
-        if(curRun < len(runStarts) - 1):
-            curTrack += range(runStarts[curRun+1],
-                              min(runStarts[curRun+1] + padding, endIndex))
-        tracks.append(curTrack)
-        # Jump by 2 to next track (we know label pattern *must* alternate)
-        curRun += 2
+    else:
+        # Nothing but gap
+        return NP.zeros((0,2), NP.int64)
+    # Rest of tracks are every other run from here on
+    # (we know label pattern *must* alternate)
+    trackRuns = NP.arange(curRun,nruns,2)
+    tracks = NP.empty((len(trackRuns)+1,2), NP.int64)
+    tracks[0] = first
+    # Take half the previous gap, the track,
+    # then half the next gap (if it exists)
+    tracks[1:,0] = NP.maximum(runStarts[trackRuns] - padding, 0)
+    tracks[1:,1] = runEnds[trackRuns]
+    hasNext = trackRuns < nruns - 1
+    tracks[1:,1][hasNext] = NP.minimum(runStarts[trackRuns[hasNext]+1] +
+                                       padding, endIndex)
     return tracks
 
+def intervalIndices(intervals):
+    """ 
+    [start,end) intervals -> List of index Lists (the form 
+    returned by splitTracks / segmentVoice)
+    """
+    return [range(start,end) for (start,end) in intervals.tolist()]
+
 def detectRuns(assign):
     """ 
     Detect contiguous runs of each label
     
-    Return indices and lengths of runs    
-    """
-    runStarts = [0] # 1st label begins the 1st run
-    for i in range(len(assign)-1):
-        if(assign[i] != assign[i+1]):
-            runStarts.append(i+1)
-    runLengths = []
-    for gs in runStarts:
-        tmp = 0
-        while(gs+tmp < len(assign) and
-              assign[gs+tmp] == assign[gs]):              
-            tmp += 1
-        runLengths.append(tmp)
+    Return indices and lengths of runs (NP arrays)
+    """
+    assign = NP.asarray(assign)
+    # 1st label begins the 1st run, then wherever the label changes
+    runStarts = NP.concatenate(([0],
+                                NP.flatnonzero(assign[1:] != assign[:-1]) + 1))
+    runLengths = NP.diff(NP.append(runStarts,len(assign)))
     return (runStarts,runLengths)
 
-def getMonoAmpSamples(sound,subrate):
+def getMonoAmpSamples(sound,subrate,start=0,end=None):
     """
     Take the maximum absolute amplitude over each stereo
-    channel, subsampling every subrate samples
+    channel, for each block of subrate samples
+
+    sound -- tkSnack.Sound, or filename of a 16-bit PCM WAV
+    start,end -- optionally only look at samples [start,end)
+    """
+    if(isinstance(sound,basestring)):
+        (rate,frames) = WavFile.mapWav(sound)
+        frames = frames[start:end]
+        with Instrument.stage('envelope',len(frames)):
+            return blockLevels(frames,subrate)[0].max(axis=1)
+    # Dump the recording to a temp WAV in one go, then map that
+    # (any stray sample past 'end' falls in a dropped partial block)
+    (fd,fn) = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    try:
+        if(end == None):
+            sound.write(fn,start=start)
+        else:
+            sound.write(fn,start=start,end=end)
+        return getMonoAmpSamples(fn,subrate)
+    finally:
+        os.remove(fn)
+
+def blockLevels(frames,subrate,chunkblocks=64):
+    """
+    Peak absolute amplitude and RMS amplitude of each channel
+    over each block of subrate frames (any trailing partial 
+    block is dropped)
+
+    frames -- PCM frames (dim nframes x channels), e.g. from 
+    WavFile.mapWav -- processed chunkblocks blocks at a time so
+    memory use does not grow with the length of the recording
+
+    Return (peak,rms) each of dim (nblocks x channels)
+    """
+    (nframes,channels) = frames.shape
+    nblocks = nframes // subrate
+    peak = NP.zeros((nblocks,channels))
+    rms = NP.zeros((nblocks,channels))
+    for b in range(0,nblocks,chunkblocks):
+        e = min(b + chunkblocks, nblocks)
+        # View chunk as (blocks x subrate x channels)
+        chunk = NP.reshape(frames[b*subrate:e*subrate],
+                           (e-b,subrate,channels))
+        # Peak from max/min (abs() of -32768 overflows int16)
+        peak[b:e] = NP.maximum(chunk.max(axis=1).astype(NP.int32),
+                               -chunk.min(axis=1).astype(NP.int32))
+        # (sum of squares is exact in 64-bit ints)
+        ichunk = chunk.astype(NP.int64)
+        sumsq = NP.einsum('ijk,ijk->ik',ichunk,ichunk)
+        rms[b:e] = NP.sqrt(sumsq / float(subrate))
+    return (peak,rms)
+
+def trackIntervals(trackAssign,subrate):
+    """
+    Convert subsample index Lists (from splitTracks / segmentVoice)
+    to an NP array (dim ntracks x 2) of [start,end) sample offsets
     """
-    nsamp = sound.info()[0] / subrate
-    (lefts,rights) = (NP.zeros((nsamp,)),NP.zeros((nsamp,)))
-    for i in range(nsamp):
-        (lefts[i],rights[i]) = [int(val) for val 
-                                in sound.sample(i*subrate).split()]
-    lefts = NP.abs(lefts)
-    rights = NP.abs(rights)
-    return NP.maximum(lefts,rights)
+    return NP.array([[min(ta),max(ta)+1] for ta in trackAssign],
+                    NP.int64).reshape((-1,2)) * subrate
 
+def trackConfidence(data,intervals,subrate):
+    """
+    How clearly each track stands out from the gaps next to it:
+    1 - (median level of the louder neighbouring gap) / (median
+    level of the track), from 0 (not at all) to 1
+
+    data -- envelope (getMonoAmpSamples)
+    intervals -- [start,end) sample offsets of each track
+
+    Return List of confidences (None for a track with no gap
+    blocks on either side to compare against)
+    """
+    data = NP.asarray(data)
+    bounds = [(int(s) // subrate,-(-int(e) // subrate)) for (s,e) in intervals]
+    confidence = []
+    for (i,(b,e)) in enumerate(bounds):
+        # Whole blocks between the neighbouring tracks and this one
+        prevend = bounds[i-1][1] if i > 0 else 0
+        nextstart = bounds[i+1][0] if i+1 < len(bounds) else len(data)
+        gaps = [g for g in [data[prevend:b],data[e:nextstart]] if len(g) > 0]
+        track = data[b:e]
+        if(len(gaps) == 0 or len(track) == 0):
+            confidence.append(None)
+            continue
+        gaplevel = max([NP.median(g) for g in gaps])
+        tracklevel = max(NP.median(track),1.0)
+        confidence.append(float(NP.clip(1 - gaplevel / tracklevel,0,1)))
+    return confidence
+
+@Instrument.timed('refine')
+def refineTracks(frames,assign,subrate,padding=6,rates=None,span=2):
+    """
+    Like splitTracks, but with sample-accurate cut points
+
+    Every gap/track transition found at the coarse (subrate) 
+    resolution is re-located by refineRunStarts, and each track
+    boundary derived from it is shifted by the same amount
+
+    frames -- PCM frames of the recording (dim nframes x channels)
+
+    Return NP array (dim ntracks x 2) of [start,end) sample offsets
+    """
+    intervals = splitTrackIntervals(assign,padding) * subrate
+    (runStarts,runLengths) = detectRuns(assign)
+    coarse = runStarts[1:] * subrate
+    shift = refineRunStarts(frames,assign,subrate,rates,span) - coarse
+    if(len(coarse) > 0):
+        # Boundaries within padding of a transition came from it
+        nearest = NP.abs(intervals[:,:,NP.newaxis] - 
+                         coarse[NP.newaxis,NP.newaxis,:]).argmin(axis=2)
+        offset = NP.abs(intervals - coarse[nearest])
+        moved = offset <= padding*subrate
+        intervals[moved] += shift[nearest[moved]]
+    return NP.clip(intervals,0,len(frames))
+
+def refineRunStarts(frames,assign,subrate,rates=None,span=2):
+    """
+    Coarse-to-fine location of each gap/track transition
+
+    Starting from the coarse (subrate) run starts, look at a window
+    of +/- span blocks around each transition, compute a finer 
+    envelope (rates[0] samples per block) over just that window, 
+    locate the change point there, and repeat at each finer rate.
+    Only a few windows are ever analysed at high resolution.
+
+    rates -- decreasing samples-per-block for each refinement 
+    level (default subrate/10, /100, /1000, ie about 0.5 ms)
+
+    Return NP array of sample offsets (one per run start after 0)
+    """
+    if(rates == None):
+        rates = [r for r in [subrate // 10, subrate // 100, subrate // 1000]
+                 if r >= 1]
+    (runStarts,runLengths) = detectRuns(assign)
+    refined = []
+    for runStart in runStarts[1:]:
+        (sample,scale) = (runStart * subrate,subrate)
+        for rate in rates:
+            # Window of +/- span blocks at the previous resolution
+            lo = max(0,sample - span*scale)
+            hi = min(len(frames),sample + span*scale)
+            # Finer envelope over the window (log RMS, max over channels)
+            rms = blockLevels(frames[lo:hi],rate)[1].max(axis=1)
+            if(len(rms) >= 2):
+                sample = lo + changePoint(NP.log1p(rms)) * rate
+            scale = rate
+        refined.append(sample)
+    return NP.array(refined,NP.int64)
+
+def changePoint(x):
+    """
+    Single change point of x: index k which minimizes the squared
+    error of fitting x[:k] and x[k:] with their own means
+    """
+    n = len(x)
+    csum = NP.cumsum(x)[:-1]
+    k = NP.arange(1,n)
+    # Minimizing the squared error <=> maximizing this
+    score = csum**2 / k + (csum[-1] + x[-1] - csum)**2 / (n - k)
+    return int(score.argmax()) + 1
+
+@Instrument.timed('decode')
 def viterbiDecoding(data, initprob, transition, stateparam):
     """
     Given HMM parameters, return most probable 
     hidden state sequence (the viterbi decoding)
 
-    data -- observed data (dim T)
+    data -- observed data (dim T, or dim T x D feature vectors)
     initprob -- initial distribution over states
     transition -- state transition matrix (dim S x S)
-    stateparam -- state likelihood parameters (mu,sigma)
+    stateparam -- state likelihood parameters (mu,sigma), see
+    stateLogLikes
 
     Return value is NP array of hidden state assignments
     """       
-    (T,S) = (len(data),len(stateparam))
-
     # Log-likes for each state-observation pair (dim S x T)
+    loglikes = stateLogLikes(data,stateparam)
+
+    # Log initial / transition probabilities
+    loginit = NP.log(initprob)
+    logtransition = NP.log(transition)
+
+    # 2-state 'sticky' HMM (our track/gap model) has a closed 
+    # form recurrence which avoids any per-timestep Python code
+    if(isStickyTwoState(logtransition)):
+        return twoStateViterbi(loglikes,loginit,logtransition)
+
+    # Otherwise fall back on the generic max-product recurrence
+    (finalstate,trackback) = viterbiForward(loglikes,loginit,logtransition)
+    return followTrackback(finalstate,trackback)
+
+def stateLogLikes(data,stateparam):
+    """ 
+    Gaussian log-likelihood of each observation 
+    under each state (dim S x T)
+
+    data -- scalar observations (dim T), or feature vectors (dim
+    T x D), in which case each state's (mu,sigma) are length-D
+    vectors of a diagonal Gaussian (see Features)
+    """
+    (T,S) = (len(data),len(stateparam))
     loglikes = NP.zeros((S,T))
+    multivariate = NP.ndim(data) == 2
     for (si,(mu,sigma)) in enumerate(stateparam):
-        loglikes[si,:] = logGauss(data,mu,sigma).T
+        if(multivariate):
+            ll = logGauss(data,NP.asarray(mu),NP.asarray(sigma))
+            loglikes[si,:] = ll.sum(axis=1)
+        else:
+            loglikes[si,:] = logGauss(data,mu,sigma).T
+    return loglikes
 
-    # Log transition probabilities (dim S x S)
-    logtransition = NP.log(transition)
+def isStickyTwoState(logtransition):
+    """
+    Does this 2-state transition matrix favor staying put?
+    (log A_00 + log A_11 >= log A_01 + log A_10)
+
+    Under this condition the Viterbi trackback pointers can never
+    'swap' the two states, which is what makes the closed form work
+    """
+    if(logtransition.shape != (2,2)):
+        return False
+    return (logtransition[0,0] + logtransition[1,1] >=
+            logtransition[0,1] + logtransition[1,0])
+
+def twoStateViterbi(loglikes, loginit, logtransition):
+    """
+    Closed-form Viterbi decoding for a sticky 2-state HMM
+
+    Only the score difference d_t = maxll[1,t] - maxll[0,t] matters,
+    and it obeys d_t = clamp(d_{t-1},lo,hi) + w_t for constant bounds
+    (lo,hi) and per-step offsets w_t.  Maps of that form are closed
+    under composition, so all d_t come out of a parallel prefix scan
+    (log2(T) vectorized passes) instead of a loop over t.
+
+    Trackback pointers are then just threshold tests on d_{t-1},
+    and since they never swap states the backtrace is a single
+    'next reset point' lookup (again no per-timestep Python code).
+
+    Note the scan re-associates floating point sums, so on exact 
+    score ties the path may differ from the step-by-step recurrence.
+    (The scan runs over fixed blocks of scanblock timesteps, so the
+    result never depends on how the sequence was fed in, see
+    viterbiCheckpointed.)
+    """
+    T = loglikes.shape[1]
+    # Back pointer thresholds: come from state 1 into state 0 
+    # iff d > hi, come from state 1 into state 1 iff d > lo
+    lo = logtransition[0,1] - logtransition[1,1]
+    hi = logtransition[0,0] - logtransition[1,0]
+    # Score difference at t = 0, then t = 1...T-1
+    diffs = NP.empty((T,))
+    diffs[0] = loginit[1] + loglikes[1,0] - loginit[0] - loglikes[0,0]
+    diffs[1:] = twoStateDiffs(diffs[0],loglikes[:,1:],logtransition)
+
+    # Reset points: wherever both back pointers agree, the state is
+    # fixed no matter which state follows it (same indexing as 
+    # followTrackback: pointer column t, built from d_{t-1}, sets the
+    # state at t given the state at t+1, and column 0 is all zeros)
+    prev = diffs[:-2]
+    resetone = prev > hi
+    resetzero = prev <= lo
+    # Ties go to state 0 (same as NP.argmax)
+    finalstate = 1 if diffs[-1] > 0 else 0
+    resetval = NP.zeros((T,), NP.int)
+    resetval[1:-1] = resetone
+    resetval[-1] = finalstate
+    isreset = NP.ones((T,), NP.bool_)
+    isreset[1:-1] = resetone | resetzero
+    # State at t is set by the first reset point at or after t
+    where = NP.where(isreset, NP.arange(T), T)
+    nextreset = NP.minimum.accumulate(where[::-1])[::-1]
+    return resetval[nextreset]
+
+def twoStateDiffs(d0, loglikes, logtransition):
+    """
+    Score differences d_t = maxll[1,t] - maxll[0,t] over a block 
+    of observations (dim 2 x n), given d0 for the timestep just 
+    before the block
+    """
+    n = loglikes.shape[1]
+    lo = logtransition[0,1] - logtransition[1,1]
+    hi = logtransition[0,0] - logtransition[1,0]
+    diffs = NP.empty((n,))
+    for b in range(0,n,scanblock):
+        e = min(b + scanblock, n)
+        # Per-step offsets w_t
+        offsets = (logtransition[1,1] - logtransition[0,0] +
+                   loglikes[1,b:e] - loglikes[0,b:e])
+        # Each step is the map x -> clamp(x + shift, floor, ceil)
+        (shift,floor,ceil) = clampScan(offsets, lo + offsets, hi + offsets)
+        diffs[b:e] = NP.minimum(NP.maximum(d0 + shift, floor), ceil)
+        d0 = diffs[e-1]
+    return diffs
+
+def clampScan(shift, floor, ceil):
+    """
+    Inclusive prefix composition of the maps 
+    f_t(x) = min(max(x + shift_t, floor_t), ceil_t)
 
-    # maxll_it = max loglike of all length-t seqs 
-    # which are in state i at time t (dim S x T)
-    maxll = NP.zeros((S,T))
+    Composing two such maps gives another one:
+    g(f(x)) = clamp(x + s_f + s_g, 
+                    clamp(lo_f + s_g, lo_g, hi_g), 
+                    clamp(hi_f + s_g, lo_g, hi_g))
+    so we use Hillis-Steele doubling, one vectorized pass per bit of T
+
+    Return (shift,floor,ceil) of f_t o ... o f_0 for each t
+    (scans along the last axis, so several sequences can be
+    scanned at once as rows of a 2-d array)
+    """
+    (shift,floor,ceil) = (shift.copy(),floor.copy(),ceil.copy())
+    step = 1
+    while(step < shift.shape[-1]):
+        # Compose current map (later) with the one 'step' back (earlier)
+        (s,lo,hi) = (shift[...,step:],floor[...,step:],ceil[...,step:])
+        newfloor = NP.minimum(NP.maximum(floor[...,:-step] + s, lo), hi)
+        newceil = NP.minimum(NP.maximum(ceil[...,:-step] + s, lo), hi)
+        shift[...,step:] = shift[...,:-step] + s
+        floor[...,step:] = newfloor
+        ceil[...,step:] = newceil
+        step *= 2
+    return (shift,floor,ceil)
+
+def viterbiForward(loglikes, loginit, logtransition):
+    """
+    Generic (any number of states) Viterbi forward pass
+
+    Return most likely final state and trackback matrix (dim S x T)
+    """
+    (S,T) = loglikes.shape
 
-    # trackback pointers (dim S x T)
+    # trackback pointers (stored dim T x S so each step writes
+    # one contiguous row, returned as a dim S x T view)
     # (for maxll_it, which state did we 'come from' at time t-1?)
-    trackback =  NP.zeros((S,T), NP.int)
+    trackback = NP.zeros((T,S), indexType(S))
 
-    # Init from state 0
-    maxll[:,0] = NP.log(initprob) + loglikes[:,0]
+    # maxll_i = max loglike of all length-t seqs which are 
+    # in state i at time t (only need the current t)
+    maxll = loginit + loglikes[:,0]
+    prevtrans = NP.empty((S,S))
+    loglikesT = NP.ascontiguousarray(loglikes.T)
 
-    # Calc maxll over t=1...T
+    # Calc maxll over t=1...T, re-using the same buffers
     for t in range(1,T):
         # loglikes of being in each prev state, transitioning
         # into this one, and generating the observed data
-        prevtrans =  NP.reshape(maxll[:,t-1],(S,1)) + logtransition
+        NP.add(maxll[:,NP.newaxis], logtransition, out=prevtrans)
         # For each column (state at time t), keep trackback 
         # pointer of argmax over rows (states at time t-1) 
-        trackback[:,t] = prevtrans.argmax(axis=0)
+        trackback[t] = prevtrans.argmax(axis=0)
         # Use max of prevstate + transitions to calc max 
         # loglike of being in each state at time t
-        maxll[:,t] = prevtrans.max(axis=0) + loglikes[:,t]
+        NP.add(prevtrans.max(axis=0), loglikesT[t], out=maxll)
+    return (NP.argmax(maxll),trackback.T)
 
-    # Start from the end and follow trackback pointers
-    # back to the beginning to get the most probable 
-    # hidden state sequence  (ie, the viterbi decoding/parse)
-    return followTrackback(NP.argmax(maxll[:,-1]),trackback)
+def forwardBlock(loglikes, maxll, logtransition):
+    """
+    Continue the Viterbi forward pass over a new block of 
+    observations (dim S x n), given maxll for the timestep 
+    just before the block
+
+    Return (maxll at the last timestep, trackback columns dim S x n)
+    """
+    (S,n) = loglikes.shape
+    if(isStickyTwoState(logtransition)):
+        # Only the score difference matters, so keep maxll as [0,d]
+        lo = logtransition[0,1] - logtransition[1,1]
+        hi = logtransition[0,0] - logtransition[1,0]
+        prev = NP.empty((n+1,))
+        prev[0] = maxll[1] - maxll[0]
+        prev[1:] = twoStateDiffs(prev[0],loglikes,logtransition)
+        trackback = NP.vstack((prev[:-1] > hi, prev[:-1] > lo))
+        return (NP.array([0.0,prev[-1]]),trackback.astype(NP.uint8))
+    trackback = NP.zeros((n,S), indexType(S))
+    maxll = NP.array(maxll, NP.float64)
+    prevtrans = NP.empty((S,S))
+    loglikesT = NP.ascontiguousarray(loglikes.T)
+    for t in range(n):
+        NP.add(maxll[:,NP.newaxis], logtransition, out=prevtrans)
+        trackback[t] = prevtrans.argmax(axis=0)
+        NP.add(prevtrans.max(axis=0), loglikesT[t], out=maxll)
+    return (maxll,trackback.T)
 
 def followTrackback(finalstate,trackback):
     """ 
     Follow trackback matrix from most likely final 
     state to construct most likely state sequence
     """
-    # Build up in reverse chronological order
-    stateseq =  [finalstate]
-    for backstep in range(2,trackback.shape[1] + 1):
-        stateseq.append(trackback[stateseq[-1], -backstep])
     # Return result in chronological order
-    stateseq.reverse()
-    return stateseq
+    return backtraceMaps(trackback)[finalstate,:].astype(NP.int)
+
+def backtraceMaps(trackback):
+    """
+    For each timestep t, the state at t as a function of the final
+    state (dim S x T, row = final state)
+
+    Vectorized by pointer doubling: after pass k, column t holds 
+    the state at time t as a function of the state at time t+2^k,
+    so log2(T) passes get us all the way back from the final state
+    """
+    (S,T) = trackback.shape
+    # Column t maps state at t+1 -> state at t (last column = identity)
+    jump = NP.empty((S,T), trackback.dtype)
+    jump[:,:-1] = trackback[:,:-1]
+    jump[:,-1] = NP.arange(S)
+    step = 1
+    while(step < T):
+        # state at t as a function of state at t+2*step
+        jump[:,:-step] = jump[jump[:,step:],NP.arange(T-step)]
+        step *= 2
+    return jump
+
+def indexType(S):
+    """ Smallest unsigned int type which can hold state indices < S """
+    for dtype in [NP.uint8,NP.uint16,NP.uint32]:
+        if(S <= NP.iinfo(dtype).max + 1):
+            return dtype
+    return NP.uint64
+
+@Instrument.timed('decode')
+def viterbiCheckpointed(data, initprob, transition, stateparam,
+                        segment=None):
+    """
+    Memory-bounded version of viterbiDecoding (same arguments, 
+    identical result)
+
+    The forward pass only keeps the scores at the start of every 
+    <segment> timesteps (default sqrt(T)), and never holds more 
+    than one segment of log-likelihoods.  The backtrace then works
+    from the last segment to the first, recomputing each segment's
+    trackback pointers (as the smallest int type) from its 
+    checkpoint.  This costs one extra forward pass, but needs only
+    O(T / segment + segment) working memory instead of O(S x T).
+
+    For the sticky 2-state closed form, each segment's pointers are
+    bit-packed (see packTwoState) and followed by a lookup of reset
+    points (twoStateBacktrace) instead of backtraceMaps.  Its scan
+    runs over fixed blocks of scanblock timesteps though, and only
+    whole blocks give bit-identical scores, so there segment is
+    rounded up to a multiple of scanblock: the working memory never
+    goes below one block (a few MB).
+    """
+    (T,S) = (len(data),len(stateparam))
+    loginit = NP.log(initprob)
+    logtransition = NP.log(transition)
+    twostate = isStickyTwoState(logtransition)
+    if(segment == None):
+        segment = int(NP.ceil(NP.sqrt(T)))
+    if(twostate):
+        segment = scanblock * int(NP.ceil(segment / float(scanblock)))
+
+    # Initial scores (computed exactly as viterbiDecoding does)
+    loglikes = stateLogLikes(data[:1],stateparam)
+    if(twostate):
+        maxll = NP.array([0.0, loginit[1] + loglikes[1,0] - 
+                          loginit[0] - loglikes[0,0]])
+    else:
+        maxll = loginit + loglikes[:,0]
+
+    # Forward pass, keeping only segment checkpoints
+    # (segments cover t = 1...T-1)
+    starts = range(1,T,segment)
+    checkpoints = []
+    for start in starts:
+        checkpoints.append(maxll)
+        loglikes = stateLogLikes(data[start:start+segment],stateparam)
+        maxll = forwardBlock(loglikes,maxll,logtransition)[0]
+    state = NP.argmax(maxll)
+
+    # Backtrace one recomputed segment at a time
+    assign = NP.empty((T,), NP.int)
+    for (start,checkpoint) in reversed(zip(starts,checkpoints)):
+        end = min(start + segment, T)
+        loglikes = stateLogLikes(data[start:end],stateparam)
+        trackback = forwardBlock(loglikes,checkpoint,logtransition)[1]
+        if(twostate):
+            packed = packTwoState(trackback)
+            del trackback
+            if(end < T):
+                state = twoStateBacktrace(packed,end - start,state,True)
+            assign[start:end] = twoStateBacktrace(packed,end - start,state)
+        else:
+            if(end < T):
+                # State at the end of this segment, given the next one
+                state = trackback[state,-1]
+            assign[start:end] = backtraceMaps(trackback)[state,:]
+        state = assign[start]
+    # 1st trackback column is all zeros (see viterbiForward)
+    assign[0] = 0 if T > 1 else state
+    return assign
+
+def packTwoState(trackback):
+    """
+    Bit-packed form of a sticky 2-state trackback (dim 2 x n)
+
+    Pointers never swap the states (see isStickyTwoState), so each
+    column either keeps the state or resets it to trackback[0,t]:
+    return packed bits of (resets, reset states)
+    """
+    return (NP.packbits(trackback[0] == trackback[1]),
+            NP.packbits(trackback[0]))
+
+def twoStateBacktrace(packed, n, state, last=False):
+    """
+    States along n timesteps of a packed 2-state trackback (as
+    backtraceMaps(trackback)[state,:]), or with last, the state
+    at the last timestep given <state> just after the block
+    """
+    (resets,values) = [NP.unpackbits(bits)[:n] for bits in packed]
+    if(last):
+        return values[-1] if resets[-1] else state
+    # (last column maps to itself, as in backtraceMaps)
+    points = NP.flatnonzero(resets[:-1])
+    runs = NP.diff(NP.concatenate(([0],points + 1,[n])))
+    return NP.repeat(NP.append(values[points],state),runs)
+
+def viterbiBatch(data, initprob, transition, stateparam, lengths=None):
+    """
+    Decode a whole batch of sequences and/or parameter sets at once,
+    each row giving what viterbiDecoding would (up to exact score
+    ties, see twoStateBatch)
+
+    data -- (dim B x T) stack of sequences, padded to a common 
+    length T, or a single sequence (dim T) to decode under each of
+    B parameter sets
+    initprob -- (dim S) or one per row (dim B x S)
+    transition -- (dim S x S) or one per row (dim B x S x S)
+    stateparam -- (mu,sigma) of each state (dim S x 2) or one set 
+    per row (dim B x S x 2)
+    lengths -- actual length of each row (default T)
+
+    Rows with a sticky 2-state HMM go through twoStateBatch, the
+    rest through viterbiForwardBatch; each is a single Python loop
+    over t for the whole batch, so the cost per row falls as the
+    batch grows.  (Batches of fewer than minbatch rows are simply 
+    decoded one row at a time with viterbiDecoding.)
+
+    Return NP array (dim B x T) of state assignments (0 past the
+    end of each row)
+    """
+    data = NP.asarray(data, NP.float64)
+    (initprob,transition,stateparam) = [NP.asarray(p, NP.float64) for p in
+                                        (initprob,transition,stateparam)]
+    if(data.ndim == 1):
+        data = data[NP.newaxis,:]
+    if(initprob.ndim == 1):
+        initprob = initprob[NP.newaxis,:]
+    if(transition.ndim == 2):
+        transition = transition[NP.newaxis,:,:]
+    if(stateparam.ndim == 2):
+        stateparam = stateparam[NP.newaxis,:,:]
+    B = max(len(data),len(initprob),len(transition),len(stateparam))
+    T = data.shape[1]
+    data = NP.broadcast_to(data,(B,T))
+    initprob = NP.broadcast_to(initprob,(B,) + initprob.shape[1:])
+    transition = NP.broadcast_to(transition,(B,) + transition.shape[1:])
+    stateparam = NP.broadcast_to(stateparam,(B,) + stateparam.shape[1:])
+    if(lengths is None):
+        lengths = NP.repeat(T,B)
+    lengths = NP.asarray(lengths)
+    if(B < minbatch):
+        assign = NP.zeros((B,T), NP.int)
+        for b in range(B):
+            assign[b,:lengths[b]] = viterbiDecoding(data[b,:lengths[b]],
+                                                    initprob[b],
+                                                    transition[b],
+                                                    stateparam[b])
+        return assign
+
+    # Log-likes of each row / state / observation (dim B x S x T)
+    # (a shared sequence only needs them once per distinct stateparam)
+    if(data.strides[0] == 0):
+        (params,inverse) = NP.unique(stateparam.reshape((B,-1)),axis=0,
+                                     return_inverse=True)
+        params = params.reshape((-1,) + stateparam.shape[1:])
+        loglikes = logGauss(data[:1,NP.newaxis,:],
+                            params[:,:,0,NP.newaxis],
+                            params[:,:,1,NP.newaxis])[inverse]
+    else:
+        loglikes = logGauss(data[:,NP.newaxis,:],
+                            stateparam[:,:,0,NP.newaxis],
+                            stateparam[:,:,1,NP.newaxis])
+    loginit = NP.log(initprob)
+    logtransition = NP.log(transition)
+
+    assign = NP.zeros((B,T), NP.int)
+    if(logtransition.shape[1:] == (2,2)):
+        sticky = (logtransition[:,0,0] + logtransition[:,1,1] >=
+                  logtransition[:,0,1] + logtransition[:,1,0])
+    else:
+        sticky = NP.zeros((B,), NP.bool_)
+    for (rows,decode) in [(NP.flatnonzero(sticky),twoStateBatch),
+                          (NP.flatnonzero(~sticky),viterbiForwardBatch)]:
+        if(len(rows) > 0):
+            assign[rows] = decode(loglikes[rows],loginit[rows],
+                                  logtransition[rows],lengths[rows])
+    assign[NP.arange(T)[NP.newaxis,:] >= lengths[:,NP.newaxis]] = 0
+    return assign
+
+def twoStateBatch(loglikes, loginit, logtransition, lengths):
+    """
+    Sticky 2-state decoding (as twoStateViterbi) for a batch of rows
+    (loglikes dim B x 2 x T), each with its own HMM and length
+
+    Here the score differences d_t = clamp(d_{t-1},lo,hi) + w_t are
+    stepped through t for all rows at once (3 vector operations of
+    length B per step), which for large batches beats a prefix scan
+    per row.  This re-associates floating point sums differently, 
+    so paths may differ from twoStateViterbi on exact score ties.
+    """
+    (B,S,T) = loglikes.shape
+    rows = NP.arange(B)
+    lo = logtransition[:,0,1] - logtransition[:,1,1]
+    hi = logtransition[:,0,0] - logtransition[:,1,0]
+    # Per-step offsets w_t, stored dim T x B (one row per step)
+    offsets = NP.ascontiguousarray((logtransition[:,1,1,NP.newaxis] - 
+                                    logtransition[:,0,0,NP.newaxis] +
+                                    loglikes[:,1,:] - loglikes[:,0,:]).T)
+    diffs = NP.empty((T,B))
+    diffs[0] = loginit[:,1] + loglikes[:,1,0] - loginit[:,0] - loglikes[:,0,0]
+    clamped = NP.empty((B,))
+    for t in range(1,T):
+        NP.maximum(diffs[t-1], lo, out=clamped)
+        NP.minimum(clamped, hi, out=clamped)
+        NP.add(clamped, offsets[t], out=diffs[t])
+    diffs = diffs.T
+
+    # Reset points as in twoStateViterbi, with the final state 
+    # (decided at each row's own end) holding from there on
+    times = NP.arange(T)[NP.newaxis,:]
+    finalstate = (diffs[rows,lengths-1] > 0).astype(NP.int)
+    isreset = NP.ones((B,T), NP.bool_)
+    resetval = NP.zeros((B,T), NP.int)
+    resetone = diffs[:,:-1] > hi[:,NP.newaxis]
+    isreset[:,1:] = resetone | (diffs[:,:-1] <= lo[:,NP.newaxis])
+    resetval[:,1:] = resetone
+    isreset[:,0] = True
+    resetval[:,0] = 0
+    tail = times >= (lengths - 1)[:,NP.newaxis]
+    isreset[tail] = True
+    resetval = NP.where(tail, finalstate[:,NP.newaxis], resetval)
+    where = NP.where(isreset, times, T)
+    nextreset = NP.minimum.accumulate(where[:,::-1],axis=1)[:,::-1]
+    return resetval[rows[:,NP.newaxis],nextreset]
+
+def viterbiForwardBatch(loglikes, loginit, logtransition, lengths):
+    """
+    viterbiForward + followTrackback for a batch of rows 
+    (loglikes dim B x S x T), each with its own HMM and length,
+    stepping through t for all rows at once
+    """
+    (B,S,T) = loglikes.shape
+    rows = NP.arange(B)
+    # (dim T x B x S so each step reads / writes one contiguous block)
+    loglikesT = NP.ascontiguousarray(loglikes.transpose((2,0,1)))
+    trackback = NP.zeros((T,B,S), indexType(S))
+    maxll = loginit + loglikesT[0]
+    prevtrans = NP.empty((B,S,S))
+    finalstate = NP.zeros((B,), NP.int)
+    ending = dict([(t,NP.flatnonzero(lengths - 1 == t))
+                   for t in NP.unique(lengths - 1)])
+    for t in range(T):
+        if(t > 0):
+            NP.add(maxll[:,:,NP.newaxis], logtransition, out=prevtrans)
+            trackback[t] = prevtrans.argmax(axis=1)
+            NP.add(prevtrans.max(axis=1), loglikesT[t], out=maxll)
+        if(t in ending):
+            finalstate[ending[t]] = NP.argmax(maxll[ending[t]],axis=1)
+    # Backtrace (same indexing as followTrackback: pointer column t 
+    # gives the state at t from the state at t+1, column 0 is zeros)
+    assign = NP.empty((T,B), NP.int)
+    state = finalstate
+    for t in range(T-1,-1,-1):
+        state = NP.where(t < lengths - 1, trackback[t,rows,state], state)
+        assign[t] = state
+    return assign.T
+
+def durationDecoding(data, initprob, transition, stateparam, 
+                     mindur, maxdur=None):
+    """
+    Explicit-duration (semi-Markov) Viterbi decoding: most probable
+    state sequence under the HMM (same arguments as viterbiDecoding)
+    subject to every run of state s lasting between mindur[s] and 
+    maxdur[s] timesteps (the first and last runs only have to obey
+    the maximum, as the recording may start or stop in the middle
+    of one)
+
+    mindur -- List of minimum run length per state (at least 1)
+    maxdur -- List of maximum run length per state (None = no limit),
+    or None for no limits at all
+
+    With the self-transitions folded into the emissions, the best 
+    score of a run of s ending at t is C_s[t] + max over run starts
+    u in [t-maxdur,t-mindur] of G_s[u] (C = cumulative scores, G =
+    best score of entering s at u, less C_s[u]).  Those window maxima
+    only look back at least mindur[s] timesteps, so the recurrence
+    is run over whole chunks of timesteps at once (as long as the 
+    second shortest minimum, e.g. the minimum track length when 
+    the minimum gap is shorter), with the window max over G read 
+    off a running prefix max (no maximum) or a sparse table (see
+    RunStarts).  The cost is O(S^2 T + S T log maxdur) however long
+    the runs may be, with one Python iteration per chunk.
+
+    Boundaries follow the viterbiDecoding convention (every run 
+    after the first starts one timestep late), so with mindur = 1
+    and no maximum the result is that of viterbiDecoding.
+
+    Return NP array of hidden state assignments
+    """
+    (T,S) = (len(data),len(stateparam))
+    if(maxdur == None):
+        if(max(mindur) <= 1):
+            # No limits at all
+            return viterbiDecoding(data,initprob,transition,stateparam)
+        maxdur = [None] * S
+    maxdur = [T if m == None else min(m,T) for m in maxdur]
+    loglikes = stateLogLikes(data,stateparam)
+    loginit = NP.log(initprob)
+    logtransition = NP.log(transition)
+    logstay = NP.diag(logtransition)
+    # C_s[t] = sum of (loglike + self-transition) over [0,t)
+    cumll = NP.zeros((S,T+1))
+    NP.cumsum(loglikes + logstay[:,NP.newaxis], axis=1, out=cumll[:,1:])
+    # Score of a first run (starting at 0) less C_s[0]
+    firstrun = loginit - logstay
+    # Entering s at u from another state (switch less the stay 
+    # already counted in C), with diagonal excluded
+    switch = logtransition - logstay[NP.newaxis,:]
+    NP.fill_diagonal(switch,-NP.inf)
+
+    # F[t] = best score of [0,t) with the last run ending at t, 
+    # for each state; G_s[u] / pred_s[u] = best score / previous 
+    # state for a run of s starting at u; start_s[t] = where the 
+    # best run of s ending at t started (0 = first run)
+    F = NP.empty((T+1,S))
+    G = NP.full((S,T+1), -NP.inf)
+    pred = NP.zeros((S,T+1), NP.int)
+    start = NP.zeros((S,T+1), NP.int)
+    runstarts = [RunStarts(T+1,None if maxdur[s] >= T-1 else
+                           maxdur[s] - mindur[s] + 1) for s in range(S)]
+    def enter(s,u):
+        # Runs of s starting at u (after a run of another state)
+        entry = F[u] + switch[:,s][NP.newaxis,:]
+        pred[s,u] = entry.argmax(axis=1)
+        G[s,u] = entry.max(axis=1) - cumll[s,u]
+        runstarts[s].extend(G[s],u[0],u[-1] + 1)
+
+    # Going through the states from the longest minimum down, state 
+    # s in a chunk only needs runs which started at least mindur[s]
+    # before, i.e. before the chunk, except for the last state (with
+    # the shortest minimum): it can be done after the others' runs 
+    # within the chunk
+    order = sorted(range(S), key=lambda s: -mindur[s])
+    last = order[-1]
+    chunk = min([mindur[s] for s in order[:-1]] + [T])
+    for a in range(1,T+1,chunk):
+        t = NP.arange(a,min(a + chunk,T + 1))
+        u = t[t < T]
+        for s in order:
+            if(s == last and len(u) > 0):
+                enter(s,u)
+            (best,v) = runstarts[s].query(NP.maximum(t - maxdur[s],1),
+                                          t - mindur[s])
+            first = NP.where(t <= maxdur[s], firstrun[s], -NP.inf)
+            later = best > first
+            F[t,s] = cumll[s,t] + NP.where(later,best,first)
+            start[s,t] = NP.where(later,v,0)
+        if(len(u) > 0):
+            for s in order[:-1]:
+                enter(s,u)
+
+    # Last run: any length up to the maximum (or the first run)
+    final = NP.empty((S,))
+    finalstart = NP.empty((S,), NP.int)
+    for s in range(S):
+        lo = max(1,T-maxdur[s])
+        u = G[s,lo:T].argmax() + lo if lo < T else 0
+        first = firstrun[s] if T <= maxdur[s] else -NP.inf
+        if(lo < T and G[s,u] > first):
+            (final[s],finalstart[s]) = (cumll[s,T] + G[s,u],u)
+        else:
+            (final[s],finalstart[s]) = (cumll[s,T] + first,0)
+    if(NP.isneginf(final.max())):
+        raise ValueError('No state sequence satisfies the duration limits')
+
+    # Backtrace run by run, each run after the first from u+1 on
+    assign = NP.empty((T,), NP.int)
+    s = final.argmax()
+    (t,u) = (T,finalstart[s])
+    while(u > 0):
+        assign[u+1:t] = s
+        (s,t) = (pred[s,u],u + 1)
+        u = start[s,u]
+    assign[:t] = s
+    return assign
+
+class RunStarts:
+    """
+    Window max over the entry scores G_s[u] of one state, for 
+    durationDecoding: G is filled in left to right, and each query
+    asks for the max (and latest argmax) over u in [lo,hi] for 
+    windows no wider than <width>
+
+    Unbounded windows (width None: lo is always 1) only need a 
+    running prefix max.  Otherwise a sparse table keeps the max 
+    over [u,u+2^k) for 2^k <= width, and any window is covered by
+    two (overlapping) entries of one level.
+    """
+    def __init__(self, n, width):
+        self.prefix = (width == None)
+        levels = 1 if self.prefix else int(NP.log2(max(width,1))) + 1
+        self.value = NP.full((levels,n), -NP.inf)
+        self.index = NP.zeros((levels,n), NP.int)
+
+    def extend(self, G, a, b):
+        """ G[a:b] have just been filled in (a >= 1) """
+        (value,index) = (self.value,self.index)
+        if(self.prefix):
+            # Ties go to the later run start (as for the table)
+            v = G[a-1:b].copy()
+            v[0] = value[0,a-1]
+            i = NP.arange(a-1,b)
+            i[0] = index[0,a-1]
+            run = NP.maximum.accumulate(v)
+            value[0,a:b] = run[1:]
+            index[0,a:b] = NP.maximum.accumulate(NP.where(v == run,i,0))[1:]
+            return
+        value[0,a:b] = G[a:b]
+        index[0,a:b] = NP.arange(a,b)
+        for k in range(1,len(value)):
+            # Entries whose span [u,u+2^k) just became complete
+            half = 1 << (k-1)
+            (lo,hi) = (max(a - 2*half + 1,1),b - 2*half + 1)
+            if(hi <= lo):
+                break
+            (left,right) = (slice(lo,hi),slice(lo + half,hi + half))
+            later = value[k-1,right] >= value[k-1,left]
+            value[k,left] = NP.where(later,value[k-1,right],value[k-1,left])
+            index[k,left] = NP.where(later,index[k-1,right],index[k-1,left])
+
+    def query(self, lo, hi):
+        """ 
+        (max,argmax) of G over [lo,hi] for arrays of windows 
+        (-inf where the window is empty)
+        """
+        empty = hi < lo
+        if(self.prefix):
+            hi = NP.maximum(hi,0)
+            return (NP.where(empty,-NP.inf,self.value[0,hi]),
+                    self.index[0,hi])
+        lo = NP.where(empty,0,lo)
+        hi = NP.where(empty,0,hi)
+        k = NP.floor(NP.log2(hi - lo + 1)).astype(NP.int)
+        left = lo
+        right = hi - (1 << k) + 1
+        righter = self.value[k,right] >= self.value[k,left]
+        value = NP.where(righter,self.value[k,right],self.value[k,left])
+        index = NP.where(righter,self.index[k,right],self.index[k,left])
+        return (NP.where(empty,-NP.inf,value),index)
+
+def durationTracks(data, mintrack, mingap, maxtrack=None, maxgap=None):
+    """
+    Track/gap state (1/0) of each subsample under the trackHMM with
+    minimum (and optionally maximum) track and gap lengths, in
+    subsamples (feed the result to splitTracks)
+    """
+    (initprob,transition,stateparam) = trackHMM(data.mean(),data.std())
+    return durationDecoding(data,initprob,transition,stateparam,
+                            [mingap,mintrack],[maxgap,maxtrack])
 
 def logGauss(X,mu,sigma):
     """ Gaussian log-likelihood of x | mu,sigma """
     ll = -0.5 * NP.log(2 * NP.pi * sigma**2)
-    ll -= NP.power(X-mu,2) / (2 * sigma**2)
+    ll = ll - NP.power(X-mu,2) / (2 * sigma**2)
     return ll
+
+class OnlineSegmentor:
+    """
+    Fixed-lag version of segmentTracks, fed blocks of sample
+    amplitudes while the tape is still recording
+
+    Each push() advances the Viterbi forward pass over the new 
+    samples and commits the state of every subsample which either 
+    (1) all surviving paths agree on (so the offline Viterbi path 
+    can never change there), or (2) is more than <lag> subsamples
+    old, in which case we go with the current best path.  
+    At STOP, flush() only has to commit the last few subsamples.
+
+    With the same HMM parameters and a large enough lag, the 
+    committed states are exactly those of viterbiDecoding.  If no
+    stateparam is given, the emission model is re-estimated from 
+    the running mean / std dev of all samples seen so far: then
+    every push re-scores the whole pending window under the new
+    estimate (from the scores where the window starts), and
+    nothing is committed on convergence alone before <settle>
+    samples have been seen -- early estimates can be far off (e.g.
+    tape hiss before the music starts looks like a track).
+    """
+
+    def __init__(self, stateparam=None, lag=100,
+                 initprob=None, transition=None, settle=100):
+        (hmminit,hmmtransition,hmmparam) = trackHMM(0.0,1.0)
+        if(initprob is None):
+            initprob = hmminit
+        if(transition is None):
+            transition = hmmtransition
+        self.loginit = NP.log(initprob)
+        self.logtransition = NP.log(transition)
+        self.stateparam = stateparam
+        self.lag = lag
+        self.settle = settle
+        # Scores of the most recent subsample (None until 1st push)
+        self.maxll = None
+        # Scores just before the pending window (None = start of
+        # the recording), and the emission model last used
+        self.startll = None
+        self.lastparam = stateparam
+        # Samples / trackback columns of subsamples not committed yet
+        self.pendingdata = NP.zeros((0,), NP.float64)
+        self.pending = NP.zeros((len(initprob),0), NP.int)
+        # Committed state assignments (List of NP arrays)
+        self.committed = []
+        # Running sums for estimating the emission model
+        (self.count,self.total,self.totalsq) = (0,0.0,0.0)
+
+    def push(self, samples):
+        """ 
+        Add newly recorded sample amplitudes
+
+        Return NP array of newly committed state assignments
+        """
+        samples = NP.asarray(samples, NP.float64)
+        if(len(samples) == 0):
+            return NP.zeros((0,), NP.int)
+        stateparam = self.emissionParams(samples)
+        self.lastparam = stateparam
+        if(self.stateparam is None):
+            # Re-score the pending window under the new estimate
+            self.pendingdata = NP.concatenate((self.pendingdata,samples))
+            (self.maxll,self.pending) = self.forward(self.pendingdata,
+                                                     self.startll,
+                                                     stateparam)
+        else:
+            (self.maxll,trackback) = self.forward(samples,self.maxll,
+                                                  stateparam)
+            self.pending = NP.hstack((self.pending,trackback))
+        return self.commit(False)
+
+    def forward(self, samples, maxll, stateparam):
+        """
+        Viterbi forward pass over samples, from scores maxll (None
+        at the start of the recording)
+
+        Return (scores of the last subsample, trackback columns)
+        """
+        loglikes = stateLogLikes(samples,stateparam)
+        if(maxll is None):
+            # 1st subsample: initial distribution, and (as in 
+            # viterbiForward) an all-zero trackback column
+            maxll = self.loginit + loglikes[:,0]
+            (maxll,trackback) = forwardBlock(loglikes[:,1:],maxll,
+                                             self.logtransition)
+            trackback = NP.hstack((NP.zeros((len(maxll),1), NP.int),
+                                   trackback))
+            return (maxll,trackback)
+        return forwardBlock(loglikes,maxll,self.logtransition)
+
+    def flush(self):
+        """ 
+        Recording is over, commit all remaining subsamples
+
+        Return NP array of newly committed state assignments
+        """
+        if(self.maxll is None):
+            return NP.zeros((0,), NP.int)
+        return self.commit(True)
+
+    def assignments(self):
+        """ All committed state assignments so far """
+        if(len(self.committed) == 0):
+            return NP.zeros((0,), NP.int)
+        return NP.concatenate(self.committed)
+
+    def tracks(self, padding=6):
+        """ Split committed assignments into tracks (see splitTracks) """
+        return splitTracks(self.assignments(),padding)
+
+    def trackIntervals(self, padding=6):
+        """ Split committed assignments into track intervals """
+        return splitTrackIntervals(self.assignments(),padding)
+
+    def emissionParams(self, samples):
+        """ Fixed stateparam, or re-estimate from the running stats """
+        if(self.stateparam is not None):
+            return self.stateparam
+        self.count += len(samples)
+        self.total += samples.sum()
+        self.totalsq += NP.dot(samples,samples)
+        mean = self.total / self.count
+        std = NP.sqrt(max(self.totalsq / self.count - mean**2, 0.0))
+        # (avoid a degenerate model on an all-silent start)
+        return trackHMM(mean,max(std,1e-6))[2]
+
+    def commit(self, final):
+        """ Commit all converged (or too old) pending subsamples """
+        # Row = state at the newest subsample
+        maps = backtraceMaps(self.pending)
+        W = maps.shape[1]
+        if(final):
+            ncommit = W
+        else:
+            # All paths agree from here back to the start
+            disagree = NP.where(NP.any(maps != maps[0,:], axis=0))[0]
+            nconverged = disagree[0] if len(disagree) > 0 else W
+            if(self.stateparam is None and self.count < self.settle):
+                nconverged = 0
+            ncommit = max(nconverged, W - self.lag)
+        newstates = maps[NP.argmax(self.maxll),:ncommit]
+        self.committed.append(newstates)
+        self.pending = self.pending[:,ncommit:]
+        if(self.stateparam is None and ncommit > 0):
+            # Scores where the window now starts
+            self.startll = self.forward(self.pendingdata[:ncommit],
+                                        self.startll,self.lastparam)[0]
+            self.pendingdata = self.pendingdata[ncommit:]
+        return newstates
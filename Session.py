@@ -0,0 +1,136 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Multi-side (e.g. double-sided tape) recording sessions
+
+Each side is recorded to its own capture file and segmented on its
+own (voice or music) as soon as it is finished, e.g. when the tape
+is flipped.  Only the side's track boundaries are kept, written to
+a small JSON session file next to the captures, so nothing of a
+finished side stays in memory however many sides are recorded.
+
+The final burn stitches all sides' tracks into one cue sheet, in
+side order, pointing at one CD image (see imageFile): each capture
+up to the end of its last track, with the side's track gains and
+fades (see Normalize) applied on the way.  The captures themselves
+are never changed, so a side can still be re-segmented (or its
+gains changed) after a failed burn.
+"""
+import json
+import os, os.path
+
+import CDImage
+import Normalize
+import Segmentor
+import WavFile
+
+class TapeSession:
+    """ Sides recorded so far, persisted in sessionfn """
+
+    def __init__(self, sessionfn):
+        self.sessionfn = sessionfn
+        # List of dicts: capture, mode, intervals (List of [start,end)
+        # sample offsets of each track)
+        self.sides = []
+
+    def putSide(self, side, capture, mode, intervals, gains=None,
+                confidence=None):
+        """
+        Record (or replace) side number <side>, save session
+
+        gains -- per-track gains to apply before burning (see
+        Normalize.trackGains), or None to burn the capture as is
+        confidence -- per-track segmentation confidence (see
+        Segmentor.trackConfidence), kept for the archive manifest
+        """
+        entry = {'capture' : capture,
+                 'mode' : mode,
+                 'intervals' : [[int(s),int(e)] for (s,e) in intervals]}
+        if(confidence != None):
+            entry['confidence'] = list(confidence)
+        if(gains is not None):
+            entry['gains'] = [float(g) for g in gains]
+        if(side < len(self.sides)):
+            self.sides[side] = entry
+        else:
+            self.sides.append(entry)
+        self.save()
+
+    def ntracks(self):
+        return sum([len(side['intervals']) for side in self.sides])
+
+    def cueSides(self):
+        """
+        (audio chunks, track starts, end) of each side with tracks,
+        for CDImage.writeImage
+        """
+        sides = []
+        for side in self.sides:
+            if(len(side['intervals']) == 0):
+                continue
+            end = CDImage.trackEnd(side['intervals'])
+            (rate,frames) = WavFile.mapWav(side['capture'])
+            frames = frames[:end]
+            if('gains' in side):
+                chunks = Normalize.captureChunks(frames,side['intervals'],
+                                                 side['gains'],
+                                                 Normalize.fadeFrames(rate))
+            else:
+                chunks = CDImage.frameChunks(frames)
+            sides.append((chunks,CDImage.trackStarts(side['intervals']),end))
+        return sides
+
+    def writeCueSheet(self, cuefn):
+        """ Write the CD image of all sides' tracks, and its cue sheet """
+        sides = self.cueSides()
+        if(len(sides) == 0):
+            raise ValueError('No tracks to burn')
+        (channels,rate) = WavFile.readWavHeader(self.sides[0]['capture'])[:2]
+        imagefn = imageFile(cuefn)
+        (starts,sidestarts) = CDImage.writeImage(imagefn,sides,channels,rate)
+        CDImage.writeCueSheet(cuefn,imagefn,starts,sidestarts)
+
+    def save(self):
+        tmpfn = self.sessionfn + '.tmp'
+        f = open(tmpfn,'w')
+        json.dump({'sides' : self.sides},f,indent=2)
+        f.close()
+        os.rename(tmpfn,self.sessionfn)
+
+    def clear(self):
+        """ Forget all sides (capture files are left alone) """
+        self.sides = []
+        if(os.path.exists(self.sessionfn)):
+            os.remove(self.sessionfn)
+
+def loadSession(sessionfn):
+    """ TapeSession saved in sessionfn (empty if there is none) """
+    session = TapeSession(sessionfn)
+    if(os.path.exists(sessionfn)):
+        session.sides = json.load(open(sessionfn))['sides']
+    return session
+
+def imageFile(cuefn):
+    """ Filename of the CD image, next to cuefn """
+    return os.path.splitext(cuefn)[0] + '.wav'
+
+def sideIntervals(capture, mode, samps, subrate, assign=None):
+    """
+    Track [start,end) sample offsets for one side
+
+    mode -- 'voice' (single track, see Segmentor.voiceIntervals) or
+    'music' (split tracks, with sample-accurate cut points)
+    samps -- envelope of the capture (getMonoAmpSamples)
+    assign -- track/gap path, if already decoded (e.g. online while
+    recording)
+    """
+    if(mode == 'voice'):
+        return Segmentor.voiceIntervals(samps) * subrate
+    if(assign is None):
+        assign = Segmentor.decodeTracks(samps)
+    frames = WavFile.mapWav(capture)[1]
+    return Segmentor.refineTracks(frames,assign,subrate)
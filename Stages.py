@@ -0,0 +1,237 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+The work behind the GUI buttons, minus Tk: everything about the tape
+being ripped (captures, envelope, session, archive, burn settings)
+lives in a TapeJob, and its stage methods are the Pipeline stages the
+GUI runs in the background (see Pipeline).  The GUI only sets the
+user's choices (mode, levels, archiving, copies) before starting a
+pipeline and shows the progress, so the same stages can be run and
+tested without a display.
+"""
+import os,os.path
+import re
+import time
+
+import numpy as NP
+
+import Archive
+import CDImage
+import Normalize
+import Recorder
+import Segmentor
+import Session
+
+class TapeJob:
+    """ State of the tape being ripped, and the stages run on it """
+
+    def __init__(self, datadir, burner, rate=44100, subrate=20000):
+        """
+        datadir -- where captures, cue sheet, CD image, session and
+        archives go
+        burner -- CDImage.BurnerProbe (already started)
+        rate -- capture sampling freq (Hz)
+        subrate -- samples per envelope block for segmentation
+        """
+        self.datadir = datadir
+        self.burner = burner
+        self.rate = rate
+        self.subrate = subrate
+        # Cue sheet describing the tracks to burn
+        self.cuefn = os.path.join(datadir,'tracks.cue')
+        # Lossless archives of burned tapes, one subdirectory per tape
+        self.archivedir = os.path.join(datadir,'archive')
+        # Sides recorded so far (for double-sided tapes), current side
+        self.session = Session.TapeSession(os.path.join(datadir,
+                                                        'session.json'))
+        self.side = 0
+        # Current recording's WAV file and level meter, envelope
+        # blocks / online segmentation of it (envelope blocks come
+        # from the level meter)
+        self.capture = None
+        self.meter = None
+        self.envelope = []
+        self.online = None
+        # Finished recording: envelope, track/gap path
+        self.samps = None
+        self.assign = None
+        # User's choices: 'voice' / 'music', even out track levels,
+        # keep a lossless archive, how many CDs to burn (across all
+        # burners, see CDImage.BurnQueue)
+        self.mode = 'music'
+        self.levels = False
+        self.archiving = False
+        self.copies = 1
+        # Lossless archive being encoded alongside the burn
+        self.archive = None
+
+    def startSide(self, side=0):
+        """
+        New capture file and level meter for a side (the caller
+        records into them, see Recorder.DiskRecorder)
+        """
+        self.side = side
+        self.capture = os.path.join(self.datadir,'capture%d.wav' % side)
+        self.meter = Recorder.LevelMeter(2,self.rate,subrate=self.subrate)
+        # Segment the recording as it comes in
+        self.envelope = []
+        self.online = Segmentor.OnlineSegmentor()
+        return self.capture
+
+    def segmentCaptured(self):
+        """
+        Push the mono amplitudes (max over channels) of newly
+        recorded whole blocks of subrate samples through the online
+        segmentation (the level meter already worked them out, so
+        nothing is read back from disk)
+        """
+        samps = self.meter.takeBlocks()
+        if(len(samps) > 0):
+            self.envelope.append(samps)
+            self.online.push(samps)
+
+    def processingStages(self):
+        """ envelope -> segment -> export """
+        return [('envelope',self.envelopeStage),
+                ('segment',self.segmentStage),
+                ('export',self.exportStage)]
+
+    def flipStages(self):
+        """ envelope -> segment -> save (side done, another to come) """
+        return self.processingStages()[:2] + [('save',self.saveSideStage)]
+
+    def burnStages(self):
+        """ prepare -> archive -> burn -> archived -> cleanup """
+        return [('prepare',self.prepareStage),
+                ('archive',self.archiveStage),
+                ('burn',self.burnStage),
+                ('archived',self.archiveWaitStage),
+                ('cleanup',self.cleanupStage)]
+
+    def envelopeStage(self, data, report):
+        """ Process the last few seconds of subsampled audio """
+        report('Processing audio...')
+        self.segmentCaptured()
+        # (track/gap path was decoded while recording)
+        self.online.flush()
+        self.assign = self.online.assignments()
+        self.online = None
+        self.samps = NP.concatenate(self.envelope)
+        return self.samps
+
+    def segmentStage(self, samps, report):
+        """ Track [start,end) sample offsets """
+        report('Finding tracks...')
+        # VOICE: just find single track
+        # MUSIC: tracks were segmented while recording,
+        # now find sample-accurate cut points
+        return Session.sideIntervals(self.capture,self.mode,samps,
+                                     self.subrate,self.assign)
+
+    def exportStage(self, intervals, report):
+        """
+        Save the side's tracks in the session (the cue sheet is
+        only written when burning, see prepareStage)
+        """
+        report('Saving tracks...')
+        # (the captures are never changed, so the mode can still be
+        # changed until the CD is burned)
+        self.putSide(intervals)
+        return self.session.ntracks()
+
+    def saveSideStage(self, intervals, report):
+        """ Keep the side's tracks on disk only, release the rest """
+        self.putSide(intervals)
+        (self.samps,self.assign) = (None,None)
+        self.envelope = []
+        return len(intervals)
+
+    def putSide(self, intervals):
+        """ Side's tracks, gains and confidences into the session """
+        self.session.putSide(self.side,self.capture,self.mode,
+                             intervals,self.trackGains(intervals),
+                             Segmentor.trackConfidence(self.samps,intervals,
+                                                       self.subrate))
+
+    def trackGains(self, intervals):
+        """ Track gains from the envelope (None if not normalizing) """
+        if(not self.levels):
+            return None
+        return Normalize.trackGains(self.samps,intervals,self.subrate)
+
+    def prepareStage(self, data, report):
+        """
+        Write the CD image (each capture up to its last track, with
+        track gains and fades, if any) and its cue sheet
+        """
+        report('Preparing tracks...')
+        self.session.writeCueSheet(self.cuefn)
+
+    def archiveStage(self, data, report):
+        """
+        Start encoding the tracks into the archive (on worker
+        processes, while the CD burns), if asked to and not
+        already started by an earlier BURN attempt
+        """
+        if(self.archiving and self.archive == None):
+            report('Archiving tracks...')
+            self.archive = Archive.TapeArchive(
+                self.session.sides,
+                os.path.join(self.archivedir,time.strftime('%Y%m%d-%H%M%S')))
+            self.archive.start()
+
+    def burnStage(self, data, report):
+        """
+        Burn the copies on all burners at once (progress of each
+        drive on its own line), return how many copies failed
+        """
+        if(not self.burner.finished()):
+            report('Looking for CD burner...')
+        devs = self.burner.devices()
+        if(len(devs) == 0):
+            raise IOError('CD burner not found')
+        queue = CDImage.BurnQueue(self.cuefn,devs,self.copies,
+                                  report=lambda dev,text:
+                                      report(queue.statusText()))
+        return self.copies - queue.run()
+
+    def archiveWaitStage(self, failed, report):
+        """ Let the archive finish before the captures go """
+        if(self.archive != None):
+            if(not self.archive.finished()):
+                report('Finishing archive...')
+            self.archive.wait()
+        return failed
+
+    def cleanupStage(self, failed, report):
+        """
+        Now that we're done, cleanup by deleting the
+        cue sheet and capture files (kept if any copy failed,
+        so BURN can be retried)
+        """
+        if(failed == 0):
+            self.removeCaptures()
+            (self.samps,self.assign) = (None,None)
+        return failed
+
+    def removeCaptures(self):
+        """ Delete capture files, cue sheet and CD image """
+        captures = [fn for fn in os.listdir(self.datadir)
+                    if re.match('capture\d+\.wav',fn)]
+        for capture in captures:
+            os.remove(os.path.join(self.datadir,capture))
+        for fn in [self.cuefn,Session.imageFile(self.cuefn)]:
+            if(os.path.exists(fn)):
+                os.remove(fn)
+        self.session.clear()
+        self.archive = None
+
+    def stop(self):
+        """ Stop the archive (if any) and delete the captures """
+        if(self.archive != None):
+            self.archive.stop()
+        self.removeCaptures()
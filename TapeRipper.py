@@ -19,6 +19,9 @@ find track breaks to create a CD with multiple tracks
 4) When tape is done, press STOP
 5) When tracks are done, press BURN
 
+Double-sided tapes: at the end of side one press FLIP TAPE, turn the
+tape over and press play again (voice/music can be chosen per side)
+
 If any problems are encountered, simply QUIT and start over
 
 To test mic
@@ -26,26 +29,53 @@ To test mic
 -Hit PLAY to listen to the recording (use to test quality/volume/etc)
 """
 import os,os.path
-import re
 import cPickle as CP
 
 import numpy as NP
 from Tkinter import *
 import tkSnack
 
-import Segmentor
+import CDImage
+import Instrument
+import Pipeline
+import Recorder
+import Stages
 
+# Captures, cue sheet, CD image, session and archives (see Stages)
 datadir = 'data'
+# CD burners last found (see CDImage.BurnerProbe)
+burnerfn = os.path.join(datadir,'burner')
+# Voice / music radio button values
+modes = {0 : 'voice', 2 : 'music'}
+# Wave sampling freq (Hz)
+sampfreq = 44100
+# Subsampling rate for segmentation (samples per envelope block)
+subrate = 20000
+# How often to segment newly recorded audio (ms)
+pollms = 2000
+# How often to check on background work (ms)
+watchms = 100
+# How often to redraw the input level meter (ms), and its width
+meterms = 50
+meterwidth = 300
 
 class TapeRipperApp:
 
     def __init__(self, master):
         # Initialize state to 0
         self.state = 0
-        # Current track being recorded
-        self.recsound = None
-        # Side one (for double-sided tapes)
-        self.sideone = None
+        # Current recording (streamed to disk)
+        self.recorder = None
+        self.playback = None
+        # Processing/burning running in the background
+        self.pipeline = None
+        # Automagically determine CD burner device ID
+        # (in the background, the window comes up right away)
+        self.burner = CDImage.BurnerProbe(burnerfn)
+        self.burner.start()
+        # Captures, session, segmentation and burn settings of the
+        # tape being ripped, and the background stages run on it
+        self.job = Stages.TapeJob(datadir,self.burner,sampfreq,subrate)
         # Tk master frame
         self.frame = Frame(master)#,bg='white')
         self.frame.pack(padx=5,pady=5)        
@@ -61,6 +91,7 @@ class TapeRipperApp:
         instructions += '1) Press the RECORD button\n'
         instructions += '2) Press play on your cassette tape player\n'
         instructions += '3) When tape is done, press STOP\n'
+        instructions += '   (or FLIP TAPE to record the other side)\n'
         instructions += '4) When tracks are done, press BURN\n'
         self.instruct = Label(self.frame, text=instructions, justify='left')
         self.instruct.grid(row=1,column=0,columnspan=3)
@@ -68,19 +99,49 @@ class TapeRipperApp:
         self.tracksplit = IntVar()
         # Voice recording, 1 side
         self.voice = Radiobutton(self.frame, text="Voice recording\n(do not split)", 
-                                 variable=self.tracksplit, value=0)
+                                 variable=self.tracksplit, value=0,
+                                 command=self.changeMode)
         self.voice.grid(row=2,column=0)
         # (for 2-sided tape)
-        # self.fliptape = Button(self.frame, text="FLIP\nTAPE",
-        #                        command=self.doTapeFlip)
-        # self.fliptape.grid(row=2,column=1)
+        self.fliptape = Button(self.frame, text="FLIP\nTAPE",
+                               command=self.doTapeFlip)
+        self.fliptape.grid(row=2,column=1)
         # Music recording (try to identify track breaks)
         self.music = Radiobutton(self.frame, text="Music recording\n(split tracks)",
-                                 variable=self.tracksplit, value=2)
+                                 variable=self.tracksplit, value=2,
+                                 command=self.changeMode)
         self.music.grid(row=2,column=2)
         # Status messages
         self.status = Label(self.frame, text="")
         self.status.grid(row=3,column=0,columnspan=3)
+        # Even out track levels (and fade track ends) before burning
+        self.normalize = IntVar()
+        self.normalizebox = Checkbutton(self.frame, text="Even out track levels",
+                                        variable=self.normalize,
+                                        command=self.changeMode)
+        self.normalizebox.grid(row=5,column=0)
+        # Also keep every track in a lossless archive (see Archive)
+        self.keeparchive = IntVar()
+        self.archivebox = Checkbutton(self.frame, text="Keep lossless archive",
+                                      variable=self.keeparchive)
+        self.archivebox.grid(row=5,column=2)
+        # Number of copies to burn
+        self.copiesframe = Frame(self.frame)
+        Label(self.copiesframe, text="Copies:").pack(side=LEFT)
+        self.ncopies = Spinbox(self.copiesframe, from_=1, to=20, width=3)
+        self.ncopies.pack(side=LEFT)
+        self.copiesframe.grid(row=5,column=1)
+        # Input level meter while recording: RMS bar and peak tick
+        # per channel (-60 to 0 dBFS), CLIP if the input clipped
+        self.levelmeter = Canvas(self.frame, width=meterwidth, height=24,
+                                 bg='black', highlightthickness=0)
+        self.levelmeter.grid(row=6,column=0,columnspan=3,pady=3)
+        self.levelbars = [self.levelmeter.create_rectangle(
+                0,2+11*c,0,11+11*c,fill='green',width=0) for c in range(2)]
+        self.peakticks = [self.levelmeter.create_rectangle(
+                0,2+11*c,0,11+11*c,fill='yellow',width=0) for c in range(2)]
+        self.cliplabel = self.levelmeter.create_text(
+            meterwidth-4,12,anchor=E,text='',fill='red')
         # RECORD / STOP / BURN button
         self.record_sound = Button(self.frame, text="RECORD", bg="green",
                                    command=self.recordSound)
@@ -93,142 +154,232 @@ class TapeRipperApp:
         self.button = Button(self.frame, text="QUIT", 
                              command=self.cleanupQuit)
         self.button.grid(row=4,column=2)    
-        # Automagically determine CD burner device ID
-        scanbus = os.popen('cdrecord -scanbus')
-        for line in scanbus:
-            # If 'RW' appears in device description, 
-            # assume this device can burn CDs
-            if('RW' in line):
-                m = re.search('(\d,\d,\d)',line)
-                if(m == None):
-                    notfounderr = 'ERROR - CD BURNER NOT FOUND'
-                    self.status.config(text=notfounderr)
-                else:
-                    self.dev = m.group(1)
-                    break
+        self.frame.after(watchms,self.watchBurner)
+
+    def watchBurner(self):
+        """ Complain once the probe is done, if no burner was found """
+        if(not self.burner.finished()):
+            self.frame.after(watchms,self.watchBurner)
+        elif(self.burner.device() == None):
+            notfounderr = 'ERROR - CD BURNER NOT FOUND'
+            self.status.config(text=notfounderr)
 
     def doTapeFlip(self):
-        """ For 2-sided tape, save the first side and resume... """
-        self.status.config(text='Flip tape, then play...')
-        # Save side one
-        self.recsound.stop()
-        (sampfreq,subrate) = (44100,20000)
-        samps = Segmentor.getMonoAmpSamples(self.recsound,
-                                            subrate)            
-        trackAssign = Segmentor.segmentVoice(samps)
-        (tstart,tend) = (min(trackAssign[0])*subrate,
-                         max(trackAssign[0])*subrate)
-        self.sideone = tkSnack.Sound()
-        self.sideone.copy(self.recsound,start=tstart,end=tend)
-        # Restart recording
-        self.recsound = tkSnack.Sound()
-        self.recsound.configure(channels="Stereo")
-        self.recsound.configure(frequency=44100)
-        self.recsound.record()
+        """ 
+        For 2-sided (or more) tapes, segment and save the side just
+        recorded (in the background), then record the next one
+        """
+        if(self.state != 1):
+            self.status.config(text='RECORD the first side, then FLIP')
+            return
+        self.recorder.stop()
+        self.setChoices()
+        self.status.config(text='Saving side %d...' % (self.job.side + 1))
+        self.record_sound.config(text="WAIT",bg='gray',state=DISABLED)
+        self.state = 3
+        self.runPipeline(self.job.flipStages(),self.flipDone)
+
+    def flipDone(self, ntracks):
+        """ Side saved, restart recording """
+        self.status.config(text='Side %d: %d tracks.  Flip tape, then play...'
+                           % (self.job.side + 1,ntracks))
+        self.startRecording(self.job.side + 1)
+        self.frame.after(pollms,self.pollRecording)
+        self.record_sound.config(text="STOP",bg="red",state=NORMAL)
+        self.state = 1
 
     def cleanupQuit(self):
         """ Clear currently saved tracks and quit """
-        tracks = [fn for fn in os.listdir(datadir)
-                  if re.match('track\d+\.wav',fn)]        
-        for track in tracks:
-            os.remove(os.path.join(datadir,track))
+        if(self.recorder != None):
+            self.recorder.stop()
+        self.job.stop()
         self.frame.quit()
 
+    def startRecording(self, side=0):
+        """ 
+        Start streaming the mic input to a capture file on disk
+        (segmented as it comes in, see Stages.TapeJob)
+        """
+        capture = self.job.startSide(side)
+        self.recorder = Recorder.DiskRecorder(Recorder.SnackSource(sampfreq),
+                                              capture,meter=self.job.meter)
+        self.recorder.start()
+        self.frame.after(meterms,self.updateMeter,self.recorder)
+
+    def setChoices(self):
+        """ Hand the user's voice/music and levels choices to the job """
+        self.job.mode = modes[self.tracksplit.get()]
+        self.job.levels = self.normalize.get()
+
     def recordSound(self):
         """ Start/stop recording from the mic input """        
         if(self.state == 0):
             #
             # Start recording
             #
-            self.recsound = tkSnack.Sound()
-            self.recsound.configure(channels="Stereo")
-            self.recsound.configure(frequency=44100)
-            self.recsound.record()
+            self.job.session.clear()
+            self.startRecording()
+            self.frame.after(pollms,self.pollRecording)
             self.status.config(text='Recording...')
             self.record_sound.config(text="STOP",bg="red")
             self.state = 1
         elif(self.state == 1):
             #
             # Stop recording, write tracks out to disk for burning
+            # (in the background, see Stages.TapeJob)
             # 
-            self.recsound.stop()
-            # Wave sampling freq (Hz)
-            sampfreq = 44100 
-            # Convert to mono (take max amplitude over channels) and subsample
-            subrate = 20000
-            samps = Segmentor.getMonoAmpSamples(self.recsound,
-                                                subrate)            
-            # Process subsampled audio
+            self.recorder.stop()
+            self.setChoices()
             self.status.config(text='Processing audio...')
-            if(self.tracksplit.get() == 0):
-                # VOICE: just find single track
-                trackAssign = Segmentor.segmentVoice(samps)                
-            elif(self.tracksplit.get() == 2):
-                # MUSIC: segment recording into individual tracks
-                trackAssign = Segmentor.segmentTracks(samps)
-            # Write these tracks out to disk                     
-            if(self.sideone != None):
-                # We have a previous side-one track, write it out
-                fn = os.path.join(datadir,'track%d.wav' % 0)
-                self.sideone.write(fn)
-                # Then write out the current track
-                (tstart,tend) = (min(trackAssign[0])*subrate,
-                                 max(trackAssign[0])*subrate)
-                newTrack = tkSnack.Sound()
-                newTrack.copy(self.recsound,start=tstart,end=tend)
-                fn = os.path.join(datadir,'track%d.wav' % 1)
-                newTrack.write(fn)
-            else:                
-                # No side-one, just write these tracks out to disk
-                for (tracknum,ta) in enumerate(trackAssign):
-                    (tstart,tend) = (min(ta)*subrate,max(ta)*subrate)
-                    newTrack = tkSnack.Sound()
-                    newTrack.copy(self.recsound,start=tstart,end=tend)
-                    fn = os.path.join(datadir,'track%d.wav' % tracknum)
-                    newTrack.write(fn)
-            self.status.config(text='Ready to burn!')            
-            self.recsound = None
-            self.record_sound.config(text="BURN",bg='red')
-            self.state = 2
+            self.record_sound.config(text="WAIT",bg='gray',state=DISABLED)
+            self.state = 3
+            self.runPipeline(self.job.processingStages(),self.processingDone)
         elif(self.state == 2):
             #
-            # Burn tracks from disk to a blank CD 
+            # Burn tracks from disk to a blank CD (in the background,
+            # cdrecord progress is shown in the status label)
             #
-            tracks = [fn for fn in os.listdir(datadir)
-                      if re.match('track\d+\.wav',fn)]
-            def sortfn(a,b):
-                aval = int(re.match('track(\d+)\.wav',a).group(1))
-                bval = int(re.match('track(\d+)\.wav',b).group(1))
-                return aval-bval
-            tracks.sort(sortfn)        
-            # Construct cdrecord command for CD burning
-            cmd = 'cdrecord fs=4096k -v -useinfo speed=1 '
-            cmd += '-dao -eject -pad -audio '
-            cmd += '-dev=%s ' % (self.dev)
-            for track in tracks:
-                cmd += '\"%s\" ' % os.path.join(datadir,track)
             self.status.config(text='Burning CD...')
-            os.system(cmd)
-            self.status.config(text='Done - CD completed')
-            # Now that we're done, cleanup by deleting temp track files
-            for track in tracks:
-                os.remove(os.path.join(datadir,track))
+            self.record_sound.config(text="WAIT",bg='gray',state=DISABLED)
+            self.job.archiving = self.keeparchive.get()
+            try:
+                self.job.copies = max(int(self.ncopies.get()),1)
+            except ValueError:
+                self.job.copies = 1
+            self.state = 3
+            self.runPipeline(self.job.burnStages(),self.burnDone,
+                             onerror=self.burnButton)
+
+    def changeMode(self):
+        """
+        Switching voice/music (or level normalization) before BURN
+        re-segments the recording (envelope and decoded tracks are
+        kept in memory, from the recording)
+        """
+        if(self.state == 2 and 
+           (modes[self.tracksplit.get()] != self.job.mode or
+            self.normalize.get() != self.job.levels)):
+            self.setChoices()
+            self.status.config(text='Processing audio...')
+            self.record_sound.config(text="WAIT",bg='gray',state=DISABLED)
+            self.state = 3
+            self.runPipeline(self.job.processingStages()[1:],
+                             self.processingDone,self.job.samps,
+                             onerror=self.burnButton)
+
+    def runPipeline(self, stages, ondone, data=None, onerror=None):
+        """
+        Run stages on a worker thread, call ondone(result) when done
+        (or onerror() if a stage fails, default back to RECORD)
+        """
+        self.pipeline = Pipeline.Pipeline(stages)
+        self.pipeline.start(data)
+        self.frame.after(watchms,self.watchPipeline,ondone,
+                         onerror or self.resetButton)
+
+    def watchPipeline(self, ondone, onerror):
+        """ Show progress of the background work in the status label """
+        for (kind,stage,value) in self.pipeline.poll():
+            if(kind == 'progress'):
+                self.status.config(text=value)
+            elif(kind == 'error'):
+                self.status.config(text='ERROR (%s) - %s' % (stage,value))
+                self.pipeline = None
+                onerror()
+                return
+            elif(kind == 'done'):
+                self.pipeline = None
+                ondone(value)
+                return
+        self.frame.after(watchms,self.watchPipeline,ondone,onerror)
+
+    def resetButton(self):
+        """ Back to the RECORD state """
+        self.record_sound.config(text="RECORD",bg="green",state=NORMAL)
+        self.state = 0
+
+    def burnButton(self):
+        """ Back to the BURN state (tracks are ready) """
+        self.record_sound.config(text="BURN",bg='red',state=NORMAL)
+        self.state = 2
+
+    def processingDone(self, ntracks):
+        """ Tracks are ready, wait for BURN """
+        self.status.config(text='Ready to burn! (%d tracks)' % ntracks)
+        self.recorder = None
+        self.burnButton()
+
+    def burnDone(self, failed):
+        """ Report how the burn went """
+        if(failed == 0):
+            self.status.config(text='Done - %d CD(s) completed' %
+                               self.job.copies)
             # Reset state
-            self.state = 0
+            self.resetButton()
+        else:
+            self.status.config(text='ERROR - %d of %d CD(s) failed, '
+                               'insert blank CDs and BURN again' %
+                               (failed,self.job.copies))
+            # (only the missing copies next time)
+            self.ncopies.delete(0,END)
+            self.ncopies.insert(0,str(failed))
+            self.burnButton()
+
+    def pollRecording(self):
+        """ While recording, periodically segment the new audio """
+        if(self.state == 1):
+            self.recorder.poll()
+            self.job.segmentCaptured()
+            self.frame.after(pollms,self.pollRecording)
+
+    def updateMeter(self, recorder):
+        """ While recording, pull in new audio and redraw the meter """
+        if(self.state != 1 or recorder is not self.recorder):
+            self.drawLevels(NP.zeros((2,)),NP.zeros((2,)),False)
+            return
+        recorder.poll()
+        (peak,rms) = self.job.meter.levels()
+        self.drawLevels(peak,rms,self.job.meter.clipping())
+        self.frame.after(meterms,self.updateMeter,recorder)
+
+    def drawLevels(self, peak, rms, clipping):
+        """ Move the meter bars (only existing items are changed) """
+        # -60 dBFS at the left, full scale just before the CLIP text
+        scale = lambda level: ((meterwidth - 40) *
+                               min(max(Recorder.dbfs(level) / 60.0 + 1,0),1))
+        for c in range(2):
+            self.levelmeter.coords(self.levelbars[c],
+                                   0,2+11*c,scale(rms[c]),11+11*c)
+            x = scale(peak[c])
+            self.levelmeter.coords(self.peakticks[c],
+                                   max(x-2,0),2+11*c,x,11+11*c)
+            self.levelmeter.itemconfig(self.peakticks[c],
+                                       fill='red' if peak[c] >= 32767
+                                       else 'yellow')
+        self.levelmeter.itemconfig(self.cliplabel,
+                                   text='CLIP' if clipping else '')
 
     def playSound(self):
         """ Play the first track to test the recording setup """
-        if(self.recsound == None):
+        if(self.recorder == None):
             nosoundmsg = 'RECORD some audio first, then try to PLAY'
             self.status.config(text=nosoundmsg)
         else:
             playsoundmsg = 'Recording OK?  If not, QUIT and adjust volume.'
             self.status.config(text=playsoundmsg)
-            self.recsound.play()
+            # Play back from disk (Sound linked to the capture file)
+            self.recorder.poll()
+            self.playback = tkSnack.Sound(file=self.job.capture)
+            self.playback.play()
 
 # Init stuff for launching the app
-root = Tk()
-root.title('Tape Ripper')
-tkSnack.initializeSnack(root)
-app = TapeRipperApp(root)
-root.mainloop()
+# (headless batch processing: see BatchRipper.py)
+if __name__ == '__main__':
+    # Log per-stage timings (see Instrument), if asked to
+    if('TAPERIPPER_LOG' in os.environ):
+        Instrument.enable(os.environ['TAPERIPPER_LOG'])
+    root = Tk()
+    root.title('Tape Ripper')
+    tkSnack.initializeSnack(root)
+    app = TapeRipperApp(root)
+    root.mainloop()
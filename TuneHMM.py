@@ -0,0 +1,161 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Tune the track/gap HMM (see Segmentor.trackHMM) against a corpus of
+labeled envelopes
+
+Each corpus item is an envelope (getMonoAmpSamples output) and its
+correct track split (splitTracks output, i.e. a List of subsample
+index Lists, like test/trackCorrect.p).  Every point of a parameter
+grid is tried on every item; all of those decodes go through
+Segmentor.viterbiBatch a batch at a time, and each grid point is
+scored by how many true track boundaries it finds.
+
+USAGE
+
+python TuneHMM.py [options] env1.p truth1.p env2.p truth2.p ...
+
+prints the best grid points (and writes all results as JSON with -o)
+"""
+import cPickle as CP
+import itertools
+import json
+import optparse
+import sys
+
+import numpy as NP
+
+import Segmentor
+
+# Default grid: self-transition probability, track mean and
+# (both states') std as multiples of the envelope mean / std
+defaultgrid = {'stay' : [0.9,0.95,0.99,0.995,0.999],
+               'trackmean' : [0.5,0.75,1.0,1.25],
+               'std' : [0.5,1.0,2.0]}
+
+def hmmGrid(stay, trackmean, std):
+    """ List of grid points (dicts), every combination of the values """
+    return [{'stay' : s, 'trackmean' : m, 'std' : d}
+            for (s,m,d) in itertools.product(stay,trackmean,std)]
+
+def gridHMM(point, samps):
+    """
+    (initprob,transition,stateparam) for a grid point, relative to
+    an envelope (stay=0.99, trackmean=1, std=1 is trackHMM)
+    """
+    (initprob,transition,stateparam) = Segmentor.trackHMM(samps.mean(),
+                                                          samps.std())
+    stay = point['stay']
+    transition = NP.array([[stay,1-stay],[1-stay,stay]])
+    stateparam = [(mu * point['trackmean'] if i == 1 else mu,
+                   sigma * point['std'])
+                  for (i,(mu,sigma)) in enumerate(stateparam)]
+    return (initprob,transition,stateparam)
+
+def boundaries(tracks):
+    """ Start and end (exclusive) subsample of each track """
+    return ([min(t) for t in tracks],[max(t)+1 for t in tracks])
+
+def scoreTracks(found, truth, tolerance=2):
+    """
+    How well do the found tracks (splitTracks output) match the
+    truth?  A true start (end) counts as found if a found start
+    (end) lies within tolerance subsamples.
+
+    Return dict of recall, precision, F1 and whether the track
+    split is exactly right
+    """
+    (fstarts,fends) = boundaries(found)
+    (tstarts,tends) = boundaries(truth)
+    hits = 0
+    matched = 0
+    for (fb,tb) in [(fstarts,tstarts),(fends,tends)]:
+        if(len(fb) == 0 or len(tb) == 0):
+            continue
+        dist = NP.abs(NP.subtract.outer(NP.array(tb),NP.array(fb)))
+        hits += (dist.min(axis=1) <= tolerance).sum()
+        matched += (dist.min(axis=0) <= tolerance).sum()
+    recall = hits / (2.0 * max(len(truth),1))
+    precision = matched / (2.0 * max(len(found),1))
+    f1 = (2 * recall * precision / (recall + precision)
+          if recall + precision > 0 else 0.0)
+    exact = (len(found) == len(truth) and
+             all([list(f) == list(t) for (f,t) in zip(found,truth)]))
+    return {'recall' : recall, 'precision' : precision,
+            'f1' : f1, 'exact' : exact}
+
+def tuneHMM(corpus, grid, tolerance=2, padding=6, batchsize=256):
+    """
+    Score every grid point over the whole corpus
+
+    corpus -- List of (envelope, true tracks)
+    grid -- List of grid points (see hmmGrid)
+
+    Return List of {'params', 'f1', 'recall', 'precision', 'exact'}
+    (averaged over the corpus), best first
+    """
+    lengths = NP.array([len(samps) for (samps,truth) in corpus])
+    padded = NP.zeros((len(corpus),lengths.max()))
+    for (i,(samps,truth)) in enumerate(corpus):
+        padded[i,:len(samps)] = samps
+    # One row per (grid point, corpus item)
+    jobs = list(itertools.product(range(len(grid)),range(len(corpus))))
+    scores = [[] for point in grid]
+    for b in range(0,len(jobs),batchsize):
+        batch = jobs[b:b+batchsize]
+        hmms = [gridHMM(grid[g],corpus[c][0]) for (g,c) in batch]
+        items = [c for (g,c) in batch]
+        assign = Segmentor.viterbiBatch(padded[items],
+                                        [h[0] for h in hmms],
+                                        [h[1] for h in hmms],
+                                        [h[2] for h in hmms],
+                                        lengths[items])
+        for (row,(g,c)) in enumerate(batch):
+            found = Segmentor.splitTracks(assign[row,:lengths[c]],padding)
+            scores[g].append(scoreTracks(found,corpus[c][1],tolerance))
+    results = []
+    for (point,pointscores) in zip(grid,scores):
+        result = {'params' : point}
+        for key in ['f1','recall','precision','exact']:
+            result[key] = NP.mean([s[key] for s in pointscores])
+        results.append(result)
+    results.sort(key=lambda r: (-r['f1'],-r['exact']))
+    return results
+
+def loadCorpus(fns):
+    """ Pairs of (envelope pickle, true tracks pickle) filenames """
+    return [(NP.asarray(CP.load(open(envfn))),CP.load(open(truthfn)))
+            for (envfn,truthfn) in zip(fns[::2],fns[1::2])]
+
+def main(argv):
+    parser = optparse.OptionParser(
+        usage='%prog [options] env1.p truth1.p env2.p truth2.p ...')
+    parser.add_option('-t','--tolerance',type='int',default=2,
+                      help='boundary tolerance in subsamples [%default]')
+    parser.add_option('-n','--top',type='int',default=10,
+                      help='how many of the best grid points to show '
+                      '[%default]')
+    parser.add_option('-o','--output',default=None,
+                      help='write all results to this JSON file')
+    (options,fns) = parser.parse_args(argv)
+    if(len(fns) == 0 or len(fns) % 2 != 0):
+        parser.error('need pairs of envelope / truth files')
+    corpus = loadCorpus(fns)
+    grid = hmmGrid(**defaultgrid)
+    results = tuneHMM(corpus,grid,options.tolerance)
+    for result in results[:options.top]:
+        print('%.3f %.2f  %s' % (result['f1'],result['exact'],
+                                 json.dumps(result['params'],
+                                            sort_keys=True)))
+    if(options.output != None):
+        f = open(options.output,'w')
+        json.dump(results,f,indent=2)
+        f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+"""
+TapeRipper - A GUI program for dead simple tape-to-CD transfers.
+
+David Andrzejewski
+david.andrzej@gmail.com
+
+
+Minimal PCM WAV file access for large recordings
+
+Rather than loading the whole recording into memory (or asking
+tkSnack for one sample at a time), find the 'data' chunk in the
+RIFF header and map it straight into a NumPy array with NP.memmap.
+The OS then pages audio in and out as we scan over it.
+"""
+import struct
+
+import numpy as NP
+
+def readWavHeader(fn):
+    """
+    Parse the RIFF/WAVE header of a PCM WAV file
+
+    Return (channels, rate, bits, dataoffset, nframes)
+    where dataoffset is the byte offset of the first frame
+    """
+    f = open(fn,'rb')
+    try:
+        (riff,riffsize,wave) = struct.unpack('<4sI4s',f.read(12))
+        if(riff != b'RIFF' or wave != b'WAVE'):
+            raise ValueError('%s is not a RIFF/WAVE file' % fn)
+        fmt = None
+        while(True):
+            chunkhead = f.read(8)
+            if(len(chunkhead) < 8):
+                raise ValueError('%s has no data chunk' % fn)
+            (chunkid,chunksize) = struct.unpack('<4sI',chunkhead)
+            if(chunkid == b'fmt '):
+                fmt = struct.unpack('<HHIIHH',f.read(16))
+                f.seek(chunksize - 16 + (chunksize % 2), 1)
+            elif(chunkid == b'data'):
+                if(fmt == None):
+                    raise ValueError('%s has data before fmt chunk' % fn)
+                (tag,channels,rate,byterate,align,bits) = fmt
+                if(tag != 1):
+                    raise ValueError('%s is not PCM (format %d)' % (fn,tag))
+                return (channels,rate,bits,f.tell(),chunksize // align)
+            else:
+                # Skip unknown chunk (chunks are word-aligned)
+                f.seek(chunksize + (chunksize % 2), 1)
+    finally:
+        f.close()
+
+def mapWav(fn, mode='r'):
+    """
+    Memory-map the PCM frames of a 16-bit WAV file
+
+    Return (rate, frames) where frames is an NP.memmap of
+    dim (nframes x channels) -- no audio is actually read yet
+    """
+    (channels,rate,bits,dataoffset,nframes) = readWavHeader(fn)
+    if(bits != 16):
+        raise ValueError('%s is %d-bit, only 16-bit is supported' %
+                         (fn,bits))
+    if(nframes == 0):
+        return (rate,NP.zeros((0,channels),'<i2'))
+    frames = NP.memmap(fn, dtype='<i2', mode=mode, offset=dataoffset,
+                       shape=(nframes,channels))
+    return (rate,frames)
+
+def truncateWav(fn, nframes):
+    """ Cut a 16-bit PCM WAV file down to its first nframes frames """
+    (channels,rate,bits,dataoffset,oldframes) = readWavHeader(fn)
+    datasize = min(nframes,oldframes) * channels * 2
+    f = open(fn,'r+b')
+    try:
+        f.truncate(dataoffset + datasize)
+        # Patch RIFF and data chunk sizes
+        f.seek(4)
+        f.write(struct.pack('<I',dataoffset - 8 + datasize))
+        f.seek(dataoffset - 4)
+        f.write(struct.pack('<I',datasize))
+    finally:
+        f.close()
+
+class WavWriter:
+    """
+    Write a 16-bit PCM WAV file a chunk of frames at a time
+
+    The file simply grows as frames are appended; the RIFF/data
+    sizes in the header are patched on every flush(), so the file 
+    on disk is always a valid WAV of everything written so far
+    """
+
+    def __init__(self, fn, channels=2, rate=44100):
+        self.fn = fn
+        self.channels = channels
+        self.rate = rate
+        self.nframes = 0
+        self.f = open(fn,'wb')
+        self.writeHeader()
+
+    def writeHeader(self):
+        """ (Re-)write the 44-byte header for the current length """
+        datasize = self.nframes * self.channels * 2
+        self.f.seek(0)
+        self.f.write(struct.pack('<4sI4s',b'RIFF',36 + datasize,b'WAVE'))
+        self.f.write(struct.pack('<4sIHHIIHH',b'fmt ',16,1,self.channels,
+                                 self.rate,self.rate * self.channels * 2,
+                                 self.channels * 2,16))
+        self.f.write(struct.pack('<4sI',b'data',datasize))
+        self.f.seek(0,2)
+
+    def write(self, frames):
+        """ Append frames (dim n x channels, or flat interleaved) """
+        frames = NP.ascontiguousarray(frames,'<i2')
+        self.f.write(frames.tostring())
+        self.nframes += frames.size // self.channels
+
+    def flush(self):
+        """ Bring the header up to date and push data to disk """
+        self.writeHeader()
+        self.f.flush()
+
+    def close(self):
+        """ Finish the file (final header) """
+        self.flush()
+        self.f.close()
+
+def copyFrames(frames, fn, rate=44100, chunkframes=1048576):
+    """ 
+    Write frames (dim n x channels, e.g. a slice of a memmap) 
+    to a new WAV file, chunkframes at a time
+    """
+    writer = WavWriter(fn,frames.shape[1],rate)
+    for i in range(0,len(frames),chunkframes):
+        writer.write(frames[i:i+chunkframes])
+    writer.close()
@@ -35,3 +35,121 @@ def generateLabels(runs):
                               [[1 if run[0]=='track' else 0
                                 for i in range(run[1])]
                                for run in runs]))                              
+
+class SyntheticSource:
+    """
+    Stand-in for the mic input (see Recorder): plays back a
+    synthetic tape of gap/track runs, where run lengths are 
+    given in frames (gaps = faint hiss, tracks = loud noise)
+
+    Frames are generated on demand, read() hands out up to
+    readsize frames at a time (like a real-time capture would)
+    """
+
+    def __init__(self, runs, rate=44100, channels=2, 
+                 readsize=4096, seed=0):
+        self.rate = rate
+        self.channels = channels
+        self.readsize = readsize
+        self.runends = NP.cumsum([run[1] for run in runs])
+        self.loud = NP.array([run[0] == 'track' for run in runs])
+        self.rng = NR.RandomState(seed)
+        self.pos = 0
+        self.recording = False
+
+    def start(self):
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def read(self, nframes):
+        n = min(nframes, self.readsize, self.runends[-1] - self.pos)
+        if(n <= 0):
+            return NP.zeros((0,self.channels),'<i2')
+        # Which run does each frame belong to?
+        idx = NP.arange(self.pos,self.pos+n)
+        scale = NP.where(self.loud[NP.searchsorted(self.runends,idx,
+                                                   side='right')],
+                         8000,50)
+        self.pos += n
+        noise = self.rng.normal(0,1,(n,self.channels))
+        return (noise * scale[:,NP.newaxis]).astype('<i2')
+
+def tapeRuns(minutes, rate=44100, seed=0):
+    """
+    Runs (in frames) for a whole synthetic tape side: 2-6 minute
+    tracks separated by 1-6 second gaps, with about one in five gaps
+    a short (1/4 s) dip between two fading tracks, like a crossfade
+    """
+    rng = NR.RandomState(seed)
+    total = int(minutes * 60 * rate)
+    runs = [('gap',int(rng.uniform(1,3) * rate))]
+    length = runs[0][1]
+    while(length < total):
+        track = int(rng.uniform(120,360) * rate)
+        if(rng.uniform() < 0.2):
+            gap = int(0.25 * rate)
+        else:
+            gap = int(rng.uniform(1,6) * rate)
+        runs += [('track',track),('gap',gap)]
+        length += track + gap
+    # Cut the last track short at the end of the tape
+    excess = length - total
+    while(excess > 0):
+        (runtype,runlen) = runs.pop()
+        if(runlen > excess):
+            runs.append((runtype,runlen - excess))
+        excess -= runlen
+    return runs
+
+def runIntervals(runs):
+    """ NP array (ntracks x 2) of [start,end) frames of the track runs """
+    ends = NP.cumsum([run[1] for run in runs])
+    starts = ends - [run[1] for run in runs]
+    istrack = NP.array([run[0] == 'track' for run in runs])
+    return NP.column_stack((starts[istrack],ends[istrack]))
+
+class SyntheticTape(SyntheticSource):
+    """
+    More realistic synthetic tape (for benchmarks): tape hiss
+    throughout, tracks fade in and out over <fade> seconds, pulse
+    at 2 Hz, and each has one quiet passage of 5-15 seconds at
+    <quiet> times the usual level
+    """
+
+    def __init__(self, runs, rate=44100, channels=2,
+                 readsize=1048576, seed=0, hiss=50, loud=8000,
+                 fade=1.0, quiet=0.05):
+        SyntheticSource.__init__(self,runs,rate,channels,readsize,seed)
+        self.lengths = NP.array([run[1] for run in runs])
+        self.runstarts = self.runends - self.lengths
+        self.hiss = hiss
+        self.level = loud
+        self.fadeframes = fade * rate
+        self.quiet = quiet
+        quietlen = (self.rng.uniform(5,15,len(runs)) * rate).astype(int)
+        self.quietlen = NP.minimum(quietlen,self.lengths // 2)
+        self.quietstart = (self.rng.uniform(0.2,0.7,len(runs)) *
+                           self.lengths).astype(int)
+
+    def read(self, nframes):
+        n = min(nframes, self.readsize, self.runends[-1] - self.pos)
+        if(n <= 0):
+            return NP.zeros((0,self.channels),'<i2')
+        idx = NP.arange(self.pos,self.pos+n)
+        run = NP.searchsorted(self.runends,idx,side='right')
+        offset = idx - self.runstarts[run]
+        # Fade in / out at the track ends
+        ramp = NP.minimum(offset,self.lengths[run] - 1 - offset)
+        ramp = NP.clip(ramp / self.fadeframes,0,1)
+        inquiet = ((offset >= self.quietstart[run]) &
+                   (offset < self.quietstart[run] + self.quietlen[run]))
+        pulse = 0.6 + 0.4 * NP.sin(2 * NP.pi * 2 * idx / self.rate)
+        scale = NP.where(self.loud[run],
+                         self.level * ramp * pulse *
+                         NP.where(inquiet,self.quiet,1),0) + self.hiss
+        self.pos += n
+        noise = self.rng.normal(0,1,(n,self.channels))
+        return NP.clip(noise * scale[:,NP.newaxis],
+                       -32768,32767).astype('<i2')
@@ -0,0 +1,70 @@
+"""
+Benchmark Viterbi decoding throughput as the number of subsamples T
+grows (10^3 ... 10^7), for viterbiDecoding and the memory-bounded
+viterbiCheckpointed
+
+The old step-by-step recurrence (viterbiForward + followTrackback)
+is only timed up to 10^5 subsamples, beyond that it takes minutes
+
+Run from the test directory: python benchSegmentation.py
+"""
+import os, os.path
+import sys
+import time
+
+import numpy as NP
+import numpy.random as NR
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import Segmentor
+import ToyData
+
+def syntheticTape(T):
+    """ Alternating track/gap runs of random length, T subsamples total """
+    runs = []
+    total = 0
+    while(total < T):
+        runlen = NR.randint(10,1000)
+        runs.append(('track' if len(runs) % 2 else 'gap', runlen))
+        total += runlen
+    return ToyData.generateData(runs)[:T]
+
+def hmmParams(data):
+    """ Same hand-coded HMM as Segmentor.segmentTracks """
+    initprob = NP.array([0.999,0.001])
+    transition = NP.array([[0.99,0.01],[0.01,0.99]])
+    stateparam = [(0,data.std()),(data.mean(),data.std())]
+    return (initprob,transition,stateparam)
+
+def stepwiseDecoding(data, initprob, transition, stateparam):
+    """ Generic per-timestep recurrence (reference) """
+    loglikes = Segmentor.stateLogLikes(data,stateparam)
+    (finalstate,trackback) = Segmentor.viterbiForward(
+        loglikes,NP.log(initprob),NP.log(transition))
+    return Segmentor.followTrackback(finalstate,trackback)
+
+def timeDecoder(decoder, data, params):
+    """ Return wall time (seconds) for decoding data once """
+    start = time.time()
+    decoder(data,*params)
+    return time.time() - start
+
+def main(maxexp=7, maxstepwise=5):
+    NR.seed(0)
+    print('%10s %14s %14s %14s %14s' % ('T','closed (s)','closed (T/s)',
+                                         'checkpt (T/s)','stepwise (T/s)'))
+    for exp in range(3,maxexp+1):
+        T = 10 ** exp
+        data = syntheticTape(T)
+        params = hmmParams(data)
+        fast = timeDecoder(Segmentor.viterbiDecoding,data,params)
+        checkpt = timeDecoder(Segmentor.viterbiCheckpointed,data,params)
+        if(exp <= maxstepwise):
+            slow = '%14.0f' % (T / timeDecoder(stepwiseDecoding,data,params))
+        else:
+            slow = '%14s' % '-'
+        print('%10d %14.3f %14.0f %14.0f %s' % (T, fast, T / fast, 
+                                                T / checkpt, slow))
+
+if __name__ == '__main__':
+    main()
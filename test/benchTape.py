@@ -0,0 +1,219 @@
+"""
+Benchmark the whole segmentation pipeline on full-length synthetic
+tape sides (ToyData.SyntheticTape: 44.1 kHz stereo with hiss, fades,
+crossfade-like dips, quiet passages and varying gaps)
+
+For each tape, every stage (envelope, smoothing, decoding, splitting,
+refinement, export) is timed, its peak (anonymous) memory growth
+measured, and the track boundaries found are scored against the
+ground truth.  Results are written as JSON so that runs of different
+versions can be compared:
+
+python benchTape.py -o new.json                  (30/45/90 min sides)
+python benchTape.py --minutes 5,10 -o quick.json
+python benchTape.py --compare old.json new.json
+
+The tape WAVs (about 10 MB per minute) are generated once and kept
+in --tapedir.  Run from the test directory.
+"""
+import json
+import optparse
+import os, os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as NP
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import Instrument
+import Recorder
+import Segmentor
+import WavFile
+import ToyData
+
+def timeStage(stages, name, items, stage, *args):
+    """ Run stage(*args), record time / memory / throughput """
+    sampler = Instrument.MemorySampler()
+    sampler.start()
+    start = time.time()
+    result = stage(*args)
+    seconds = time.time() - start
+    stages[name] = {'seconds' : seconds,
+                    'peakmb' : sampler.stop(),
+                    'items' : items,
+                    'persec' : items / max(seconds,1e-9)}
+    return result
+
+def boundaryAccuracy(truth, found, rate, tolerance=2.0):
+    """
+    Score found track [start,end) intervals against the true ones:
+    a boundary (start or end) counts as found if one of the same
+    kind lies within tolerance seconds
+    """
+    scores = {}
+    for (col,kind) in [(0,'start'),(1,'end')]:
+        true = NP.asarray(truth)[:,col] / float(rate)
+        got = NP.asarray(found).reshape(-1,2)[:,col] / float(rate)
+        if(len(got) == 0 or len(true) == 0):
+            scores[kind] = {'recall' : 0.0, 'precision' : 0.0,
+                            'meanerror' : None}
+            continue
+        errors = NP.abs(true[:,NP.newaxis] - got[NP.newaxis,:])
+        hits = errors.min(axis=1) <= tolerance
+        scores[kind] = {
+            'recall' : hits.mean(),
+            'precision' : (errors.min(axis=0) <= tolerance).mean(),
+            'meanerror' : (errors.min(axis=1)[hits].mean()
+                           if hits.any() else None)}
+    scores['ntrue'] = len(truth)
+    scores['nfound'] = len(found)
+    return scores
+
+def makeTape(tapedir, minutes, seed=0):
+    """ Generate (once) a synthetic tape side, return (WAV file, runs) """
+    runs = ToyData.tapeRuns(minutes,seed=seed)
+    fn = os.path.join(tapedir,'tape%gmin_seed%d.wav' % (minutes,seed))
+    if(not os.path.exists(fn)):
+        if(not os.path.isdir(tapedir)):
+            os.makedirs(tapedir)
+        recorder = Recorder.DiskRecorder(ToyData.SyntheticTape(runs,seed=seed),
+                                         fn + '.part',chunkframes=1048576)
+        recorder.start()
+        recorder.stop()
+        os.rename(fn + '.part',fn)
+    return (fn,runs)
+
+def exportTracks(frames, intervals, rate):
+    """ Write each track to its own WAV (in a temp dir, then removed) """
+    outdir = tempfile.mkdtemp()
+    try:
+        for (tracknum,(start,end)) in enumerate(intervals):
+            WavFile.copyFrames(frames[int(start):int(end)],
+                               os.path.join(outdir,'track%02d.wav' % tracknum),
+                               rate)
+    finally:
+        shutil.rmtree(outdir)
+
+def benchTape(fn, runs, subrate=20000, tolerance=4.0):
+    """ Run and measure every stage on one tape, return result dict """
+    (rate,frames) = WavFile.mapWav(fn)
+    nframes = len(frames)
+    stages = {}
+    samps = timeStage(stages,'envelope',nframes,
+                      Segmentor.getMonoAmpSamples,fn,subrate)
+    T = len(samps)
+    timeStage(stages,'smooth',T,Segmentor.smoothEnvelope,samps)
+    (initprob,transition,stateparam) = Segmentor.trackHMM(samps.mean(),
+                                                          samps.std())
+    assign = timeStage(stages,'decode',T,Segmentor.viterbiDecoding,
+                       samps,initprob,transition,stateparam)
+    coarse = timeStage(stages,'split',T,Segmentor.splitTrackIntervals,
+                       assign) * subrate
+    refined = timeStage(stages,'refine',nframes,Segmentor.refineTracks,
+                        frames,assign,subrate)
+    exported = sum([min(e,nframes) - s for (s,e) in refined])
+    timeStage(stages,'export',exported,exportTracks,frames,refined,rate)
+    truth = ToyData.runIntervals(runs)
+    return {'file' : os.path.basename(fn),
+            'minutes' : nframes / float(rate) / 60,
+            'frames' : nframes,
+            'stages' : stages,
+            'tolerance' : tolerance,
+            'accuracy' : {'coarse' : boundaryAccuracy(truth,coarse,rate,
+                                                      tolerance),
+                          'refined' : boundaryAccuracy(truth,refined,rate,
+                                                       tolerance)}}
+
+def revision():
+    """ Current git revision of the code being benchmarked (if known) """
+    try:
+        proc = subprocess.Popen(['git','rev-parse','--short','HEAD'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        return proc.communicate()[0].strip() or None
+    except OSError:
+        return None
+
+def printResult(result):
+    print('%s (%.1f min)' % (result['file'],result['minutes']))
+    print('  %-10s %10s %10s %14s' % ('stage','seconds','peak MB','items/s'))
+    for name in ['envelope','smooth','decode','split','refine','export']:
+        stage = result['stages'][name]
+        peak = stage['peakmb']
+        print('  %-10s %10.3f %10s %14.0f' %
+              (name,stage['seconds'],
+               '-' if peak == None else '%.1f' % peak,stage['persec']))
+    for level in ['coarse','refined']:
+        acc = result['accuracy'][level]
+        print('  %-8s starts R=%.2f P=%.2f  ends R=%.2f P=%.2f  (%d/%d tracks)' %
+              (level,acc['start']['recall'],acc['start']['precision'],
+               acc['end']['recall'],acc['end']['precision'],
+               acc['nfound'],acc['ntrue']))
+
+def compare(oldfn, newfn):
+    """ Print per-stage time ratios (new / old) for tapes in both runs """
+    (old,new) = [json.load(open(fn)) for fn in (oldfn,newfn)]
+    print('%s (%s) -> %s (%s)' % (oldfn,old.get('revision'),
+                                  newfn,new.get('revision')))
+    oldtapes = dict([(t['file'],t) for t in old['tapes']])
+    for tape in new['tapes']:
+        if(tape['file'] not in oldtapes):
+            continue
+        before = oldtapes[tape['file']]
+        print(tape['file'])
+        for (name,stage) in sorted(tape['stages'].items()):
+            if(name in before['stages']):
+                was = before['stages'][name]['seconds']
+                print('  %-10s %10.3f -> %10.3f  (x%.2f)' %
+                      (name,was,stage['seconds'],
+                       stage['seconds'] / max(was,1e-9)))
+        for level in ['coarse','refined']:
+            (a,b) = (before['accuracy'][level],tape['accuracy'][level])
+            print('  %-10s start recall %.2f -> %.2f, end recall %.2f -> %.2f' %
+                  (level,a['start']['recall'],b['start']['recall'],
+                   a['end']['recall'],b['end']['recall']))
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--minutes',default='30,45,90',
+                      help='tape side lengths to benchmark [%default]')
+    parser.add_option('--seed',type='int',default=0)
+    parser.add_option('-s','--subrate',type='int',default=20000,
+                      help='samples per envelope block [%default]')
+    parser.add_option('-t','--tolerance',type='float',default=4.0,
+                      help='boundary accuracy tolerance, seconds (the '
+                      'default allows for track padding and fades) '
+                      '[%default]')
+    parser.add_option('--tapedir',default='benchtapes',
+                      help='where to keep the generated tapes [%default]')
+    parser.add_option('-o','--output',default='benchTape.json',
+                      help='JSON results file [%default]')
+    parser.add_option('--compare',nargs=2,metavar='OLD NEW',
+                      help='compare two JSON results files and exit')
+    (options,args) = parser.parse_args(argv)
+    if(options.compare != None):
+        compare(*options.compare)
+        return 0
+    results = {'revision' : revision(),
+               'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+               'python' : platform.python_version(),
+               'numpy' : NP.__version__,
+               'subrate' : options.subrate,
+               'tapes' : []}
+    for minutes in [float(m) for m in options.minutes.split(',')]:
+        (fn,runs) = makeTape(options.tapedir,minutes,options.seed)
+        result = benchTape(fn,runs,options.subrate,options.tolerance)
+        printResult(result)
+        results['tapes'].append(result)
+        # (written after every tape, so partial runs are kept)
+        f = open(options.output,'w')
+        json.dump(results,f,indent=2)
+        f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
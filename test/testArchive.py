@@ -0,0 +1,103 @@
+import unittest
+import json
+import os, os.path
+import shutil
+import stat
+import sys
+import tempfile
+
+import numpy as NP
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import Archive
+import Recorder
+import Segmentor
+import Session
+import WavFile
+import ToyData
+
+# Stand-in for flac: log the command line, copy stdin to the -o file
+fakeflac = """#!/bin/sh
+echo "$@" >> "%(log)s"
+while [ "$1" != "-o" ]; do shift; done
+cat > "$2"
+"""
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        """ Two recorded and segmented sides in a session """
+        self.tmpdir = tempfile.mkdtemp()
+        self.oldpath = os.environ['PATH']
+        self.session = Session.TapeSession(os.path.join(self.tmpdir,
+                                                        'session.json'))
+        subrate = 2000
+        sides = [('music',[('gap',50000),('track',200000),('gap',40000),
+                           ('track',150000),('gap',60000)]),
+                 ('voice',[('gap',30000),('track',100000),('gap',30000)])]
+        for (side,(mode,runs)) in enumerate(sides):
+            capture = os.path.join(self.tmpdir,'capture%d.wav' % side)
+            recorder = Recorder.DiskRecorder(
+                ToyData.SyntheticSource(runs,seed=side),capture)
+            recorder.start()
+            recorder.stop()
+            samps = Segmentor.getMonoAmpSamples(capture,subrate)
+            intervals = Session.sideIntervals(capture,mode,samps,subrate)
+            self.session.putSide(side,capture,mode,intervals,
+                                 confidence=Segmentor.trackConfidence(
+                    samps,intervals,subrate))
+        self.outdir = os.path.join(self.tmpdir,'archive')
+
+    def tearDown(self):
+        os.environ['PATH'] = self.oldpath
+        shutil.rmtree(self.tmpdir)
+
+    def trackFrames(self, track):
+        """ A manifest entry's frames, from the capture """
+        frames = WavFile.mapWav(os.path.join(self.tmpdir,
+                                             track['capture']))[1]
+        return frames[track['start']:track['end']]
+
+    def testArchive(self):
+        """
+        Tracks encoded on a process pool decode back to exactly
+        the capture's frames, and the manifest describes them
+        """
+        archive = Archive.TapeArchive(self.session.sides,self.outdir,
+                                      'zlib',processes=2)
+        archive.start()
+        manifestfn = archive.wait()
+        self.assert_(archive.finished() and archive.wait() == manifestfn)
+        manifest = json.load(open(manifestfn))
+        tracks = manifest['tracks']
+        self.assert_([t['track'] for t in tracks] == [1,2,3])
+        self.assert_([t['side'] for t in tracks] == [1,1,2])
+        self.assert_(all([0.9 < t['confidence'] <= 1 for t in tracks]))
+        for track in tracks:
+            (rate,frames) = Archive.decodeZlib(os.path.join(self.outdir,
+                                                            track['file']))
+            self.assert_(NP.all(frames == self.trackFrames(track)))
+            self.assert_(track['bytes'] < frames.nbytes)
+
+    def testFlac(self):
+        """ The flac encoder gets the raw PCM and the track tags """
+        logfn = os.path.join(self.tmpdir,'flac.log')
+        bindir = os.path.join(self.tmpdir,'bin')
+        os.mkdir(bindir)
+        flac = os.path.join(bindir,'flac')
+        open(flac,'w').write(fakeflac % {'log' : logfn})
+        os.chmod(flac,stat.S_IRWXU)
+        os.environ['PATH'] = bindir + os.pathsep + self.oldpath
+        self.assert_(Archive.defaultEncoder() == 'flac')
+        archive = Archive.TapeArchive(self.session.sides,self.outdir)
+        archive.start()
+        tracks = json.load(open(archive.wait()))['tracks']
+        for track in tracks:
+            pcm = open(os.path.join(self.outdir,track['file']),'rb').read()
+            self.assert_(pcm == self.trackFrames(track).tostring())
+        log = open(logfn).read()
+        self.assert_('-T TRACKNUMBER=3' in log and '-T SIDE=2' in log)
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
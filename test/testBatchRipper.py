@@ -0,0 +1,98 @@
+import unittest
+import json
+import os, os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import BatchRipper
+import Recorder
+import WavFile
+import ToyData
+
+class TestBatchRipper(unittest.TestCase):
+
+    def setUp(self):
+        """ Two synthetic captures (2 tracks, 3 tracks) """
+        self.tmpdir = tempfile.mkdtemp()
+        self.captures = []
+        for (i,ntracks) in enumerate([2,3]):
+            runs = [('gap',50000)]
+            for t in range(ntracks):
+                runs += [('track',150000),('gap',50000)]
+            fn = os.path.join(self.tmpdir,'tape%d.wav' % i)
+            recorder = Recorder.DiskRecorder(
+                ToyData.SyntheticSource(runs,seed=i),fn)
+            recorder.start()
+            recorder.stop()
+            self.captures.append(fn)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testBatch(self):
+        """ Rip captures in a process pool, check summary and tracks """
+        outdir = os.path.join(self.tmpdir,'out')
+        bogus = os.path.join(self.tmpdir,'bogus.wav')
+        open(bogus,'w').write('not a wav file')
+        BatchRipper.main(['-o',outdir,'-s','2000','-j','2'] +
+                         self.captures + [bogus])
+        summary = json.load(open(os.path.join(outdir,'summary.json')))
+        files = summary['files']
+        self.assert_([len(f['tracks']) for f in files[:2]] == [2,3])
+        self.assert_('error' in files[2])
+        for track in files[1]['tracks']:
+            (rate,frames) = WavFile.mapWav(track['file'])
+            self.assert_(len(frames) == track['end'] - track['start'])
+        self.assert_(all(['segment' in f['timings'] for f in files[:2]]))
+
+    def testCue(self):
+        """
+        --cue points the cue sheet at a copy of the capture which
+        ends with the last track (normalized with --normalize)
+        """
+        capture = WavFile.mapWav(self.captures[0])[1]
+        for normalize in [False,True]:
+            outdir = os.path.join(self.tmpdir,'out%d' % normalize)
+            summary = BatchRipper.ripBatch(self.captures[:1],outdir,
+                                           subrate=2000,cue=True,processes=1,
+                                           normalize=normalize)
+            tracks = summary['files'][0]['tracks']
+            self.assert_(len(tracks) == 2 and
+                         all([0 < t['gain'] <= 1 for t in tracks]))
+            copyfn = os.path.join(outdir,'tape0.wav')
+            cue = open(os.path.join(outdir,'tape0.cue')).read()
+            self.assert_(os.path.abspath(copyfn) in cue)
+            copy = WavFile.mapWav(copyfn)[1]
+            self.assert_(len(copy) == tracks[-1]['end'] < len(capture))
+            self.assert_(normalize != (copy == capture[:len(copy)]).all())
+
+    def testMinGap(self):
+        """ --min-gap keeps a short dropout from splitting a track """
+        runs = [('gap',50000),('track',150000),('gap',20000),
+                ('track',150000),('gap',50000)]
+        fn = os.path.join(self.tmpdir,'dropout.wav')
+        recorder = Recorder.DiskRecorder(
+            ToyData.SyntheticSource(runs,seed=0),fn)
+        recorder.start()
+        recorder.stop()
+        outdir = os.path.join(self.tmpdir,'out')
+        for (args,ntracks) in [([],2),(['--min-gap','1'],1)]:
+            BatchRipper.main(['-o',outdir,'-s','2000','-j','1'] + 
+                             args + [fn])
+            summary = json.load(open(os.path.join(outdir,'summary.json')))
+            self.assert_(len(summary['files'][0]['tracks']) == ntracks)
+
+    def testNoTk(self):
+        """ Importing the batch code must not pull in Tk """
+        code = 'import sys, BatchRipper; print(\"Tkinter\" in sys.modules)'
+        out = subprocess.Popen([sys.executable,'-c',code],
+                               stdout=subprocess.PIPE,
+                               cwd=os.path.split(os.getcwd())[0]).communicate()[0]
+        self.assert_(out.strip() == 'False')
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+import unittest
+import os, os.path
+import re
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import CDImage
+import Recorder
+import Segmentor
+import WavFile
+import ToyData
+
+# Stand-in for cdrecord: log the command line and the cue sheet
+fakecdrecord = """#!/bin/sh
+echo "$@" > "%(log)s"
+for arg in "$@"; do
+    case "$arg" in
+        -cuefile=*) cat "${arg#-cuefile=}" >> "%(log)s" ;;
+    esac
+done
+"""
+
+# Stand-in for a slow cdrecord -scanbus / -inq, which only knows
+# about the burner at 1,0,0 (and logs each call)
+slowcdrecord = """#!/bin/sh
+echo "$@" >> "%(log)s"
+case "$1" in
+    -scanbus)
+        sleep %(delay)s
+        echo "scsibus0:"
+        echo "        0,0,0     0) 'ATA     ' 'WDC WD800JD-75MS' '10.0' Disk"
+        echo "scsibus1:"
+        echo "        1,0,0   100) 'PLEXTOR ' 'DVDR   PX-716A  ' '1.11' Removable CD-ROM RW"
+        ;;
+    -inq)
+        [ "$2" = "dev=1,0,0" ] || exit 1
+        echo "Vendor_info    : 'PLEXTOR '"
+        ;;
+esac
+"""
+
+# Stand-in for cdrecord with several burners: 1,0,0 is slow, 2,0,0
+# is fast but fails its first burn, any other drive always fails.
+# The disc in each drive is a file holding its -minfo disk status
+# (none = no disc), a good burn ejects it, a failed one ruins it
+multicdrecord = """#!/bin/sh
+for arg in "$@"; do
+    case "$arg" in
+        -dev=*|dev=*) dev="${arg#*dev=}" ;;
+    esac
+done
+disc="%(log)s.disc$dev"
+if [ "$1" = "-minfo" ]; then
+    [ -e "$disc" ] || { echo "No disk / Wrong disk!"; exit 255; }
+    echo "disk status:              `cat $disc`"
+    exit 0
+fi
+echo "$dev" >> "%(log)s"
+[ "`cat $disc 2>/dev/null`" = "empty" ] || { echo "No disk"; exit 255; }
+case "$dev" in
+    1,0,0) sleep %(slow)s ;;
+    2,0,0)
+        sleep %(fast)s
+        if [ ! -e "%(log)s.2" ]; then
+            touch "%(log)s.2"; echo incomplete > "$disc"; exit 3
+        fi ;;
+    *) echo incomplete > "$disc"; exit 1 ;;
+esac
+printf 'Track 01:    1 of    2 MB written\\rTrack 01:    2 of    2 MB written\\n'
+echo "Fixating..."
+rm "$disc"
+"""
+
+class Operator(threading.Thread):
+    """ Puts a blank CD in any of devs which has none (or a used one) """
+
+    def __init__(self, log, devs, delay=0.05):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        (self.log,self.devs,self.delay) = (log,devs,delay)
+        self.inserted = 0
+        self.running = True
+        self.start()
+
+    def run(self):
+        while(self.running):
+            for dev in self.devs:
+                disc = '%s.disc%s' % (self.log,dev)
+                if(not os.path.exists(disc) or
+                   open(disc).read().strip() != 'empty'):
+                    open(disc,'w').write('empty\n')
+                    self.inserted += 1
+            time.sleep(self.delay)
+
+class TestCDImage(unittest.TestCase):
+
+    def setUp(self):
+        """ Temp dir for capture, cue sheet and fake cdrecord """
+        self.tmpdir = tempfile.mkdtemp()
+        self.oldpath = os.environ['PATH']
+
+    def tearDown(self):
+        os.environ['PATH'] = self.oldpath
+        shutil.rmtree(self.tmpdir)
+
+    def testCueSheetBurn(self):
+        """ 
+        Cue sheet track starts should be frame-aligned and match
+        the segmentation, capture trimmed after the last track,
+        and cdrecord called in DAO mode on the cue sheet
+        """
+        subrate = 2000
+        runs = [('gap',50000),('track',200000),('gap',40000),
+                ('track',150000),('gap',60000)]
+        capture = os.path.join(self.tmpdir,'capture0.wav')
+        recorder = Recorder.DiskRecorder(ToyData.SyntheticSource(runs),
+                                         capture)
+        recorder.start()
+        recorder.stop()
+        samps = Segmentor.getMonoAmpSamples(capture,subrate)
+        trackAssign = Segmentor.segmentTracks(samps)
+        intervals = Segmentor.trackIntervals(trackAssign,subrate)
+        starts = CDImage.trackStarts(intervals)
+        end = CDImage.trackEnd(intervals)
+        self.assert_(all([s % CDImage.framesamples == 0 
+                          for s in starts + [end]]))
+        CDImage.trimCapture(capture,end)
+        self.assert_(WavFile.mapWav(capture)[1].shape[0] == end)
+        cuefn = os.path.join(self.tmpdir,'tracks.cue')
+        CDImage.writeCueSheet(cuefn,capture,starts)
+        # Burn with the fake cdrecord
+        log = os.path.join(self.tmpdir,'cdrecord.log')
+        fake = os.path.join(self.tmpdir,'cdrecord')
+        f = open(fake,'w')
+        f.write(fakecdrecord % {'log' : log})
+        f.close()
+        os.chmod(fake,stat.S_IRWXU)
+        os.environ['PATH'] = self.tmpdir + os.pathsep + self.oldpath
+        self.assert_(CDImage.burnCueSheet('1,0,0',cuefn) == 0)
+        logged = open(log).read()
+        self.assert_('-dao' in logged and '-dev=1,0,0' in logged)
+        self.assert_('-cuefile=%s' % cuefn in logged)
+        # Track INDEX 01 times should be the track starts
+        times = re.findall('INDEX 01 (\\d\\d):(\\d\\d):(\\d\\d)',logged)
+        frames = [(int(m)*60 + int(s))*75 + int(f) for (m,s,f) in times]
+        self.assert_([f*CDImage.framesamples for f in frames] == starts)
+        self.assert_(len(starts) == 2)
+
+    def fakeCdrecord(self, script, **params):
+        """ Put a fake cdrecord first on the PATH, return its log file """
+        params['log'] = os.path.join(self.tmpdir,'cdrecord.log')
+        fake = os.path.join(self.tmpdir,'cdrecord')
+        f = open(fake,'w')
+        f.write(script % params)
+        f.close()
+        os.chmod(fake,stat.S_IRWXU)
+        os.environ['PATH'] = self.tmpdir + os.pathsep + self.oldpath
+        return params['log']
+
+    def testBurnerProbe(self):
+        """
+        Probe runs in the background, device() waits for it; the
+        next probe just re-checks the cached device (no bus scan),
+        and a stale cached device falls back to scanning
+        """
+        log = self.fakeCdrecord(slowcdrecord,delay=0.5)
+        cachefn = os.path.join(self.tmpdir,'burner')
+        probe = CDImage.BurnerProbe(cachefn)
+        start = time.time()
+        probe.start()
+        self.assert_(time.time() - start < 0.25 and not probe.finished())
+        self.assert_(probe.device() == '1,0,0')
+        self.assert_(time.time() - start >= 0.5)
+        self.assert_(open(cachefn).read().strip() == '1,0,0')
+        # Cached
+        probe = CDImage.BurnerProbe(cachefn)
+        start = time.time()
+        probe.start()
+        self.assert_(probe.device() == '1,0,0')
+        self.assert_(time.time() - start < 0.5)
+        calls = open(log).read().splitlines()
+        self.assert_(calls == ['-scanbus','-inq dev=1,0,0'])
+        # Stale cache
+        open(cachefn,'w').write('2,0,0\n')
+        probe = CDImage.BurnerProbe(cachefn)
+        probe.start()
+        self.assert_(probe.device() == '1,0,0')
+        self.assert_(open(log).read().splitlines()[-2:] ==
+                     ['-inq dev=2,0,0','-scanbus'])
+
+    def testBurnQueue(self):
+        """
+        Copies are spread over all drives at once (faster drives
+        burn more), failed copies are retried on any drive, and a
+        drive that keeps failing is given up on
+        """
+        log = self.fakeCdrecord(multicdrecord,slow=0.6,fast=0.1)
+        devs = ['1,0,0','2,0,0','3,0,0']
+        operator = Operator(log,devs)
+        cuefn = os.path.join(self.tmpdir,'tracks.cue')
+        open(cuefn,'w').write('')
+        reports = []
+        queue = CDImage.BurnQueue(cuefn,devs,copies=5,mediapoll=0.05,
+                                  report=lambda dev,text:
+                                      reports.append((dev,text)))
+        start = time.time()
+        self.assert_(queue.run() == 5)
+        self.assert_(time.time() - start < 5 * 0.6)
+        self.assert_(sorted(queue.burned) == range(5) and queue.failed == [])
+        calls = open(log).read().split()
+        self.assert_(calls.count('3,0,0') == 2)
+        self.assert_(calls.count('2,0,0') > calls.count('1,0,0'))
+        self.assert_(queue.progress['3,0,0'] == 'Gave up on this drive')
+        self.assert_(len([r for (dev,r) in reports if
+                          re.match('Copy \\d: Burning track 1: 2 of 2 MB',
+                                   r)]) == 5)
+        self.assert_(len(queue.statusText().splitlines()) == 3)
+        operator.running = False
+        # Nowhere to burn: every copy fails (no endless retrying)
+        queue = CDImage.BurnQueue(cuefn,['3,0,0'],copies=2,retries=5,
+                                  mediapoll=0.05)
+        operator = Operator(log,['3,0,0'])
+        self.assert_(queue.run() == 0 and sorted(queue.failed) == [0,1])
+        operator.running = False
+        queue = CDImage.BurnQueue(cuefn,[],copies=2)
+        self.assert_(queue.run() == 0 and sorted(queue.failed) == [0,1])
+
+    def testBurnQueueMedia(self):
+        """
+        One drive burns every copy, waiting for a blank CD after
+        each (ejected) one; with no CD coming it stops without
+        counting that as a failed burn
+        """
+        log = self.fakeCdrecord(multicdrecord,slow=0.05,fast=0.05)
+        cuefn = os.path.join(self.tmpdir,'tracks.cue')
+        open(cuefn,'w').write('')
+        reports = []
+        operator = Operator(log,['1,0,0'],delay=0.2)
+        queue = CDImage.BurnQueue(cuefn,['1,0,0'],copies=3,mediapoll=0.05,
+                                  report=lambda dev,text:
+                                      reports.append(text))
+        self.assert_(queue.run() == 3 and queue.failed == [])
+        operator.running = False
+        self.assert_(open(log).read().split() == ['1,0,0'] * 3)
+        self.assert_('Copy 2: insert a blank CD' in reports)
+        # Nobody there to change discs
+        time.sleep(0.3)
+        if(os.path.exists(log + '.disc1,0,0')):
+            os.remove(log + '.disc1,0,0')
+        queue = CDImage.BurnQueue(cuefn,['1,0,0'],copies=2,mediapoll=0.05,
+                                  mediatimeout=0.3)
+        self.assert_(queue.run() == 0 and sorted(queue.failed) == [0,1])
+        self.assert_(queue.attempts == {0 : 0, 1 : 0})
+        self.assert_(queue.progress['1,0,0'] == 'No blank CD, stopped')
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
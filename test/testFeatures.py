@@ -0,0 +1,94 @@
+import unittest
+import os, os.path
+import sys
+import tempfile
+
+import numpy as NP
+import numpy.random as NR
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import Features
+import Segmentor
+import WavFile
+
+class TestFeatures(unittest.TestCase):
+
+    def setUp(self):
+        """ Temp file for the capture """
+        (fd,self.fn) = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.fn)
+
+    def testBlockFeatures(self):
+        """
+        Batched features match a block-by-block computation, across
+        chunks and with leftover frames in each block
+        """
+        NR.seed(0)
+        (rate,subrate,size) = (44100,2500,1024)
+        frames = NR.normal(0,2000,(subrate * 7 + 100,2)).astype('<i2')
+        features = Features.blockFeatures(frames,subrate,rate,size,
+                                          chunkblocks=3)
+        self.assert_(features.shape == (7,len(Features.featureNames())))
+        starts = Features.bandBins(rate,size)
+        window = NP.hanning(size)
+        for b in range(7):
+            mono = frames[b*subrate:(b+1)*subrate].astype(NP.float64).mean(axis=1)
+            power = NP.mean([NP.abs(NP.fft.rfft(mono[w*size:(w+1)*size] *
+                                                window))**2
+                             for w in range(subrate // size)],axis=0)
+            ends = list(starts[1:]) + [len(power)]
+            bands = [NP.log10(power[s:e].mean() + 1)
+                     for (s,e) in zip(starts,ends)]
+            self.assert_(NP.allclose(features[b,:len(starts)],bands,rtol=1e-4))
+            ac = power[1:] + 1e-10
+            flatness = NP.exp(NP.log(ac).mean()) / ac.mean()
+            self.assert_(NP.allclose(features[b,-2],flatness,rtol=1e-3))
+            crossings = NP.sum((mono[1:] < 0) != (mono[:-1] < 0))
+            self.assert_(abs(features[b,-1] - crossings / (subrate - 1.0))
+                         < 1e-9)
+        # 1-dim feature vectors give the scalar likelihoods
+        data = features[:,-1]
+        param = [(0.3,0.1),(0.6,0.2)]
+        self.assert_(NP.allclose(Segmentor.stateLogLikes(data[:,NP.newaxis],
+                                                         param),
+                                 Segmentor.stateLogLikes(data,param)))
+
+    def testHissVsTone(self):
+        """
+        Gaps of tape hiss and hum, tracks of quiet tones at the same
+        peak level: the envelope can't split them, the features can
+        """
+        NR.seed(1)
+        rate = 44100
+        runs = [('gap',3),('track',5),('gap',2),('track',4),('gap',3)]
+        parts = []
+        for (kind,seconds) in runs:
+            t = NP.arange(seconds * rate) / float(rate)
+            if(kind == 'gap'):
+                parts.append(NR.normal(0,300,len(t)) +
+                             80 * NP.sin(2 * NP.pi * 60 * t))
+            else:
+                parts.append(1000 * NP.sin(2 * NP.pi * 440 * t) +
+                             400 * NP.sin(2 * NP.pi * 660 * t))
+        mono = NP.concatenate(parts)
+        writer = WavFile.WavWriter(self.fn)
+        writer.write(NP.column_stack((mono,mono)).astype('<i2'))
+        writer.close()
+        subrate = 2205
+        samps = Segmentor.getMonoAmpSamples(self.fn,subrate)
+        self.assert_(len(Segmentor.splitTracks(
+                    Segmentor.decodeTracks(samps))) != 2)
+        features = Features.getFeatures(self.fn,subrate)
+        self.assert_(len(features) == len(samps))
+        assign = Features.decodeFeatureTracks(features)
+        (starts,lengths) = Segmentor.detectRuns(assign)
+        # (0.05 s blocks, true changes at 3, 8, 10, 14 s)
+        self.assert_(len(starts) == 5 and assign[0] == 0)
+        self.assert_(NP.all(NP.abs(starts[1:] - [60,160,200,280]) <= 1))
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import json
+import os, os.path
+import sys
+import tempfile
+
+import numpy as NP
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import Instrument
+import Recorder
+import Segmentor
+import ToyData
+
+class TestInstrument(unittest.TestCase):
+
+    def setUp(self):
+        """ Temp files for the capture and the log """
+        (fd,self.fn) = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        (fd,self.logfn) = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        Instrument.reset()
+
+    def tearDown(self):
+        Instrument.disable()
+        Instrument.reset()
+        os.remove(self.fn)
+        os.remove(self.logfn)
+
+    def segmentCapture(self):
+        """ Record and segment a short synthetic tape """
+        runs = [('gap',50000),('track',200000),('gap',40000),
+                ('track',150000),('gap',60000)]
+        recorder = Recorder.DiskRecorder(ToyData.SyntheticSource(runs),
+                                         self.fn)
+        recorder.start()
+        recorder.stop()
+        samps = Segmentor.getMonoAmpSamples(self.fn,2000)
+        return Segmentor.segmentTracks(samps)
+
+    def testDisabled(self):
+        """ Nothing is recorded by default """
+        self.assert_(len(self.segmentCapture()) == 2)
+        self.assert_(Instrument.records == [])
+        self.assert_(Instrument.counters == {})
+        self.assert_(Instrument.stage('x') is Instrument.nostage)
+
+    def testStages(self):
+        """
+        Envelope and decoder runs are recorded with their input
+        sizes, in memory and in the JSON-lines log
+        """
+        Instrument.enable(self.logfn)
+        self.assert_(len(self.segmentCapture()) == 2)
+        Instrument.disable()
+        stages = [r['stage'] for r in Instrument.records]
+        self.assert_(stages == ['envelope','decode'])
+        envelope = Instrument.records[0]
+        self.assert_(envelope['items'] == 500000)
+        self.assert_(envelope['seconds'] >= 0 and envelope['persec'] > 0)
+        logged = [json.loads(line) for line in open(self.logfn)]
+        self.assert_(logged == Instrument.records)
+        totals = Instrument.report()
+        self.assert_(totals['stages']['decode']['items'] == 250)
+        self.assert_(totals['counters']['record.frames'] == 500000)
+
+    def testFailedStage(self):
+        """ Exceptions pass through but the stage is still recorded """
+        Instrument.enable(trackmemory=False)
+        try:
+            with Instrument.stage('export',10):
+                raise IOError('disk full')
+        except IOError:
+            pass
+        self.assert_(Instrument.records[0]['failed'])
+        self.assert_(Instrument.records[0]['peakmb'] == None)
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
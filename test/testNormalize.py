@@ -0,0 +1,140 @@
+import unittest
+import os, os.path
+import shutil
+import sys
+import tempfile
+
+import numpy as NP
+import numpy.random as NR
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import CDImage
+import Normalize
+import Segmentor
+import Session
+import WavFile
+import ToyData
+
+class TestNormalize(unittest.TestCase):
+
+    def setUp(self):
+        """ Capture with a quiet track and a loud track """
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir,'capture0.wav')
+        runs = [('gap',30000),('track',200000),('gap',40000),
+                ('track',150000),('gap',30000)]
+        self.intervals = ToyData.runIntervals(runs)
+        NR.seed(0)
+        scale = NP.full((sum([r[1] for r in runs]),),20.0)
+        for ((start,end),level) in zip(self.intervals,[500,9000]):
+            scale[start:end] = level
+        frames = NR.normal(0,1,(len(scale),2)) * scale[:,NP.newaxis]
+        writer = WavFile.WavWriter(self.fn)
+        writer.write(NP.clip(frames,-32768,32767).astype('<i2'))
+        writer.close()
+        self.subrate = 2000
+        self.samps = Segmentor.getMonoAmpSamples(self.fn,self.subrate)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testLevels(self):
+        """
+        Both tracks come out at about the same loudness (the gains
+        come from the envelope alone), with faded ends
+        """
+        gains = Normalize.trackGains(self.samps,self.intervals,self.subrate)
+        self.assert_(gains[0] > 1 and gains[1] < 1)
+        (rate,frames) = WavFile.mapWav(self.fn)
+        fade = Normalize.fadeFrames(rate)
+        louds = []
+        for (i,(start,end)) in enumerate(self.intervals):
+            trackfn = os.path.join(self.tmpdir,'track%02d.wav' % i)
+            Normalize.writeTrack(frames[start:end],trackfn,rate,gains[i],
+                                 fade,chunkframes=10000)
+            track = WavFile.mapWav(trackfn)[1]
+            self.assert_(len(track) == end - start)
+            self.assert_(not track[0].any() and not track[-1].any())
+            peaks = Segmentor.getMonoAmpSamples(trackfn,self.subrate)
+            louds.append(NP.percentile(peaks,Normalize.loudpercentile))
+            self.assert_(peaks.max() <= Normalize.ceiling + 1)
+        self.assert_(abs(louds[0] - louds[1]) < 0.05 * louds[1])
+
+    def testStreaming(self):
+        """
+        Chunk size doesn't matter, and audio before the first track is
+        copied as is
+        """
+        gains = Normalize.trackGains(self.samps,self.intervals,self.subrate)
+        (rate,frames) = WavFile.mapWav(self.fn)
+        copies = []
+        for chunkframes in [4321,10**7]:
+            copyfn = os.path.join(self.tmpdir,'copy%d.wav' % chunkframes)
+            Normalize.writeCapture(frames,copyfn,rate,self.intervals,gains,
+                                   441,chunkframes)
+            copies.append(NP.array(WavFile.mapWav(copyfn)[1]))
+        self.assert_(NP.all(copies[0] == copies[1]))
+        self.assert_(len(copies[0]) == len(frames))
+        (start,end) = Normalize.trackSegments(self.intervals,len(frames))[0]
+        self.assert_(NP.all(copies[0][:start] == frames[:start]))
+        self.assert_(not NP.all(copies[0][start:end] == frames[start:end]))
+        # The gap after a track plays as its tail on the CD, so it
+        # gets the same gain
+        gap = slice(self.intervals[0][1] + 1000,self.intervals[1][0] - 1000)
+        self.assert_(NP.all(copies[0][gap] ==
+                            NP.clip(NP.rint(frames[gap].astype(NP.float32) *
+                                            NP.float32(gains[0])),
+                                    -32768,32767)))
+
+    def testOverlap(self):
+        """
+        Tracks padded into each other (a gap shorter than 12 blocks)
+        get each gain exactly once, and the copy keeps its length
+        """
+        segments = Normalize.trackSegments([[0,60000],[40000,100000]],100000)
+        self.assert_(segments == [(0,39984),(39984,100000)])
+        frames = NP.full((100000,2),1000,'<i2')
+        copyfn = os.path.join(self.tmpdir,'overlap.wav')
+        Normalize.writeCapture(frames,copyfn,44100,[[0,60000],[40000,100000]],
+                               [2.0,2.0],0,7000)
+        copy = WavFile.mapWav(copyfn)[1]
+        self.assert_(len(copy) == 100000)
+        self.assert_(NP.all(copy == 2000))
+        # Envelope of a capture with a 2 s gap
+        runs = [('track',200000),('gap',20000),('track',200000)]
+        samps = NP.zeros((sum([r[1] for r in runs]) // self.subrate,))
+        for (start,end) in ToyData.runIntervals(runs):
+            samps[start // self.subrate:end // self.subrate] = 9000
+        intervals = Segmentor.splitTrackIntervals(
+            Segmentor.decodeTracks(samps)) * self.subrate
+        self.assert_(intervals[0][1] > intervals[1][0])
+        segments = Normalize.trackSegments(intervals,len(samps) * self.subrate)
+        self.assert_(segments[0][1] <= segments[1][0])
+
+    def testSessionImage(self):
+        """
+        Session gains are applied in the CD image, and the capture is
+        left alone (so the gains can still be changed or dropped)
+        """
+        session = Session.TapeSession(os.path.join(self.tmpdir,'session.json'))
+        original = NP.array(WavFile.mapWav(self.fn)[1])
+        gains = Normalize.trackGains(self.samps,self.intervals,self.subrate)
+        session.putSide(0,self.fn,'music',self.intervals,gains)
+        cuefn = os.path.join(self.tmpdir,'tracks.cue')
+        session.writeCueSheet(cuefn)
+        end = CDImage.trackEnd(self.intervals)
+        copyfn = os.path.join(self.tmpdir,'copy.wav')
+        Normalize.writeCapture(original[:end],copyfn,44100,self.intervals,
+                               gains,Normalize.fadeFrames(44100))
+        image = WavFile.mapWav(Session.imageFile(cuefn))[1]
+        self.assert_(NP.all(image == WavFile.mapWav(copyfn)[1]))
+        self.assert_(NP.all(WavFile.mapWav(self.fn)[1] == original))
+        # Normalization turned off again
+        session.putSide(0,self.fn,'music',self.intervals)
+        session.writeCueSheet(cuefn)
+        image = WavFile.mapWav(Session.imageFile(cuefn))[1]
+        self.assert_(NP.all(image == original[:end]))
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
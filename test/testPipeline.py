@@ -0,0 +1,160 @@
+import unittest
+import os, os.path
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import CDImage
+import Pipeline
+import Recorder
+import Stages
+import ToyData
+
+# Stand-in for cdrecord: cdrecord -v style progress (rewritten with \r),
+# a burner at any device with a blank CD always in
+fakecdrecord = """#!/bin/sh
+case "$1" in
+    -inq) exit 0 ;;
+    -minfo) echo "disk status:              empty"; exit 0 ;;
+esac
+echo "Starting to write CD/DVD at speed 1 in real DAO mode"
+for mb in 1 2 3; do
+    printf "Track 01:    $mb of    3 MB written (fifo 100%%) [buf  99%%]   1.0x.\\r"
+done
+echo
+echo "Fixating..."
+exit %(status)d
+"""
+
+def collect(pipeline):
+    """ Poll the pipeline like the GUI does until it finishes """
+    messages = []
+    while(True):
+        for message in pipeline.poll():
+            messages.append(message)
+            if(message[0] in ['done','error']):
+                return messages
+        pipeline.wait(0.01)
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        """ Temp dir for capture, cue sheet and fake cdrecord """
+        self.tmpdir = tempfile.mkdtemp()
+        self.oldpath = os.environ['PATH']
+
+    def tearDown(self):
+        os.environ['PATH'] = self.oldpath
+        shutil.rmtree(self.tmpdir)
+
+    def fakeBurner(self, status=0):
+        """ Put a fake cdrecord first on the PATH """
+        fake = os.path.join(self.tmpdir,'cdrecord')
+        f = open(fake,'w')
+        f.write(fakecdrecord % {'status' : status})
+        f.close()
+        os.chmod(fake,stat.S_IRWXU)
+        os.environ['PATH'] = self.tmpdir + os.pathsep + self.oldpath
+
+    def testStages(self):
+        """
+        Stages run in order on a worker thread, each getting the
+        previous stage's result, with progress posted in between
+        """
+        threads = []
+        def double(data, report):
+            threads.append(threading.currentThread())
+            report('doubling %d' % data)
+            return 2 * data
+        pipeline = Pipeline.Pipeline([('a',double),('b',double)])
+        pipeline.start(5)
+        messages = collect(pipeline)
+        self.assert_(messages == [('stage','a',None),
+                                  ('progress','a','doubling 5'),
+                                  ('stage','b',None),
+                                  ('progress','b','doubling 10'),
+                                  ('done',None,20)])
+        self.assert_(threading.currentThread() not in threads)
+
+    def testStageError(self):
+        """ A failing stage stops the pipeline and is reported """
+        ran = []
+        def fail(data, report):
+            raise ValueError('no tracks')
+        def after(data, report):
+            ran.append(data)
+        pipeline = Pipeline.Pipeline([('segment',fail),('export',after)])
+        pipeline.start()
+        messages = collect(pipeline)
+        self.assert_(messages[-1] == ('error','segment',
+                                      'ValueError: no tracks'))
+        self.assert_(len(ran) == 0)
+
+    def testBurnProgress(self):
+        """ cdrecord progress lines -> status text """
+        line = 'Track 02:   12 of  300 MB written (fifo 100%) [buf  99%]   1.0x.'
+        self.assert_(CDImage.burnProgress(line) ==
+                     'Burning track 2: 12 of 300 MB')
+        self.assert_(CDImage.burnProgress('Fixating...') == 'Fixating...')
+        self.assert_(CDImage.burnProgress('scsidev: 1,0,0') == None)
+
+    def testHeadlessRipAndBurn(self):
+        """
+        Record a tape side, FLIP, record the other side, STOP and
+        BURN through the GUI's own stages (Stages.TapeJob), run the
+        way the GUI does it (background thread, polled queue) but
+        without Tk
+        """
+        runs = [('gap',50000),('track',200000),('gap',40000),
+                ('track',150000),('gap',60000)]
+        self.fakeBurner()
+        burnerfn = os.path.join(self.tmpdir,'burner')
+        open(burnerfn,'w').write('1,0,0\n')
+        burner = CDImage.BurnerProbe(burnerfn)
+        burner.start()
+        datadir = os.path.join(self.tmpdir,'data')
+        os.mkdir(datadir)
+        job = Stages.TapeJob(datadir,burner,subrate=2000)
+        job.levels = True
+        def record(side, stages):
+            capture = job.startSide(side)
+            recorder = Recorder.DiskRecorder(
+                ToyData.SyntheticSource(runs,seed=side),capture,
+                meter=job.meter)
+            recorder.start()
+            recorder.stop()
+            pipeline = Pipeline.Pipeline(stages)
+            pipeline.start()
+            return collect(pipeline)[-1]
+        self.assert_(record(0,job.flipStages()) == ('done',None,2))
+        self.assert_(job.samps is None)
+        self.assert_(record(1,job.processingStages()) == ('done',None,4))
+        self.assert_(len(job.session.sides) == 2)
+        pipeline = Pipeline.Pipeline(job.burnStages())
+        pipeline.start()
+        messages = collect(pipeline)
+        self.assert_(messages[-1] == ('done',None,0))
+        progress = [value for (kind,stage,value) in messages
+                    if kind == 'progress']
+        self.assert_(progress[0] == 'Preparing tracks...')
+        self.assert_(progress[-3:] == ['1,0,0: Copy 1: Burning track 1: '
+                                       '3 of 3 MB',
+                                       '1,0,0: Copy 1: Fixating...',
+                                       '1,0,0: Copy 1: done'])
+        # Captures, cue sheet and CD image are gone after the burn
+        self.assert_([fn for fn in os.listdir(datadir)
+                      if fn.endswith('.wav') or fn.endswith('.cue')] == [])
+
+    def testBurnFailure(self):
+        """ cdrecord exit status comes back from the burn """
+        self.fakeBurner(status=3)
+        cuefn = os.path.join(self.tmpdir,'tracks.cue')
+        open(cuefn,'w').close()
+        self.assert_(CDImage.burnCueSheet('1,0,0',cuefn) == 3)
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
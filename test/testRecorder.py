@@ -0,0 +1,91 @@
+import unittest
+import os, os.path
+import sys
+import tempfile
+
+import numpy as NP
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import Recorder
+import Segmentor
+import WavFile
+import ToyData
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        """ Temp file for the capture """
+        (fd,self.fn) = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.fn)
+
+    def testDiskRecording(self):
+        """
+        Streamed capture on disk should hold exactly the frames
+        the source produced, and be readable mid-recording
+        """
+        runs = [('gap',30000),('track',50000),('gap',20000)]
+        source = ToyData.SyntheticSource(runs,readsize=3000)
+        recorder = Recorder.DiskRecorder(source,self.fn,chunkframes=1000)
+        recorder.start()
+        written = recorder.poll()
+        self.assert_(written == 100000)
+        (rate,frames) = WavFile.mapWav(self.fn)
+        self.assert_(rate == 44100 and frames.shape == (100000,2))
+        recorder.stop()
+        # Same frames as generated all in one go
+        reference = ToyData.SyntheticSource(runs,readsize=100000)
+        expected = reference.read(100000)
+        self.assert_(NP.all(WavFile.mapWav(self.fn)[1] == expected))
+
+    def testSegmentCapture(self):
+        """ Segment tracks straight from the capture file """
+        runs = [('gap',50000),('track',200000),('gap',40000),
+                ('track',150000),('gap',60000)]
+        source = ToyData.SyntheticSource(runs,readsize=20000)
+        recorder = Recorder.DiskRecorder(source,self.fn)
+        recorder.start()
+        recorder.stop()
+        samps = Segmentor.getMonoAmpSamples(self.fn,2000)
+        assign = Segmentor.segmentTracks(samps)
+        self.assert_(len(assign) == 2)
+
+    def testLevelMeter(self):
+        """
+        The meter's envelope is exactly getMonoAmpSamples of the
+        capture, and its levels / clip counts cover the most recent
+        frames only (however they were chunked)
+        """
+        runs = [('gap',30000),('track',50000),('gap',25000)]
+        source = ToyData.SyntheticSource(runs,readsize=3001)
+        meter = Recorder.LevelMeter(window=0.1,subrate=2000)
+        recorder = Recorder.DiskRecorder(source,self.fn,chunkframes=1000,
+                                         meter=meter)
+        recorder.start()
+        recorder.poll()
+        head = meter.takeBlocks()
+        recorder.stop()
+        envelope = NP.concatenate((head,meter.takeBlocks()))
+        self.assert_(NP.all(envelope ==
+                            Segmentor.getMonoAmpSamples(self.fn,2000)))
+        # Levels over the last 0.1 s (the gap)
+        frames = WavFile.mapWav(self.fn)[1]
+        recent = frames[-len(meter.ring):].astype(NP.float64)
+        (peak,rms) = meter.levels()
+        self.assert_(NP.all(peak == NP.abs(recent).max(axis=0)))
+        self.assert_(NP.allclose(rms,NP.sqrt((recent**2).mean(axis=0))))
+        self.assert_(peak.max() < 1000 and not meter.clipping())
+        # Clipping on the left channel only
+        loud = NP.zeros((5000,2),'<i2')
+        loud[[100,200,4000],0] = [32767,-32768,32767]
+        meter.push(loud)
+        self.assert_(list(meter.clips) == [3,0] and meter.clipping())
+        meter.push(NP.zeros((44100,2),'<i2'))
+        self.assert_(not meter.clipping())
+        self.assert_(NP.all(meter.levels()[0] == 0))
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
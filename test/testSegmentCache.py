@@ -0,0 +1,98 @@
+import unittest
+import os, os.path
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as NP
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import CDImage
+import Instrument
+import Recorder
+import SegmentCache
+import Segmentor
+import ToyData
+
+class TestSegmentCache(unittest.TestCase):
+
+    def setUp(self):
+        """ Record a short synthetic tape into a temp dir """
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir,'capture0.wav')
+        runs = [('gap',50000),('track',200000),('gap',40000),
+                ('track',150000),('gap',60000)]
+        recorder = Recorder.DiskRecorder(ToyData.SyntheticSource(runs),
+                                         self.fn)
+        recorder.start()
+        recorder.stop()
+        self.cachedir = os.path.join(self.tmpdir,'cache')
+        Instrument.reset()
+        Instrument.enable(trackmemory=False)
+
+    def tearDown(self):
+        Instrument.disable()
+        Instrument.reset()
+        shutil.rmtree(self.tmpdir)
+
+    def testModeSwitch(self):
+        """
+        Same results as Segmentor, and switching voice -> music ->
+        voice only decodes once (envelope read from the capture once)
+        """
+        cache = SegmentCache.SegmentCache(self.cachedir)
+        samps = cache.envelope(self.fn,2000)
+        self.assert_(NP.all(samps == Segmentor.getMonoAmpSamples(self.fn,2000)))
+        voice = cache.voiceIntervals(samps)
+        music = cache.trackIntervals(samps)
+        self.assert_(NP.all(voice == Segmentor.voiceIntervals(samps)))
+        self.assert_(NP.all(music == Segmentor.splitTrackIntervals(
+                    Segmentor.decodeTracks(samps))))
+        self.assert_(Instrument.counters['cache.miss'] == 3)
+        # New cache object on the same dir (e.g. after a restart)
+        cache = SegmentCache.SegmentCache(self.cachedir)
+        samps = cache.envelope(self.fn,2000)
+        self.assert_(NP.all(cache.voiceIntervals(samps) == voice))
+        self.assert_(NP.all(cache.trackIntervals(samps,padding=3) ==
+                            Segmentor.splitTrackIntervals(
+                    Segmentor.decodeTracks(samps),3)))
+        self.assert_(Instrument.counters['cache.miss'] == 3)
+        self.assert_(Instrument.counters['cache.hit'] == 3)
+        # Different parameters are different artifacts
+        cache.envelope(self.fn,1000)
+        self.assert_(Instrument.counters['cache.miss'] == 4)
+
+    def testChangedCapture(self):
+        """ A modified capture gets a new envelope """
+        cache = SegmentCache.SegmentCache(self.cachedir)
+        before = cache.envelope(self.fn,2000)
+        time.sleep(0.01)
+        CDImage.trimCapture(self.fn,300000)
+        after = cache.envelope(self.fn,2000)
+        self.assert_(len(before) == 250 and len(after) == 150)
+        # (the old content hash is an ordinary artifact, nothing else
+        # is left in the cache directory)
+        self.assert_(all([n.endswith('.npy')
+                          for n in os.listdir(self.cachedir)]))
+        cache.maxbytes = 0
+        cache.evict()
+        self.assert_(os.listdir(self.cachedir) == [])
+
+    def testEviction(self):
+        """ Least recently used artifacts go first """
+        cache = SegmentCache.SegmentCache(self.cachedir,maxbytes=2500)
+        samps = cache.envelope(self.fn,2000)
+        for W in [3,5,7]:
+            cache.smoothed(samps,W)
+        stored = [n for n in os.listdir(self.cachedir) if n.endswith('.npy')]
+        size = sum([os.path.getsize(os.path.join(self.cachedir,n))
+                    for n in stored])
+        self.assert_(size <= 2500 and len(stored) == 1)
+        # (the most recent one is kept)
+        self.assert_(cache.load(SegmentCache.digest(
+                    'smoothed',SegmentCache.arrayDigest(samps),7)) is not None)
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
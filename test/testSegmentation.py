@@ -2,6 +2,11 @@ import unittest
 import cPickle as CP
 import os, os.path
 import sys
+import tempfile
+import wave
+
+import numpy as NP
+import numpy.random as NR
 
 sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
 import Segmentor
@@ -49,7 +54,261 @@ class TestSegmentation(unittest.TestCase):
         voicesubsamples = CP.load(open('dummyVoice.p'))
         voicetrack = Segmentor.segmentVoice(voicesubsamples)[0]
         self.assert_(min(voicetrack) == 45 and max(voicetrack) == 104)
-    
+
+    def testClosedFormViterbi(self):
+        """ 
+        Closed-form 2-state decoding should agree with the 
+        generic step-by-step recurrence
+        """
+        NR.seed(0)
+        testruns = [('gap',200),('track',500),('gap',5),('track',300),
+                    ('gap',150),('track',700),('gap',1),('track',40)]
+        data = ToyData.generateData(testruns)
+        data += NR.normal(0,30,data.shape)
+        initprob = NP.array([0.999,0.001])
+        transition = NP.array([[0.99,0.01],[0.01,0.99]])
+        stateparam = [(0,data.std()),(data.mean(),data.std())]
+        loglikes = Segmentor.stateLogLikes(data,stateparam)
+        (finalstate,trackback) = Segmentor.viterbiForward(
+            loglikes,NP.log(initprob),NP.log(transition))
+        reference = Segmentor.followTrackback(finalstate,trackback)
+        assign = Segmentor.viterbiDecoding(data,initprob,
+                                           transition,stateparam)
+        self.assert_(NP.all(assign == reference))
+
+    def testGenericViterbi(self):
+        """ Decode a 3-state HMM (uses generic recurrence) """
+        testruns = [('gap',20),('track',50),('gap',10),('track',30)]
+        data = ToyData.generateData(testruns)
+        data[30:40] = 50
+        initprob = NP.array([0.98,0.01,0.01])
+        transition = NP.array([[0.98,0.01,0.01],
+                               [0.01,0.98,0.01],
+                               [0.01,0.01,0.98]])
+        stateparam = [(0,5),(50,5),(100,5)]
+        assign = Segmentor.viterbiDecoding(data,initprob,
+                                           transition,stateparam)
+        self.assert_(NP.all(assign[2:18] == 0))
+        self.assert_(NP.all(assign[32:38] == 1))
+        self.assert_(NP.all(assign[82:] == 2))
+
+    def testEnvelope(self):
+        """ Block peak / RMS envelope read straight from a WAV file """
+        NR.seed(0)
+        (subrate,nblocks) = (100,37)
+        frames = NR.randint(-32768,32768,(subrate*nblocks+55,2))
+        frames = frames.astype('<i2')
+        frames[3,1] = -32768
+        (fd,fn) = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            wav = wave.open(fn,'wb')
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(44100)
+            wav.writeframes(frames.tostring())
+            wav.close()
+            samps = Segmentor.getMonoAmpSamples(fn,subrate)
+        finally:
+            os.remove(fn)
+        blocks = NP.reshape(frames[:subrate*nblocks].astype(float),
+                            (nblocks,subrate,2))
+        self.assert_(NP.all(samps == NP.abs(blocks).max(axis=1).max(axis=1)))
+        self.assert_(samps[0] == 32768)
+        (peak,rms) = Segmentor.blockLevels(frames,subrate,chunkblocks=5)
+        self.assert_(NP.allclose(rms,NP.sqrt((blocks**2).mean(axis=1))))
+        self.assert_(peak.shape == (nblocks,2))
+
+    def testOnlineSegmentation(self):
+        """ 
+        Online segmentation (fed in blocks) should reproduce 
+        offline segmentTracks, and never hold more than lag
+        uncommitted subsamples
+        """
+        tracksubsamples = CP.load(open('dummyTrack.p'))
+        offline = Segmentor.segmentTracks(tracksubsamples)
+        stateparam = Segmentor.trackHMM(tracksubsamples.mean(),
+                                        tracksubsamples.std())[2]
+        for blocksize in [1,7,50]:
+            online = Segmentor.OnlineSegmentor(stateparam,lag=100)
+            for i in range(0,len(tracksubsamples),blocksize):
+                online.push(tracksubsamples[i:i+blocksize])
+                self.assert_(online.pending.shape[1] <= 100)
+            online.flush()
+            self.assert_(len(online.assignments()) == len(tracksubsamples))
+            self.assert_(online.tracks() == offline)
+
+    def testOnlineEstimated(self):
+        """
+        The GUI's OnlineSegmentor() (emission model estimated as
+        the samples come in, pushed 4 at a time) should still trim
+        a hiss intro like offline segmentTracks does
+        """
+        NR.seed(0)
+        runs = [(300,20),(9000,300),(300,20),(9000,300),(300,20)]
+        data = NP.concatenate([NP.abs(NR.normal(level,0.3*level,n))
+                               for (level,n) in runs])
+        offline = Segmentor.segmentTracks(data)
+        self.assert_(offline[0][0] > 0)
+        online = Segmentor.OnlineSegmentor()
+        for i in range(0,len(data),4):
+            online.push(data[i:i+4])
+        online.flush()
+        self.assert_(online.tracks() == offline)
+        # (real recording: at most 1 subsample off)
+        tracksubsamples = CP.load(open('dummyTrack.p'))
+        online = Segmentor.OnlineSegmentor()
+        for i in range(0,len(tracksubsamples),4):
+            online.push(tracksubsamples[i:i+4])
+        online.flush()
+        offline = Segmentor.decodeTracks(tracksubsamples)
+        self.assert_((online.assignments() != offline).sum() <= 1)
+
+    def testRefineBoundaries(self):
+        """ 
+        Coarse-to-fine refinement should find gap/track transitions
+        to within a few samples (coarse blocks are 20000 samples)
+        """
+        runs = [('gap',123457),('track',900001),('gap',300007),
+                ('track',400009),('gap',300011)]
+        frames = ToyData.SyntheticSource(runs,readsize=10**7).read(10**7)
+        subrate = 20000
+        samps = Segmentor.blockLevels(frames,subrate)[0].max(axis=1)
+        assign = Segmentor.viterbiDecoding(
+            samps,*Segmentor.trackHMM(samps.mean(),samps.std()))
+        truth = NP.cumsum([run[1] for run in runs])[:-1]
+        refined = Segmentor.refineRunStarts(frames,assign,subrate)
+        self.assert_(len(refined) == len(truth))
+        self.assert_(NP.all(NP.abs(refined - truth) < 50))
+        intervals = Segmentor.refineTracks(frames,assign,subrate)
+        self.assert_(intervals.shape == (2,2))
+        # Cut points keep <padding> blocks of gap around each track
+        self.assert_(abs(intervals[1,0] - (truth[2] - 6*subrate)) < 50)
+
+    def testTrackIntervals(self):
+        """ Interval form of splitTracks / segmentVoice """
+        tracksubsamples = CP.load(open('dummyTrack.p'))
+        truth = CP.load(open('trackCorrect.p'))
+        assign = Segmentor.decodeTracks(tracksubsamples)
+        intervals = Segmentor.splitTrackIntervals(assign)
+        self.assert_(intervals.tolist() == [[min(t),max(t)+1] 
+                                            for t in truth])
+        (runStarts,runLengths) = Segmentor.detectRuns([0,0,1,1,1,0,1])
+        self.assert_(runStarts.tolist() == [0,2,5,6])
+        self.assert_(runLengths.tolist() == [2,3,1,1])
+        voicesubsamples = CP.load(open('dummyVoice.p'))
+        self.assert_(Segmentor.voiceIntervals(voicesubsamples).tolist() ==
+                     [[45,105]])
+
+    def testCheckpointedViterbi(self):
+        """ 
+        Memory-bounded checkpointed decoding should be identical
+        to viterbiDecoding (2-state closed form and generic)
+        """
+        NR.seed(1)
+        runs = [('gap',20000),('track',50000),('gap',3),('track',40000),
+                ('gap',10000),('track',30000),('gap',1),('track',123)]
+        data = ToyData.generateData(runs)
+        data += NR.normal(0,30,data.shape)
+        params = Segmentor.trackHMM(data.mean(),data.std())
+        assign = Segmentor.viterbiDecoding(data,*params)
+        for segment in [None,1000,Segmentor.scanblock]:
+            checkpointed = Segmentor.viterbiCheckpointed(data,*params,
+                                                         segment=segment)
+            self.assert_(NP.all(assign == checkpointed))
+        # Packed 2-state trackback follows the same paths
+        for n in [1,9,1001]:
+            kind = NR.randint(0,3,n)
+            trackback = NP.vstack((kind == 2,kind >= 1)).astype(NP.uint8)
+            packed = Segmentor.packTwoState(trackback)
+            maps = Segmentor.backtraceMaps(trackback)
+            for state in [0,1]:
+                self.assert_(NP.all(Segmentor.twoStateBacktrace(
+                    packed,n,state) == maps[state,:]))
+        data = data[:3000] / 2
+        params = (NP.array([0.98,0.01,0.01]),
+                  NP.array([[0.98,0.01,0.01],
+                            [0.01,0.98,0.01],
+                            [0.01,0.01,0.98]]),
+                  [(0,20),(25,20),(50,20)])
+        assign = Segmentor.viterbiDecoding(data,*params)
+        for segment in [None,7,5000]:
+            checkpointed = Segmentor.viterbiCheckpointed(data,*params,
+                                                         segment=segment)
+            self.assert_(NP.all(assign == checkpointed))
+
+    def testBatchViterbi(self):
+        """
+        Batched decoding of padded sequences / parameter sets should
+        match viterbiDecoding row by row (2-state and 3-state)
+        """
+        NR.seed(2)
+        seqs = []
+        for b in range(12):
+            runs = [('gap',NR.randint(1,300)),('track',NR.randint(1,300)),
+                    ('gap',NR.randint(1,10)),('track',NR.randint(1,300))]
+            data = ToyData.generateData(runs[:NR.randint(1,5)])
+            seqs.append(data + NR.normal(0,30,data.shape))
+        lengths = NP.array([len(s) for s in seqs])
+        padded = NP.zeros((len(seqs),lengths.max()))
+        for (b,s) in enumerate(seqs):
+            padded[b,:len(s)] = s
+        hmms = [Segmentor.trackHMM(s.mean(),s.std()+1) for s in seqs]
+        # (some non-sticky, so both batched recurrences get used)
+        for stay in [0.99,0.3]:
+            transition = NP.array([[stay,1-stay],[1-stay,stay]])
+            assign = Segmentor.viterbiBatch(padded,[h[0] for h in hmms],
+                                            transition,
+                                            [h[2] for h in hmms],lengths)
+            for (b,s) in enumerate(seqs):
+                reference = Segmentor.viterbiDecoding(s,hmms[b][0],
+                                                      transition,hmms[b][2])
+                self.assert_(NP.all(assign[b,:len(s)] == reference))
+                self.assert_(not assign[b,len(s):].any())
+        # One sequence under a batch of 3-state parameter sets
+        params = [(NP.array([0.98,0.01,0.01]),
+                   NP.array([[p,(1-p)/2,(1-p)/2],
+                             [(1-p)/2,p,(1-p)/2],
+                             [(1-p)/2,(1-p)/2,p]]),
+                   [(0,30),(50,30),(100,30)]) for p in NP.linspace(0.5,0.99,10)]
+        assign = Segmentor.viterbiBatch(seqs[0],*zip(*params))
+        for (b,p) in enumerate(params):
+            self.assert_(NP.all(assign[b] == 
+                                Segmentor.viterbiDecoding(seqs[0],*p)))
+
+    def testDurationDecoding(self):
+        """
+        Explicit-duration decoding: without limits it is the 
+        Viterbi path (with the same boundaries as viterbiDecoding),
+        and minimum / maximum lengths are respected
+        """
+        NR.seed(3)
+        runs = [('gap',20),('track',50),('gap',10),
+                ('track',30),('gap',3),('track',20),
+                ('gap',15),('track',70),('gap',10),('track',1),('gap',10)]
+        data = ToyData.generateData(runs) + NR.normal(0,20,(239,))
+        (initprob,transition,stateparam) = Segmentor.trackHMM(data.mean(),
+                                                              data.std())
+        transition = NP.array([[0.8,0.2],[0.2,0.8]])
+        exact = Segmentor.viterbiDecoding(data,initprob,transition,
+                                          stateparam)
+        for maxdur in [None,[len(data)] * 2]:
+            assign = Segmentor.durationDecoding(data,initprob,transition,
+                                                stateparam,[1,1],maxdur)
+            self.assert_(NP.all(assign == exact))
+        self.assert_(len(Segmentor.splitTracks(exact,0)) > 3)
+        # Fake gap and fake track are too short to be runs
+        assign = Segmentor.durationDecoding(data,initprob,transition,
+                                            stateparam,[5,5])
+        self.assert_(len(Segmentor.splitTracks(assign,0)) == 3)
+        (starts,lengths) = Segmentor.detectRuns(assign)
+        self.assert_(lengths[1:-1].min() >= 5)
+        # Tracks longer than maxtrack get split
+        assign = Segmentor.durationTracks(data,5,5,maxtrack=40)
+        (starts,lengths) = Segmentor.detectRuns(assign)
+        self.assert_(lengths[assign[starts] == 1].max() <= 40)
+        self.assert_(len(Segmentor.splitTracks(assign,0)) == 6)
+
 # Run the unit tests!
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os, os.path
+import re
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import CDImage
+import Recorder
+import Segmentor
+import Session
+import WavFile
+import ToyData
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        """ Temp dir for the captures, session and cue sheet """
+        self.tmpdir = tempfile.mkdtemp()
+        self.sessionfn = os.path.join(self.tmpdir,'session.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def recordSide(self, side, runs):
+        capture = os.path.join(self.tmpdir,'capture%d.wav' % side)
+        recorder = Recorder.DiskRecorder(ToyData.SyntheticSource(runs,seed=side),
+                                         capture)
+        recorder.start()
+        recorder.stop()
+        return capture
+
+    def testTwoSides(self):
+        """
+        Side one (voice) and side two (music, several tracks) are
+        segmented independently, survive a reload from disk, and
+        end up in one cue sheet numbered across both sides (with one
+        FILE, a CD image of both captures up to their last tracks)
+        """
+        subrate = 2000
+        session = Session.TapeSession(self.sessionfn)
+        sides = [('voice',[('gap',50000),('track',100000),('gap',20000),
+                           ('track',100000),('gap',60000)]),
+                 ('music',[('gap',50000),('track',200000),('gap',40000),
+                           ('track',150000),('gap',40000),
+                           ('track',150000),('gap',60000)])]
+        for (side,(mode,runs)) in enumerate(sides):
+            capture = self.recordSide(side,runs)
+            samps = Segmentor.getMonoAmpSamples(capture,subrate)
+            intervals = Session.sideIntervals(capture,mode,samps,subrate)
+            session.putSide(side,capture,mode,intervals)
+        session = Session.loadSession(self.sessionfn)
+        self.assert_([len(s['intervals']) for s in session.sides] == [1,3])
+        self.assert_(session.ntracks() == 4)
+        cuefn = os.path.join(self.tmpdir,'tracks.cue')
+        session.writeCueSheet(cuefn)
+        cue = open(cuefn).read()
+        self.assert_(len(re.findall('^FILE',cue,re.M)) == 1)
+        self.assert_(re.findall('TRACK (\\d\\d)',cue) == ['01','02','03','04'])
+        # Side two starts right after side one's last track, and its
+        # leading gap is track 2's pregap
+        image = WavFile.mapWav(Session.imageFile(cuefn))[1]
+        ends = [CDImage.trackEnd(side['intervals']) for side in session.sides]
+        self.assert_(len(image) == sum(ends))
+        side2 = WavFile.mapWav(session.sides[1]['capture'])[1]
+        self.assert_((image[ends[0]:] == side2[:ends[1]]).all())
+        times = re.findall('INDEX (\\d\\d) (\\d\\d):(\\d\\d):(\\d\\d)',cue)
+        samples = [(index,((int(m)*60 + int(s))*75 + int(f)) *
+                    CDImage.framesamples) for (index,m,s,f) in times]
+        starts = [ends[0] + start for start in
+                  CDImage.trackStarts(session.sides[1]['intervals'])]
+        self.assert_(samples[-4:] == [('00',ends[0])] +
+                     [('01',start) for start in starts])
+        # Captures left as recorded, so a side can be re-segmented
+        # after a failed burn
+        for (side,(mode,runs)) in enumerate(sides):
+            frames = WavFile.mapWav(session.sides[side]['capture'])[1]
+            self.assert_(len(frames) == sum([n for (kind,n) in runs]))
+        # Re-segmenting the last side replaces it
+        session.putSide(1,session.sides[1]['capture'],'voice',
+                        session.sides[1]['intervals'][:1])
+        self.assert_(Session.loadSession(self.sessionfn).ntracks() == 2)
+        session.clear()
+        self.assert_(not os.path.exists(self.sessionfn))
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import os, os.path
+import sys
+
+sys.path.append(os.path.split(os.path.abspath(os.getcwd()))[0])
+import TuneHMM
+
+class TestTuneHMM(unittest.TestCase):
+
+    def testScoreTracks(self):
+        """ Boundary scoring against a known track split """
+        truth = [range(10,50),range(60,100)]
+        self.assert_(TuneHMM.scoreTracks(truth,truth)['exact'])
+        score = TuneHMM.scoreTracks([range(11,50),range(60,130)],truth)
+        self.assert_(score['recall'] == 0.75 and not score['exact'])
+        score = TuneHMM.scoreTracks([range(10,100)],truth)
+        self.assert_(score['recall'] == 0.5 and score['precision'] == 1.0)
+
+    def testTuneHMM(self):
+        """
+        The hand-coded HMM gets trackCorrect.p exactly right, so it
+        should be among the best grid points
+        """
+        corpus = TuneHMM.loadCorpus(['dummyTrack.p','trackCorrect.p'])
+        grid = TuneHMM.hmmGrid([0.6,0.99],[1.0],[1.0,0.25])
+        results = TuneHMM.tuneHMM(corpus,grid,batchsize=3)
+        self.assert_(len(results) == 4)
+        self.assert_(results[0]['exact'] == 1.0)
+        best = [r['params'] for r in results if r['exact'] == 1.0]
+        self.assert_({'stay' : 0.99, 'trackmean' : 1.0, 'std' : 1.0} in best)
+
+# Run the unit tests!
+if __name__ == '__main__':
+    unittest.main()